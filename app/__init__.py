@@ -8,6 +8,9 @@ from flask_bootstrap import Bootstrap
 from flask_wtf.csrf import CSRFProtect
 import logging
 
+from app.metrics import init_metrics, pool_listener
+from app.query_stats import init_query_stats, query_listener
+
 
 app = Flask(__name__, template_folder='templates')
 app.config.from_object('app.config.Config')
@@ -15,7 +18,11 @@ app.config.from_object('app.config.Config')
 login_manager = LoginManager(app)
 login_manager.login_view = 'admin_login'
 csrf = CSRFProtect(app)
-mongo = PyMongo(app)
+# The listeners count the MongoDB commands of each request and track the connection pool,
+# see app/query_stats.py and app/metrics.py
+mongo = PyMongo(app, event_listeners=[query_listener, pool_listener])
+init_query_stats(app)
+init_metrics(app, mongo_client=mongo.cx)
 logging.basicConfig(level=logging.INFO)
 bootstrap = Bootstrap(app)
 
@@ -27,9 +34,21 @@ if app.config["TESTING"]:
 @login_manager.user_loader
 def load_user(_id):
     from app.models import Patient, Doctor, Admin  # Import here to avoid circular import
-    # Assuming you have a User model with a method like User.get
-    return Patient.get(_id) or Doctor.get(_id) or Admin.get(_id)
+    from app.utils import load_cached_user
+    loaders = {'patient': Patient.get, 'doctor': Doctor.get, 'admin': Admin.get}
+
+    # Session ids are tagged with the role ("admin:alice"), so only one collection is read
+    role, separator, username = _id.partition(':')
+    if separator and role in loaders:
+        return load_cached_user(role, username, loaders[role])
+
+    # Sessions created before ids were tagged hold the bare username
+    for role, loader in loaders.items():
+        user = load_cached_user(role, _id, loader)
+        if user:
+            return user
+    return None
 
 
-from app import routes
+from app import routes, commands
 
@@ -0,0 +1,356 @@
+# Doctor working hours, open appointment slots and booking conflicts.
+# A doctor's weekly schedule is compiled into one bitmap per weekday, with one bit per slot of
+# the day. The open slots of a date range are those bitmaps with the bits of booked appointments
+# cleared, so even a 90-day window costs a single indexed query and a few integer operations per day.
+# Bookings are checked for overlaps against an IntervalIndex of each party's day, while
+# per-day calendar locks keep concurrent bookings of the same doctor or patient apart.
+from bisect import bisect_left, bisect_right
+from contextlib import contextmanager
+from datetime import datetime, time, timedelta, timezone
+from functools import lru_cache
+from time import sleep
+
+from bson import ObjectId
+from pymongo.errors import DuplicateKeyError
+
+from app import mongo
+from app.models import ACTIVE_APPOINTMENT_STATUSES
+
+WEEKDAYS = ('monday', 'tuesday', 'wednesday', 'thursday', 'friday', 'saturday', 'sunday')
+SLOT_DURATIONS = (15, 20, 30, 45, 60)
+
+# Used for doctors who have not set their working hours; days missing from 'hours' are days off
+DEFAULT_SCHEDULE = {
+    'slot_minutes': 30,
+    'hours': {day: [['09:00', '17:00']] for day in WEEKDAYS[:5]},
+}
+
+MAX_AVAILABILITY_DAYS = 90
+
+# A booking holds its calendar locks for at most this long; a lock left behind by a crashed
+# worker is taken over once it has expired
+CALENDAR_LOCK_SECONDS = 10
+# How often, and with what back-off, a booking retries a calendar another booking holds
+CALENDAR_LOCK_ATTEMPTS = 5
+CALENDAR_LOCK_RETRY_SECONDS = 0.02
+
+
+class ScheduleError(ValueError):
+    """Raised when working hours or a slot duration are not valid."""
+
+
+class CalendarBusyError(Exception):
+    """Raised when another booking keeps holding a calendar lock."""
+
+
+def _to_minutes(value):
+    try:
+        hours, minutes = (int(part) for part in value.strip().split(':'))
+    except (AttributeError, ValueError):
+        raise ScheduleError(f'Invalid time "{value}", use HH:MM.')
+    if not (0 <= hours < 24 and 0 <= minutes < 60):
+        raise ScheduleError(f'Invalid time "{value}", use HH:MM.')
+    return hours * 60 + minutes
+
+
+def parse_working_hours(text):
+    """
+    Parse one day of working hours written as "09:00-12:30, 14:00-17:00".
+    Returns:
+        list: [start, end] pairs of "HH:MM" strings; empty for a day off.
+    Raises:
+        ScheduleError: If a period is malformed or ends before it starts.
+    """
+    intervals = []
+    for period in (text or '').split(','):
+        if not period.strip():
+            continue
+        start, separator, end = period.partition('-')
+        if not separator:
+            raise ScheduleError(f'Invalid working hours "{period.strip()}", use HH:MM-HH:MM.')
+        if _to_minutes(start) >= _to_minutes(end):
+            raise ScheduleError(f'Working hours "{period.strip()}" end before they start.')
+        intervals.append([start.strip(), end.strip()])
+    return intervals
+
+
+def format_working_hours(intervals):
+    """Format [start, end] pairs back into the text accepted by parse_working_hours()."""
+    return ', '.join(f'{start}-{end}' for start, end in intervals)
+
+
+def build_schedule(slot_minutes, hours_by_day):
+    """
+    Validate a slot duration and per-day working hours into a doctor's schedule document.
+    Args:
+        slot_minutes (str|int): Length of each appointment slot, one of SLOT_DURATIONS.
+        hours_by_day (dict): Working hours text keyed by weekday name, as parsed by parse_working_hours().
+    Raises:
+        ScheduleError: If the slot duration or any day's hours are not valid.
+    """
+    try:
+        slot_minutes = int(slot_minutes)
+    except (TypeError, ValueError):
+        slot_minutes = None
+    if slot_minutes not in SLOT_DURATIONS:
+        raise ScheduleError(f'Slot duration must be one of {", ".join(map(str, SLOT_DURATIONS))} minutes.')
+
+    hours = {}
+    for day in WEEKDAYS:
+        intervals = parse_working_hours(hours_by_day.get(day))
+        if intervals:
+            hours[day] = intervals
+    return {'slot_minutes': slot_minutes, 'hours': hours}
+
+
+def get_schedule(doctor):
+    """Return a doctor's schedule (from a document or a Doctor), or DEFAULT_SCHEDULE if they have not set one."""
+    schedule = doctor.get('schedule') if isinstance(doctor, dict) else doctor.schedule
+    return schedule or DEFAULT_SCHEDULE
+
+
+@lru_cache(maxsize=1024)
+def _compile(slot_minutes, weekly_hours):
+    bitmaps = []
+    for intervals in weekly_hours:
+        bitmap = 0
+        for start, end in intervals:
+            # Only whole slots that start and end within the period are offered
+            first = -(-_to_minutes(start) // slot_minutes)
+            last = _to_minutes(end) // slot_minutes
+            if last > first:
+                bitmap |= ((1 << (last - first)) - 1) << first
+        bitmaps.append(bitmap)
+    return tuple(bitmaps)
+
+
+def compile_schedule(schedule):
+    """
+    Compile a schedule into per-weekday bitmaps, where bit i is set if the slot starting
+    i * slot_minutes after midnight is within working hours.
+    Returns:
+        tuple: Seven bitmaps, Monday first, matching datetime.weekday().
+    """
+    hours = schedule.get('hours', {})
+    weekly_hours = tuple(tuple(tuple(interval) for interval in hours.get(day, ())) for day in WEEKDAYS)
+    return _compile(schedule['slot_minutes'], weekly_hours)
+
+
+@lru_cache(maxsize=len(SLOT_DURATIONS))
+def _slot_labels(slot_minutes):
+    # "HH:MM - HH:MM" for every slot of the day, in the format the booking form submits
+    labels = []
+    for start in range(0, 24 * 60 - slot_minutes + 1, slot_minutes):
+        end = start + slot_minutes
+        labels.append(f'{start // 60:02d}:{start % 60:02d} - {end // 60:02d}:{end % 60:02d}')
+    return tuple(labels)
+
+
+def _slot_mask(start, end, slot_minutes):
+    # Bits of the slots of start's day that [start, end) overlaps; an appointment without an
+    # end (end == start) still blocks the slot it starts in
+    start_minute = start.hour * 60 + start.minute
+    duration = max(int((end - start).total_seconds() // 60), 1)
+    first = start_minute // slot_minutes
+    last = -(-(start_minute + duration) // slot_minutes)
+    return ((1 << (last - first)) - 1) << first
+
+
+def _set_bits(bitmap):
+    while bitmap:
+        lowest = bitmap & -bitmap
+        yield lowest.bit_length() - 1
+        bitmap ^= lowest
+
+
+def is_open_slot(schedule, start, end):
+    """Return True if [start, end) is exactly one slot within the schedule's working hours."""
+    slot_minutes = schedule['slot_minutes']
+    start_minute = start.hour * 60 + start.minute
+    if start_minute % slot_minutes or end - start != timedelta(minutes=slot_minutes):
+        return False
+    return bool(compile_schedule(schedule)[start.weekday()] >> (start_minute // slot_minutes) & 1)
+
+
+def get_available_slots(doctor, start_date, days, now=None, db=None):
+    """
+    Compute a doctor's open appointment slots over a date range.
+    Slots are taken from the doctor's schedule, minus those overlapped by requested or approved
+    appointments and those that have already started.
+    Args:
+        doctor (dict): The doctor document; only _id and schedule are used.
+        start_date (date): First day of the range.
+        days (int): Number of days in the range, at most MAX_AVAILABILITY_DAYS.
+        now (datetime): The current time, for tests.
+    Returns:
+        dict: 'slot_minutes' and 'slots', a list of "HH:MM - HH:MM" slots keyed by ISO date.
+    """
+    db = db if db is not None else mongo.db
+    days = max(1, min(days, MAX_AVAILABILITY_DAYS))
+    now = now or datetime.now()
+
+    schedule = get_schedule(doctor)
+    slot_minutes = schedule['slot_minutes']
+    weekly = compile_schedule(schedule)
+
+    range_start = datetime.combine(start_date, time.min)
+    booked = [0] * days
+    appointments = db.appointments.find({
+        'doctor_id': doctor['_id'],
+        'status': {'$in': ACTIVE_APPOINTMENT_STATUSES},
+        'start': {'$gte': range_start, '$lt': range_start + timedelta(days=days)},
+    }, {'start': 1, 'end': 1, '_id': 0})
+    for appointment in appointments:
+        start = appointment['start']
+        booked[(start - range_start).days] |= _slot_mask(start, appointment.get('end') or start, slot_minutes)
+
+    labels = _slot_labels(slot_minutes)
+    today = now.date()
+    # Slots of today that start before this mask's first bit have already begun
+    started_today = (1 << -(-(now.hour * 60 + now.minute + (now.second > 0)) // slot_minutes)) - 1
+
+    slots = {}
+    for offset in range(days):
+        day = start_date + timedelta(days=offset)
+        if day < today:
+            open_slots = 0
+        else:
+            open_slots = weekly[day.weekday()] & ~booked[offset]
+            if day == today:
+                open_slots &= ~started_today
+        slots[day.isoformat()] = [labels[i] for i in _set_bits(open_slots)]
+    return {'slot_minutes': slot_minutes, 'slots': slots}
+
+
+class IntervalIndex:
+    """
+    Sorted [start, end) intervals answering overlap queries with a binary search.
+    Intervals may overlap each other (older bookings were never checked), so a running maximum
+    of the end times is kept alongside the sorted start times.
+    """
+
+    def __init__(self, intervals=()):
+        self._intervals = sorted(intervals)
+        self._reindex()
+
+    def _reindex(self):
+        self._starts = [start for start, _ in self._intervals]
+        self._max_ends = []
+        latest = None
+        for _, end in self._intervals:
+            # A plain comparison is several times cheaper than max() on datetimes
+            if latest is None or end > latest:
+                latest = end
+            self._max_ends.append(latest)
+
+    def __len__(self):
+        return len(self._intervals)
+
+    def add(self, start, end):
+        position = bisect_right(self._intervals, (start, end))
+        self._intervals.insert(position, (start, end))
+        self._starts.insert(position, start)
+        self._max_ends.insert(position, max(end, self._max_ends[position - 1]) if position else end)
+        # The running maximum only changes until it reaches an end at least as late as this one
+        for later in range(position + 1, len(self._max_ends)):
+            if self._max_ends[later] >= end:
+                break
+            self._max_ends[later] = end
+
+    def overlaps(self, start, end):
+        """Return True if [start, end) overlaps any interval in the index."""
+        # Only intervals starting before end can overlap; of those, one must end after start
+        candidates = bisect_left(self._starts, end)
+        return candidates > 0 and self._max_ends[candidates - 1] > start
+
+
+def _interval(appointment):
+    start = appointment['start']
+    # Appointments booked without an end time still occupy the minute they start at
+    return start, max(appointment.get('end') or start, start + timedelta(minutes=1))
+
+
+def get_appointment_conflict(doctor_id, patient_id, start, end, db=None):
+    """
+    Check a prospective appointment against the active appointments of its doctor and patient.
+    Both calendars for the day are read in one query, already sorted by start time, and each
+    is indexed with IntervalIndex. Call it within calendar_locks() for the same day so that no
+    concurrent booking can add an overlapping appointment before this one is inserted.
+    Args:
+        doctor_id (ObjectId): The doctor being booked; None to skip the doctor's calendar.
+        patient_id (ObjectId): The patient booking; None to skip the patient's calendar.
+        start (datetime): Start of the appointment.
+        end (datetime): End of the appointment.
+    Returns:
+        str: 'doctor' or 'patient' for whichever calendar already has an overlapping
+        appointment, or None if neither does.
+    """
+    db = db if db is not None else mongo.db
+    parties = {'doctor': doctor_id, 'patient': patient_id}
+    parties = {role: party_id for role, party_id in parties.items() if party_id is not None}
+    if not parties:
+        return None
+
+    day_start = datetime.combine(start.date(), time.min)
+    appointments = db.appointments.find({
+        '$or': [{f'{role}_id': party_id} for role, party_id in parties.items()],
+        'status': {'$in': ACTIVE_APPOINTMENT_STATUSES},
+        # Include the previous day, whose late appointments may run past midnight
+        'start': {'$gte': day_start - timedelta(days=1), '$lt': max(end, start + timedelta(minutes=1))},
+    }, {'doctor_id': 1, 'patient_id': 1, 'start': 1, 'end': 1}, sort=[('start', 1)])
+
+    intervals = {role: [] for role in parties}
+    for appointment in appointments:
+        for role, party_id in parties.items():
+            if appointment.get(f'{role}_id') == party_id:
+                intervals[role].append(_interval(appointment))
+
+    interval = _interval({'start': start, 'end': end})
+    for role, booked in intervals.items():
+        if IntervalIndex(booked).overlaps(*interval):
+            return role
+    return None
+
+
+def _acquire_lock(db, lock_id, owner):
+    for attempt in range(CALENDAR_LOCK_ATTEMPTS):
+        now = datetime.now(timezone.utc)
+        try:
+            db.calendar_locks.insert_one({'_id': lock_id, 'owner': owner,
+                                          'expires_at': now + timedelta(seconds=CALENDAR_LOCK_SECONDS)})
+            return
+        except DuplicateKeyError:
+            # Take over a lock whose holder died; otherwise wait for the holder to finish
+            if not db.calendar_locks.delete_one({'_id': lock_id, 'expires_at': {'$lt': now}}).deleted_count:
+                sleep(CALENDAR_LOCK_RETRY_SECONDS * (attempt + 1))
+    raise CalendarBusyError(f'Calendar {lock_id} is busy')
+
+
+@contextmanager
+def calendar_locks(day, doctor_id=None, patient_id=None, db=None):
+    """
+    Hold the booking locks of a doctor's and a patient's calendars for one day.
+    Bookings of the same doctor or patient on that day run one at a time, so a conflict check
+    made inside the block stays true until the appointment is inserted. Locks are documents
+    with a unique _id in calendar_locks, and are taken in a fixed order to avoid deadlocks.
+    Args:
+        day (date): The day of the appointment being booked.
+        doctor_id (ObjectId): The doctor being booked, if any.
+        patient_id (ObjectId): The patient booking, if any.
+    Raises:
+        CalendarBusyError: If a lock is still held after CALENDAR_LOCK_ATTEMPTS tries.
+    """
+    db = db if db is not None else mongo.db
+    owner = ObjectId()
+    lock_ids = sorted(f'{role}:{party_id}:{day.isoformat()}'
+                      for role, party_id in (('doctor', doctor_id), ('patient', patient_id)) if party_id is not None)
+    held = []
+    try:
+        for lock_id in lock_ids:
+            _acquire_lock(db, lock_id, owner)
+            held.append(lock_id)
+        yield
+    finally:
+        # Only this booking's locks are released, even if one expired and was taken over
+        if held:
+            db.calendar_locks.delete_many({'_id': {'$in': held}, 'owner': owner})
@@ -0,0 +1,86 @@
+# Flask CLI commands for database maintenance, run with `flask --app run <command>`
+import click
+
+from app import app
+
+
+@app.cli.command('create-indexes')
+@click.option('--foreground', is_flag=True, help='Build indexes in the foreground instead of in the background.')
+def create_indexes_command(foreground):
+    """Create the indexes declared in app.models.INDEXES and report any drift."""
+    from app.models import ensure_indexes
+
+    drift = ensure_indexes(background=not foreground)
+    if drift:
+        for collection_name, report in drift.items():
+            click.echo(f"{collection_name}: changed={report['changed']} unexpected={report['unexpected']}")
+    else:
+        click.echo('All indexes match the manifest.')
+
+
+@app.cli.command('check-indexes')
+def check_indexes_command():
+    """Report indexes that are missing, changed or not declared in the manifest."""
+    from app.models import check_indexes
+
+    drift = check_indexes()
+    for collection_name, report in drift.items():
+        click.echo(f"{collection_name}: missing={report['missing']} changed={report['changed']} "
+                   f"unexpected={report['unexpected']}")
+    if not drift:
+        click.echo('All indexes match the manifest.')
+
+
+@app.cli.command('rebuild-busy-dates')
+def rebuild_busy_dates_command():
+    """Recompute the busy_dates collection from the appointments collection."""
+    from app.utils import rebuild_busy_dates
+
+    doctors = rebuild_busy_dates()
+    click.echo(f'Rebuilt busy dates for {doctors} doctors.')
+
+
+@app.cli.command('backfill-image-variants')
+@click.option('--limit', type=int, default=None, help='Process at most this many doctors.')
+def backfill_image_variants_command(limit):
+    """Generate responsive image variants for doctors uploaded before variants existed."""
+    from app.media import backfill_doctor_image_variants
+
+    updated, failed = backfill_doctor_image_variants(limit)
+    click.echo(f'Generated image variants for {updated} doctors ({failed} failed).')
+
+
+@app.cli.command('migrate-appointment-datetimes')
+@click.option('--batch-size', type=int, default=500, help='Appointments converted per bulk write.')
+@click.option('--pause', type=float, default=0.1, help='Seconds to wait between batches.')
+def migrate_appointment_datetimes_command(batch_size, pause):
+    """Add native start/end datetimes to appointments stored with date and time strings only."""
+    from app.utils import migrate_appointment_datetimes
+
+    migrated, skipped = migrate_appointment_datetimes(batch_size, pause, log=click.echo)
+    click.echo(f'Done: {migrated} appointments migrated, {skipped} skipped.')
+
+
+@app.cli.command('seed')
+@click.option('--doctors', type=int, default=1000, show_default=True)
+@click.option('--patients', type=int, default=10000, show_default=True)
+@click.option('--appointments', type=int, default=100000, show_default=True)
+@click.option('--batch-size', type=int, default=10000, show_default=True, help='Documents per insert_many.')
+@click.option('--seed', 'random_seed', type=int, default=0, show_default=True, help='Random generator seed.')
+@click.option('--drop', is_flag=True, help='Delete every doctor, patient and appointment first.')
+def seed_command(doctors, patients, appointments, batch_size, random_seed, drop):
+    """Fill the database with synthetic doctors, patients and appointments (password: "password")."""
+    from app import mongo
+    from app.page_cache import bump_directory_version
+    from app.seed import seed_database
+
+    if drop:
+        click.confirm(f'Delete all doctors, patients and appointments in {mongo.db.name}?', abort=True)
+        for collection_name in ('doctors', 'patients', 'appointments', 'busy_dates'):
+            mongo.db.drop_collection(collection_name)
+
+    counts = seed_database(mongo.db, doctors, patients, appointments, batch_size, random_seed, log=click.echo)
+    # Cached pages and the search index of running workers must pick up the new doctors
+    bump_directory_version()
+    click.echo(f"Inserted {counts['doctors']} doctors, {counts['patients']} patients and "
+               f"{counts['appointments']} appointments.")
@@ -19,7 +19,17 @@ cloudinary.config(
 
 class Config:
     SECRET_KEY = 'asdflkjhg'
-    MONGO_URI = 'mongodb://localhost:27017/AppointmentDB'
+    MONGO_URI = os.environ.get('MONGO_URI', 'mongodb://localhost:27017/AppointmentDB')
+    # Where uploaded images are stored: 'cloudinary', or 'local' to write them under MEDIA_LOCAL_DIR
+    MEDIA_BACKEND = os.environ.get('MEDIA_BACKEND', 'cloudinary')
+    MEDIA_LOCAL_DIR = os.path.join(os.path.dirname(__file__), 'static', 'uploads')
+    MEDIA_LOCAL_URL = '/static/uploads'
+    # Reject request bodies larger than this before reading them
+    MAX_CONTENT_LENGTH = 16 * 1024 * 1024
+    # Send per-request MongoDB query counts in an X-Query-Stats header (always on in debug mode)
+    QUERY_STATS_HEADER = os.environ.get('QUERY_STATS_HEADER') == '1'
+    # Show a toolbar with the page's MongoDB queries at the bottom of HTML pages; debug mode only
+    QUERY_TOOLBAR = os.environ.get('QUERY_TOOLBAR') == '1'
 
 
 
@@ -0,0 +1,240 @@
+# Processing and storage of uploaded profile photos.
+# Decoding, resizing and uploading happen on a background worker pool so the request that
+# accepted the upload can return immediately; the profile's image_url is set once it is done.
+# Stored images are keyed by a hash of their content, so an unchanged photo is never
+# processed or uploaded twice.
+import hashlib
+import io
+import logging
+import os
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+
+import cloudinary.uploader
+from PIL import Image, UnidentifiedImageError
+
+from app import app, mongo
+from app.search import refresh_doctor
+from app.utils import invalidate_cached_user
+
+# How each kind of profile photo is stored: exact size, or bounding box when keep_aspect is set
+PROFILE_IMAGES = {
+    'doctors': {'role': 'doctor', 'size': (369, 445), 'keep_aspect': False},
+    'patients': {'role': 'patient', 'size': (400, 400), 'keep_aspect': True},
+}
+
+# Widths of the responsive variants generated for doctor photos, each as JPEG and WebP
+DOCTOR_IMAGE_VARIANT_WIDTHS = (185, 369, 738)
+IMAGE_VARIANT_FORMATS = {'jpeg': 'jpg', 'webp': 'webp'}
+
+# Uploads beyond these limits are rejected in the request, before any processing or upload
+MAX_IMAGE_BYTES = 10 * 1024 * 1024
+MAX_IMAGE_DIMENSION = 8000
+
+MEDIA_WORKERS = 4
+
+_executor = ThreadPoolExecutor(max_workers=MEDIA_WORKERS, thread_name_prefix='media')
+
+
+class ImageRejectedError(ValueError):
+    """Raised when an upload is not an image or exceeds the size or dimension limits."""
+
+
+class LocalStorage:
+    """Stores files under a directory served as static files; used in development and tests."""
+
+    def __init__(self, directory, base_url):
+        self.directory = directory
+        self.base_url = base_url
+
+    def save(self, key, data, extension='jpg'):
+        filename = f'{key}.{extension}'
+        os.makedirs(self.directory, exist_ok=True)
+        with open(os.path.join(self.directory, filename), 'wb') as f:
+            f.write(data)
+        return f'{self.base_url}/{filename}'
+
+
+class CloudinaryStorage:
+    """Stores files on Cloudinary under their content key."""
+
+    def save(self, key, data, extension='jpg'):
+        result = cloudinary.uploader.upload(io.BytesIO(data), public_id=key, overwrite=False,
+                                            resource_type='image', format=extension)
+        return result.get('secure_url')
+
+
+def get_storage():
+    """Return the storage backend selected by the MEDIA_BACKEND setting."""
+    if app.config.get('MEDIA_BACKEND', 'cloudinary') == 'local':
+        return LocalStorage(app.config['MEDIA_LOCAL_DIR'], app.config['MEDIA_LOCAL_URL'])
+    return CloudinaryStorage()
+
+
+def content_key(data, *variant):
+    """Hash data together with the processing parameters that produced (or will produce) it."""
+    digest = hashlib.sha256(data)
+    for part in variant:
+        digest.update(repr(part).encode('utf-8'))
+    return digest.hexdigest()
+
+
+def get_stored_url(key):
+    """Return the URL of a file stored earlier under key, or None. Works for every backend."""
+    stored = mongo.db.media.find_one({'_id': key})
+    return stored['url'] if stored else None
+
+
+def store_file(key, data, extension='jpg'):
+    """
+    Store a file under its content key and record its URL in the media collection.
+    Returns:
+        str: The public URL of the file.
+    """
+    url = get_storage().save(key, data, extension)
+    mongo.db.media.update_one({'_id': key}, {'$set': {'url': url}}, upsert=True)
+    return url
+
+
+def validate_image(raw_bytes):
+    """
+    Check an upload against MAX_IMAGE_BYTES and MAX_IMAGE_DIMENSION.
+    Only the image header is parsed, so this is cheap enough to run in the request.
+    Raises:
+        ImageRejectedError: If the upload is not an acceptable image.
+    """
+    if len(raw_bytes) > MAX_IMAGE_BYTES:
+        raise ImageRejectedError(f'Images must be smaller than {MAX_IMAGE_BYTES // (1024 * 1024)} MB.')
+    try:
+        width, height = Image.open(io.BytesIO(raw_bytes)).size
+    except (UnidentifiedImageError, Image.DecompressionBombError):
+        raise ImageRejectedError('The uploaded file is not a supported image.')
+    if width > MAX_IMAGE_DIMENSION or height > MAX_IMAGE_DIMENSION:
+        raise ImageRejectedError(f'Images must be at most {MAX_IMAGE_DIMENSION} pixels wide and high.')
+
+
+def resize_image(raw_bytes, size, keep_aspect=False, image_format='jpeg'):
+    """
+    Decode an image and resize it, returning JPEG (or image_format) bytes.
+    Large JPEGs are decoded in draft mode, which lets libjpeg scale them down by up to 8x
+    while decoding instead of materialising the full-resolution bitmap first.
+    Args:
+        raw_bytes (bytes): The uploaded image.
+        size (tuple): Target (width, height).
+        keep_aspect (bool): Fit within size instead of resizing to exactly size.
+        image_format (str): 'jpeg' or 'webp'.
+    """
+    img = Image.open(io.BytesIO(raw_bytes))
+    img.draft('RGB', size)
+    img = img.convert('RGB')
+    if keep_aspect:
+        img.thumbnail(size)
+    else:
+        img = img.resize(size)
+
+    output = io.BytesIO()
+    img.save(output, format=image_format.upper(), quality=85)
+    return output.getvalue()
+
+
+def generate_doctor_image_variants(raw_bytes):
+    """
+    Store the responsive variants of a doctor photo, reusing any stored before.
+    Each width in DOCTOR_IMAGE_VARIANT_WIDTHS keeps the aspect ratio of the main doctor photo
+    and is produced in every format in IMAGE_VARIANT_FORMATS. Widths beyond the source's are
+    skipped, as upscaling adds bytes but no detail; the smallest width is always produced.
+    Returns:
+        list: Dicts with the 'width', 'format' and 'url' of each variant, for the image_variants field.
+    """
+    base_width, base_height = PROFILE_IMAGES['doctors']['size']
+    source_width = Image.open(io.BytesIO(raw_bytes)).width
+    widths = [width for width in DOCTOR_IMAGE_VARIANT_WIDTHS if width <= source_width] \
+        or [min(DOCTOR_IMAGE_VARIANT_WIDTHS)]
+    variants = []
+    for width in widths:
+        size = (width, round(width * base_height / base_width))
+        for image_format, extension in IMAGE_VARIANT_FORMATS.items():
+            key = content_key(raw_bytes, size, image_format)
+            url = get_stored_url(key) or store_file(key, resize_image(raw_bytes, size, image_format=image_format),
+                                                    extension)
+            variants.append({'width': width, 'format': image_format, 'url': url})
+    return variants
+
+
+def _process_profile_image(collection_name, document_id, raw_bytes, key):
+    spec = PROFILE_IMAGES[collection_name]
+    try:
+        # An identical upload (by anyone) is reused without processing or uploading it again
+        image_url = get_stored_url(key) or store_file(key, resize_image(raw_bytes, spec['size'],
+                                                                        spec['keep_aspect']))
+        update = {'image_url': image_url, 'image_hash': key}
+        if collection_name == 'doctors':
+            update['image_variants'] = generate_doctor_image_variants(raw_bytes)
+        mongo.db[collection_name].update_one({'_id': document_id}, {'$set': update})
+    except Exception as e:
+        logging.error('Failed to process profile image for %s %s: %s', collection_name, document_id, e)
+        raise
+
+    invalidate_cached_user(spec['role'])
+    if collection_name == 'doctors':
+        refresh_doctor(document_id)
+    return image_url
+
+
+def submit_profile_image(collection_name, profile, upload):
+    """
+    Validate an uploaded profile photo and queue it for resizing and upload.
+    Args:
+        collection_name (str): 'doctors' or 'patients'.
+        profile (Patient|Doctor): The profile; its image_url is set when processing finishes.
+        upload (FileStorage): The uploaded file.
+    Returns:
+        Future: Resolves to the new image URL, or None if the photo is unchanged.
+    Raises:
+        ImageRejectedError: If the upload is not an acceptable image.
+    """
+    raw_bytes = upload.read(MAX_IMAGE_BYTES + 1)
+    validate_image(raw_bytes)
+
+    spec = PROFILE_IMAGES[collection_name]
+    key = content_key(raw_bytes, spec['size'], spec['keep_aspect'])
+    if profile.image_hash == key:
+        return None
+    return _executor.submit(_process_profile_image, collection_name, profile._id, raw_bytes, key)
+
+
+def read_image_url(image_url):
+    """Fetch the bytes of a stored image, reading local uploads straight from disk."""
+    local_url = app.config['MEDIA_LOCAL_URL'] + '/'
+    if image_url.startswith(local_url):
+        with open(os.path.join(app.config['MEDIA_LOCAL_DIR'], image_url[len(local_url):]), 'rb') as f:
+            return f.read()
+    with urllib.request.urlopen(image_url, timeout=30) as response:
+        return response.read(MAX_IMAGE_BYTES + 1)
+
+
+def backfill_doctor_image_variants(limit=None):
+    """
+    Generate image_variants for doctors that have a photo but no variants yet.
+    Args:
+        limit (int): Stop after this many doctors.
+    Returns:
+        tuple: Number of doctors updated and number that failed.
+    """
+    query = {'image_url': {'$nin': [None, '']}, 'image_variants': {'$exists': False}}
+    doctors = mongo.db.doctors.find(query, {'image_url': 1})
+    if limit:
+        doctors = doctors.limit(limit)
+
+    updated = failed = 0
+    for doctor in doctors:
+        try:
+            variants = generate_doctor_image_variants(read_image_url(doctor['image_url']))
+        except Exception as e:
+            logging.warning('Could not generate image variants for doctor %s: %s', doctor['_id'], e)
+            failed += 1
+            continue
+        mongo.db.doctors.update_one({'_id': doctor['_id']}, {'$set': {'image_variants': variants}})
+        refresh_doctor(doctor['_id'])
+        updated += 1
+    return updated, failed
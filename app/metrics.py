@@ -0,0 +1,233 @@
+# In-process metrics registry, exposed in the Prometheus text format at /metrics.
+# Request latency is recorded in fixed-bucket histograms per endpoint, method and status code;
+# bookings, logins and approvals are counted; and a PyMongo pool listener keeps gauges of the
+# MongoDB connection pool. Each worker process keeps its own numbers, so scrape every worker.
+import threading
+from bisect import bisect_left
+from time import perf_counter
+
+from flask import Response, g, request
+from pymongo import monitoring
+
+# Upper bounds, in seconds, of the request latency histogram buckets
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+
+def _escape(value):
+    return str(value).replace('\\', r'\\').replace('"', r'\"').replace('\n', r'\n')
+
+
+def _labels(names, values):
+    if not names:
+        return ''
+    return '{' + ','.join(f'{name}="{_escape(value)}"' for name, value in zip(names, values)) + '}'
+
+
+def _number(value):
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class _Metric:
+    type = None
+
+    def __init__(self, name, documentation, labels=()):
+        self.name = name
+        self.documentation = documentation
+        self.labels = tuple(labels)
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def _check(self, label_values):
+        if len(label_values) != len(self.labels):
+            raise ValueError(f'{self.name} takes labels {self.labels}, got {label_values}')
+
+    def samples(self):
+        """Yield (name suffix, label names, label values, value) for every series."""
+        with self._lock:
+            series = list(self._series.items())
+        for label_values, value in sorted(series):
+            yield '', self.labels, label_values, value
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.documentation}', f'# TYPE {self.name} {self.type}']
+        for suffix, names, values, value in self.samples():
+            lines.append(f'{self.name}{suffix}{_labels(names, values)} {_number(value)}')
+        return '\n'.join(lines)
+
+
+class Counter(_Metric):
+    type = 'counter'
+
+    def inc(self, *label_values, amount=1):
+        self._check(label_values)
+        with self._lock:
+            self._series[label_values] = self._series.get(label_values, 0) + amount
+
+
+class Gauge(_Metric):
+    type = 'gauge'
+
+    def set(self, value, *label_values):
+        self._check(label_values)
+        with self._lock:
+            self._series[label_values] = value
+
+    def inc(self, *label_values, amount=1):
+        self._check(label_values)
+        with self._lock:
+            self._series[label_values] = self._series.get(label_values, 0) + amount
+
+    def dec(self, *label_values, amount=1):
+        self.inc(*label_values, amount=-amount)
+
+
+class Histogram(_Metric):
+    type = 'histogram'
+
+    def __init__(self, name, documentation, labels=(), buckets=LATENCY_BUCKETS):
+        super().__init__(name, documentation, labels)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value, *label_values):
+        # Only the bucket the value falls in is incremented; render() makes the counts cumulative
+        index = bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(label_values)
+            if series is None:
+                self._check(label_values)
+                series = self._series[label_values] = [[0] * (len(self.buckets) + 1), 0.0]
+            series[0][index] += 1
+            series[1] += value
+
+    def samples(self):
+        with self._lock:
+            series = [(label_values, list(counts), total) for label_values, (counts, total) in self._series.items()]
+        names = self.labels + ('le',)
+        for label_values, counts, total in sorted(series):
+            cumulative = 0
+            for bound, count in zip(self.buckets + ('+Inf',), counts):
+                cumulative += count
+                yield '_bucket', names, label_values + (bound,), cumulative
+            yield '_sum', self.labels, label_values, total
+            yield '_count', self.labels, label_values, cumulative
+
+
+class MetricsRegistry:
+    """The metrics of one process, in registration order."""
+
+    def __init__(self):
+        self._metrics = {}
+
+    def _register(self, metric):
+        if metric.name in self._metrics:
+            raise ValueError(f'Metric {metric.name} is already registered')
+        self._metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name, documentation, labels=()):
+        return self._register(Counter(name, documentation, labels))
+
+    def gauge(self, name, documentation, labels=()):
+        return self._register(Gauge(name, documentation, labels))
+
+    def histogram(self, name, documentation, labels=(), buckets=LATENCY_BUCKETS):
+        return self._register(Histogram(name, documentation, labels, buckets))
+
+    def render(self):
+        """Every metric in the Prometheus text exposition format."""
+        return '\n'.join(metric.render() for metric in self._metrics.values()) + '\n'
+
+
+registry = MetricsRegistry()
+
+request_duration = registry.histogram('http_request_duration_seconds', 'Time spent handling requests.',
+                                      ('endpoint', 'method', 'status'))
+bookings = registry.counter('appointment_bookings_total', 'Appointment booking attempts by outcome.', ('result',))
+logins = registry.counter('logins_total', 'Login attempts by role and outcome.', ('role', 'result'))
+approvals = registry.counter('approvals_total', 'Approved registrations and appointments.', ('kind',))
+pool_connections = registry.gauge('mongo_pool_connections', 'Open connections in the MongoDB pool.', ('address',))
+pool_in_use = registry.gauge('mongo_pool_connections_in_use', 'MongoDB connections checked out of the pool.',
+                             ('address',))
+pool_max_size = registry.gauge('mongo_pool_max_size', 'Maximum size of each MongoDB connection pool.')
+pool_checkout_failures = registry.counter('mongo_pool_checkout_failures_total',
+                                          'MongoDB connection checkouts that failed, by reason.',
+                                          ('address', 'reason'))
+
+
+def _address(event):
+    host, port = event.address
+    return f'{host}:{port}'
+
+
+class PoolListener(monitoring.ConnectionPoolListener):
+    """Keeps the MongoDB pool gauges up to date."""
+
+    def pool_created(self, event):
+        pass
+
+    def pool_ready(self, event):
+        pass
+
+    def pool_cleared(self, event):
+        pass
+
+    def pool_closed(self, event):
+        pass
+
+    def connection_created(self, event):
+        pool_connections.inc(_address(event))
+
+    def connection_ready(self, event):
+        pass
+
+    def connection_closed(self, event):
+        pool_connections.dec(_address(event))
+
+    def connection_check_out_started(self, event):
+        pass
+
+    def connection_check_out_failed(self, event):
+        pool_checkout_failures.inc(_address(event), event.reason)
+
+    def connection_checked_out(self, event):
+        pool_in_use.inc(_address(event))
+
+    def connection_checked_in(self, event):
+        pool_in_use.dec(_address(event))
+
+
+pool_listener = PoolListener()
+
+
+def init_metrics(app, metrics_registry=registry, duration=request_duration, mongo_client=None):
+    """
+    Time every request of the app and serve the registry at /metrics.
+    Args:
+        app (Flask): The application.
+        metrics_registry (MetricsRegistry): The registry to serve.
+        duration (Histogram): Receives request latencies, labelled by endpoint, method and status.
+        mongo_client (MongoClient): Its pool size is exported; the client must have been created with
+            pool_listener among its event_listeners for the other pool gauges.
+    """
+    if mongo_client is not None:
+        pool_max_size.set(mongo_client.options.pool_options.max_pool_size)
+
+    @app.before_request
+    def start_timer():
+        g.request_started = perf_counter()
+
+    @app.after_request
+    def record_duration(response):
+        started = g.get('request_started')
+        if started is not None:
+            # Unmatched URLs share one label, so scanners cannot create unbounded series
+            endpoint = request.url_rule.endpoint if request.url_rule else 'unmatched'
+            duration.observe(perf_counter() - started, endpoint, request.method, str(response.status_code))
+        return response
+
+    def metrics():
+        return Response(metrics_registry.render(), content_type=CONTENT_TYPE)
+
+    app.add_url_rule('/metrics', 'metrics', metrics)
@@ -1,9 +1,158 @@
-from flask_login import UserMixin
+import logging
+from datetime import datetime
+
+from pymongo import ASCENDING, DESCENDING, TEXT, IndexModel
 
 from app import mongo
 
 
-class Patient(UserMixin):
+class Model:
+    """
+    Base of the document models: compact __slots__ objects hydrated straight from MongoDB documents.
+    Subclasses list their stored fields in `fields` (with defaults for missing keys in `defaults`) and
+    large, rarely shown fields in `lazy_fields`, which are read from the database on first access
+    unless the document they were hydrated from already held them. Assignments are tracked, so
+    to_document() returns only what changed since the document was read.
+    """
+    __slots__ = ('_id', '_changed')
+    collection = None
+    fields = ()
+    lazy_fields = ()
+    defaults = {}
+
+    def __init_subclass__(cls, **kwargs):
+        super().__init_subclass__(**kwargs)
+        # The slot descriptors' setters, so hydration skips attribute lookup and change tracking
+        cls._field_setters = tuple((getattr(cls, name).__set__, name, cls.defaults.get(name)) for name in cls.fields)
+        cls._lazy_setters = tuple((getattr(cls, name).__set__, name) for name in cls.lazy_fields)
+        cls._tracked = frozenset(cls.fields + cls.lazy_fields)
+
+    def __new__(cls, *args, **kwargs):
+        instance = object.__new__(cls)
+        object.__setattr__(instance, '_id', None)
+        object.__setattr__(instance, '_changed', None)
+        return instance
+
+    @classmethod
+    def from_document(cls, document):
+        """Build an instance from a MongoDB document without marking any field as changed."""
+        instance = object.__new__(cls)
+        get = document.get
+        _set_id(instance, get('_id'))
+        _set_changed(instance, None)
+        for set_field, name, default in cls._field_setters:
+            set_field(instance, get(name, default))
+        for set_field, name in cls._lazy_setters:
+            if name in document:
+                set_field(instance, document[name])
+        return instance
+
+    @classmethod
+    def find_one(cls, query, projection=None):
+        """Read one document from the model's collection; returns None if there is no match."""
+        document = mongo.db[cls.collection].find_one(query, projection)
+        return cls.from_document(document) if document else None
+
+    def __getattr__(self, name):
+        # Only called for slots that are not set, i.e. lazy fields that were not read yet
+        if name in type(self).lazy_fields and self._id is not None:
+            self._load_lazy_fields()
+            return object.__getattribute__(self, name)
+        raise AttributeError(f'{type(self).__name__!r} object has no attribute {name!r}')
+
+    def _load_lazy_fields(self):
+        lazy_fields = type(self).lazy_fields
+        document = mongo.db[self.collection].find_one({'_id': self._id}, {name: 1 for name in lazy_fields}) or {}
+        for name in lazy_fields:
+            if not self._is_loaded(name):
+                object.__setattr__(self, name, document.get(name, []))
+
+    def _is_loaded(self, name):
+        try:
+            object.__getattribute__(self, name)
+        except AttributeError:
+            return False
+        return True
+
+    def __setattr__(self, name, value):
+        if name in self._tracked:
+            try:
+                unchanged = object.__getattribute__(self, name) == value
+            except AttributeError:
+                unchanged = False
+            if not unchanged:
+                if self._changed is None:
+                    object.__setattr__(self, '_changed', set())
+                self._changed.add(name)
+        object.__setattr__(self, name, value)
+
+    def to_document(self):
+        """
+        The fields to write: every loaded field of a new instance, or only the fields assigned a
+        different value since the instance was read from the database.
+        """
+        if self._id is None:
+            names = self.fields + self.lazy_fields
+        else:
+            names = self._changed or ()
+        return {name: object.__getattribute__(self, name) for name in names if self._is_loaded(name)}
+
+    def save(self):
+        """
+        Insert a new instance, or $set the fields changed since it was read.
+        Returns:
+            bool: True if anything was written.
+        """
+        document = self.to_document()
+        if self._id is None:
+            object.__setattr__(self, '_id', mongo.db[self.collection].insert_one(document).inserted_id)
+        elif document:
+            mongo.db[self.collection].update_one({'_id': self._id}, {'$set': document})
+        else:
+            return False
+        object.__setattr__(self, '_changed', None)
+        return True
+
+
+_set_id = Model._id.__set__
+_set_changed = Model._changed.__set__
+
+
+class User(Model):
+    """A model that can be logged in with Flask-Login; provides what flask_login.UserMixin would."""
+    __slots__ = ()
+    # Prefix of the session id, so the user loader knows which collection to read
+    role = None
+    # Users loaded for a session do not need their password hash or lazy fields
+    session_projection = {'password': 0}
+
+    is_active = True
+    is_authenticated = True
+    is_anonymous = False
+
+    def get_id(self):
+        return f'{self.role}:{self.username}'
+
+    @classmethod
+    def get(cls, username):
+        return cls.find_one({'username': username}, cls.session_projection)
+
+    def __eq__(self, other):
+        if isinstance(other, User):
+            return self.get_id() == other.get_id()
+        return NotImplemented
+
+    __hash__ = object.__hash__
+
+
+class Patient(User):
+    fields = ('username', 'first_name', 'last_name', 'date_of_birth', 'gender', 'phone_number', 'password',
+              'address', 'image_url', 'image_hash', 'blood_group', 'email', 'registration_status')
+    defaults = {'registration_status': 'pending'}
+    __slots__ = fields
+    collection = 'patients'
+    role = 'patient'
+
     def __init__(self, username, first_name, last_name, date_of_birth, gender,
                  phone_number, password, address, image_url=None, blood_group=None, email=None,
                  registration_status='pending'):
@@ -15,39 +164,29 @@ class Patient(UserMixin):
         self.phone_number = phone_number
         self.password = password  # Make sure to hash the password before storing it
         self.address = address
-        self.image_url = image_url  # New field for the patient's image URL
-        self.blood_group = blood_group  # New field for the patient's blood group
+        self.image_url = image_url
+        self.image_hash = None
+        self.blood_group = blood_group
         self.email = email
         self.registration_status = registration_status
 
-    def get_id(self):
-        return self.username
-
-    @staticmethod
-    def get(username):
-        patient_data = mongo.db.patients.find_one({'username': username})
-        if patient_data:
-            return Patient(
-                username=patient_data['username'],
-                first_name=patient_data['first_name'],
-                last_name=patient_data['last_name'],
-                date_of_birth=patient_data['date_of_birth'],
-                gender=patient_data['gender'],
-                phone_number=patient_data['phone_number'],
-                password=patient_data['password'],  # Assuming this is already hashed
-                address=patient_data['address'],
-                image_url=patient_data.get('image_url'),  # Use .get for optional fields
-                blood_group=patient_data.get('blood_group'),
-                email=patient_data.get('email')
-            )
-        return None
-
-
-class Doctor(UserMixin):
+
+class Doctor(User):
+    fields = ('username', 'first_name', 'last_name', 'date_of_birth', 'gender', 'phone_number', 'password',
+              'email', 'address', 'hospital', 'specialty', 'registration_status', 'image_url', 'image_hash',
+              'image_variants', 'biography', 'schedule')
+    # Only the profile settings page shows these
+    lazy_fields = ('education', 'experience', 'registration')
+    defaults = {'registration_status': 'pending'}
+    __slots__ = fields + lazy_fields
+    collection = 'doctors'
+    role = 'doctor'
+    session_projection = {'password': 0, 'education': 0, 'experience': 0, 'registration': 0}
+
     def __init__(self, username, first_name, last_name, date_of_birth, gender,
                  phone_number, password, address, hospital, specialty,
                  registration_status='pending', image_url=None, biography=None,
-                 education=None, experience=None, registration=None):
+                 education=None, experience=None, registration=None, schedule=None):
         self.username = username
         self.first_name = first_name
         self.last_name = last_name
@@ -55,85 +194,192 @@ class Doctor(UserMixin):
         self.date_of_birth = date_of_birth
         self.phone_number = phone_number
         self.password = password
+        self.email = None
         self.address = address
         self.hospital = hospital
         self.specialty = specialty
         self.registration_status = registration_status
         self.image_url = image_url
+        self.image_hash = None
+        self.image_variants = None
         self.biography = biography
         self.education = education or []  # List of education records
         self.experience = experience or []  # List of experience records
         self.registration = registration or []  # List of registration records
+        self.schedule = schedule  # Working hours and slot duration; None means the default schedule
+
+
+class Admin(User):
+    fields = ('username', 'password')
+    __slots__ = fields
+    collection = 'admins'
+    role = 'admin'
 
-    def get_id(self):
-        return self.username
-
-    @staticmethod
-    def get(username):
-        doctor_data = mongo.db.doctors.find_one({'username': username})
-        if doctor_data:
-            return Doctor(
-                username=doctor_data['username'],
-                first_name=doctor_data['first_name'],
-                last_name=doctor_data['last_name'],
-                date_of_birth=doctor_data['date_of_birth'],
-                gender=doctor_data['gender'],
-                phone_number=doctor_data['phone_number'],
-                password=doctor_data['password'],  # Make sure to hash the password before storing it
-                address=doctor_data['address'],
-                hospital=doctor_data['hospital'],
-                specialty=doctor_data['specialty'],
-                registration_status=doctor_data.get('registration_status', 'pending'),
-                image_url=doctor_data.get('image_url'),
-                biography=doctor_data.get('biography'),
-                education=doctor_data.get('education', []),
-                experience=doctor_data.get('experience', []),
-                registration=doctor_data.get('registration', [])
-            )
-        return None
-
-
-class Admin(UserMixin):
     def __init__(self, username):
         self.username = username
+        self.password = None
 
-    def get_id(self):
-        return self.username
 
-    @staticmethod
-    def get(username):
-        # Fetch admin data from MongoDB and create an Admin instance
-        admin_data = mongo.db.admins.find_one({'username': username})
-        if admin_data:
-            return Admin(username=admin_data['username'])
-        return None
+def parse_appointment_slot(date, time):
+    """
+    Turn an appointment's date ("2024-04-27") and time ("09:00 - 12:30") into start and end datetimes.
+    The datetimes are naive wall-clock times, stored as-is in BSON. A time without an end gives end == start.
+    Raises:
+        ValueError: If the date or time is not in the expected format.
+    """
+    start_time, _, end_time = time.partition(' - ')
+    start = datetime.strptime(f"{date} {start_time.strip()}", "%Y-%m-%d %H:%M")
+    end = datetime.strptime(f"{date} {end_time.strip()}", "%Y-%m-%d %H:%M") if end_time else start
+    return start, end
 
 
-class Appointment:
-    def __init__(self, patient_id, doctor_id, date, time, status='requested'):
+class Appointment(Model):
+    fields = ('patient_id', 'doctor_id', 'date', 'time', 'start', 'end', 'status')
+    defaults = {'status': 'requested'}
+    __slots__ = fields
+    collection = 'appointments'
+
+    def __init__(self, patient_id, doctor_id, date, time, status='requested', start=None, end=None):
         self.patient_id = patient_id
         self.doctor_id = doctor_id
         self.date = date
         self.time = time
         self.status = status
+        # Native datetimes for range queries and display; date and time are kept for the slot index
+        if start is None:
+            start, end = parse_appointment_slot(date, time)
+        self.start = start
+        self.end = end
+
+
+# Appointments in these statuses hold their doctor's slot; cancelled ones free it again
+ACTIVE_APPOINTMENT_STATUSES = ['requested', 'approved']
 
-    @staticmethod
-    def from_dict(appointment_data):
-        return Appointment(
-            patient_id=appointment_data['patient_id'],
-            doctor_id=appointment_data['doctor_id'],
-            date=appointment_data['date'],
-            time=appointment_data['time'],
-            status=appointment_data.get('status', 'requested')
-        )
-
-    def to_dict(self):
-        return {
-            'patient_id': self.patient_id,
-            'doctor_id': self.doctor_id,
-            'date': self.date,
-            'time': self.time,
-            'status': self.status
+
+def _fields(*names):
+    return {name: 1 for name in names}
+
+
+# Fields each kind of view renders, keyed by view name. Every find/find_one and join that feeds
+# a page passes one of these, so pages never read password hashes or profile arrays they do not show.
+PROJECTIONS = {
+    # Doctor cards: the homepage, search results, booking pages, dashboard headers and admin lists
+    'doctor_card': _fields('username', 'first_name', 'last_name', 'gender', 'specialty', 'hospital', 'address',
+                           'image_url', 'image_variants', 'registration_status', 'ratings', 'availability',
+                           'fee_range'),
+    # The doctor's own profile settings form; also used to persist schedule and image changes
+    'doctor_profile': {'password': 0},
+    # Patients next to their appointments, in admin lists and on their own dashboard
+    'patient_summary': _fields('username', 'first_name', 'last_name', 'gender', 'date_of_birth', 'phone_number',
+                               'email', 'address', 'image_url', 'registration_status'),
+    'patient_profile': {'password': 0},
+    # Appointment lists; patient and doctor details are joined in separately
+    'appointment_row': _fields('patient_id', 'doctor_id', 'date', 'time', 'start', 'end', 'status'),
+    # What the login forms need to verify a password and pick where to redirect
+    'credentials': _fields('username', 'password', 'registration_status'),
+}
+
+# Indexes every collection is expected to have, keyed by collection name.
+# ensure_indexes() creates anything missing and reports drift from this manifest.
+INDEXES = {
+    'appointments': [
+        IndexModel([('doctor_id', ASCENDING), ('date', ASCENDING), ('time', ASCENDING)], name='doctor_date_time'),
+        # At most one active appointment per doctor slot, enforced by the server for reserve_appointment_slot()
+        IndexModel([('doctor_id', ASCENDING), ('date', ASCENDING), ('time', ASCENDING)], name='doctor_slot_unique',
+                   unique=True, partialFilterExpression={'status': {'$in': ACTIVE_APPOINTMENT_STATUSES}}),
+        IndexModel([('doctor_id', ASCENDING), ('start', ASCENDING)], name='doctor_start'),
+        IndexModel([('patient_id', ASCENDING), ('start', ASCENDING)], name='patient_start'),
+        IndexModel([('start', ASCENDING)], name='start'),
+        IndexModel([('status', ASCENDING), ('_id', DESCENDING)], name='status_id'),
+    ],
+    'patients': [
+        IndexModel([('phone_number', ASCENDING)], name='phone_number'),
+        IndexModel([('username', ASCENDING)], name='username'),
+        IndexModel([('registration_status', ASCENDING), ('_id', DESCENDING)], name='registration_status_id'),
+    ],
+    'doctors': [
+        IndexModel([('phone_number', ASCENDING)], name='phone_number'),
+        IndexModel([('username', ASCENDING)], name='username'),
+        IndexModel([('registration_status', ASCENDING), ('_id', DESCENDING)], name='registration_status_id'),
+        IndexModel([('first_name', TEXT), ('last_name', TEXT), ('specialty', TEXT)], name='doctor_text'),
+    ],
+    'admins': [
+        IndexModel([('username', ASCENDING)], name='username'),
+    ],
+    'calendar_locks': [
+        # Removes locks left behind by crashed workers; bookings also take over expired locks themselves
+        IndexModel([('expires_at', ASCENDING)], name='expires_at_ttl', expireAfterSeconds=0),
+    ],
+}
+
+# Index options that change behaviour and therefore count as drift when they differ
+_COMPARED_OPTIONS = ('unique', 'sparse', 'partialFilterExpression', 'expireAfterSeconds')
+
+
+def _index_signature(index):
+    """Normalise an index description (manifest or server side) into a comparable tuple."""
+    key = dict(index['key'])
+    if TEXT in key.values() or '_fts' in key:
+        # The server stores text indexes as {_fts, _ftsx} and lists the fields under weights
+        fields = index.get('weights') or {field: 1 for field, kind in key.items() if kind == TEXT}
+        key_signature = ('text', tuple(sorted(fields)))
+    else:
+        key_signature = tuple(key.items())
+    options = tuple((option, index.get(option)) for option in _COMPARED_OPTIONS if index.get(option))
+    return key_signature, options
+
+
+def check_indexes(db=None):
+    """
+    Compare the indexes on the database with the INDEXES manifest.
+    Args:
+        db: The database to inspect, defaults to mongo.db.
+    Returns:
+        dict: Per collection, the 'missing', 'changed' and 'unexpected' index names.
+              Collections without drift are left out.
+    """
+    db = db if db is not None else mongo.db
+    drift = {}
+    for collection_name, models in INDEXES.items():
+        existing = {index['name']: index for index in db[collection_name].list_indexes()}
+        existing.pop('_id_', None)
+        expected = {model.document['name']: model.document for model in models}
+
+        report = {
+            'missing': sorted(name for name in expected if name not in existing),
+            'changed': sorted(name for name in expected
+                              if name in existing
+                              and _index_signature(expected[name]) != _index_signature(existing[name])),
+            'unexpected': sorted(name for name in existing if name not in expected),
         }
+        if any(report.values()):
+            drift[collection_name] = report
+    return drift
+
 
+def ensure_indexes(db=None, background=False):
+    """
+    Create any index from the INDEXES manifest that does not exist yet and log the remaining drift.
+    Indexes whose definition changed are reported but never dropped automatically.
+    Args:
+        db: The database to update, defaults to mongo.db.
+        background (bool): Build the indexes without blocking the collection (for live databases).
+    Returns:
+        dict: The drift left after creating the missing indexes, as returned by check_indexes().
+    """
+    db = db if db is not None else mongo.db
+    for collection_name, report in check_indexes(db).items():
+        missing = [model for model in INDEXES[collection_name] if model.document['name'] in report['missing']]
+        if missing:
+            if background:
+                missing = [IndexModel(list(model.document['key'].items()), background=True,
+                                      **{k: v for k, v in model.document.items() if k != 'key'})
+                           for model in missing]
+            db[collection_name].create_indexes(missing)
+            logging.info('Created indexes on %s: %s', collection_name, ', '.join(report['missing']))
 
+    drift = check_indexes(db)
+    for collection_name, report in drift.items():
+        logging.warning('Index drift on %s: changed=%s unexpected=%s',
+                        collection_name, report['changed'], report['unexpected'])
+    return drift
@@ -0,0 +1,125 @@
+# Cache of rendered public pages and page fragments that depend only on the doctor directory.
+# Entries are keyed by route, query arguments and the directory version. Every change to the
+# directory bumps the version, so outdated entries are never looked up again and are dropped.
+# The version lives in MongoDB so a change made through one worker reaches the others within
+# DIRECTORY_VERSION_TTL_SECONDS.
+import sys
+import threading
+from collections import OrderedDict
+from time import monotonic
+
+from markupsafe import Markup
+from pymongo import ReturnDocument
+from werkzeug.datastructures import MultiDict
+
+from app import mongo
+
+PAGE_CACHE_MAX_BYTES = 32 * 1024 * 1024
+PAGE_CACHE_MAX_ENTRIES = 1000
+# How long a worker trusts its copy of the directory version before reading it again
+DIRECTORY_VERSION_TTL_SECONDS = 5
+
+DIRECTORY_VERSION_ID = 'doctor_directory'
+
+
+class PageCache:
+    """Thread-safe LRU cache of rendered HTML, bounded by entry count and by total size."""
+
+    def __init__(self, max_bytes, max_entries):
+        self.max_bytes = max_bytes
+        self.max_entries = max_entries
+        self.size = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, key):
+        """Return the cached HTML for key, or None."""
+        with self._lock:
+            html = self._entries.get(key)
+            if html is not None:
+                self._entries.move_to_end(key)
+            return html
+
+    def set(self, key, html):
+        size = sys.getsizeof(html)
+        # A page that would fill most of the cache on its own is not worth evicting everything for
+        if size > self.max_bytes // 4:
+            return
+        with self._lock:
+            previous = self._entries.pop(key, None)
+            if previous is not None:
+                self.size -= sys.getsizeof(previous)
+            self._entries[key] = html
+            self.size += size
+            while self.size > self.max_bytes or len(self._entries) > self.max_entries:
+                _, evicted = self._entries.popitem(last=False)
+                self.size -= sys.getsizeof(evicted)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.size = 0
+
+
+page_cache = PageCache(max_bytes=PAGE_CACHE_MAX_BYTES, max_entries=PAGE_CACHE_MAX_ENTRIES)
+
+_version_lock = threading.Lock()
+_directory_version = None
+_version_checked_at = 0.0
+
+
+def _set_version(version):
+    global _directory_version, _version_checked_at
+    with _version_lock:
+        if version != _directory_version:
+            # Entries of other versions can no longer be hit; free their memory now
+            page_cache.clear()
+        _directory_version = version
+        _version_checked_at = monotonic()
+
+
+def get_directory_version():
+    """Return the doctor directory version, reading it from MongoDB at most every DIRECTORY_VERSION_TTL_SECONDS."""
+    if _directory_version is None or monotonic() - _version_checked_at > DIRECTORY_VERSION_TTL_SECONDS:
+        counter = mongo.db.counters.find_one({'_id': DIRECTORY_VERSION_ID})
+        _set_version(counter['version'] if counter else 0)
+    return _directory_version
+
+
+def bump_directory_version():
+    """
+    Mark the doctor directory as changed, invalidating every cached page and fragment.
+    Returns:
+        int: The new directory version.
+    """
+    counter = mongo.db.counters.find_one_and_update({'_id': DIRECTORY_VERSION_ID}, {'$inc': {'version': 1}},
+                                                    upsert=True, return_document=ReturnDocument.AFTER)
+    _set_version(counter['version'])
+    return counter['version']
+
+
+def _cache_key(name, args):
+    items = args.items(multi=True) if isinstance(args, MultiDict) else (args or {}).items()
+    return name, tuple(sorted(items)), get_directory_version()
+
+
+def cached_html(name, args, render):
+    """
+    Return the HTML of a page or fragment from the cache, rendering and caching it on a miss.
+    Args:
+        name (str): The route or fragment name.
+        args (MultiDict|dict): The query arguments the HTML depends on.
+        render (callable): Renders the HTML; called only on a miss.
+    Returns:
+        tuple: The HTML as Markup, and True if it came from the cache.
+    """
+    key = _cache_key(name, args)
+    html = page_cache.get(key)
+    if html is not None:
+        return Markup(html), True
+    html = render()
+    page_cache.set(key, html)
+    return Markup(html), False
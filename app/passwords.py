@@ -0,0 +1,118 @@
+# Password hashing off the request thread.
+# pbkdf2 is deliberately slow, so hashes are computed in a bounded process pool: a burst of
+# logins queues up there (up to a limit) instead of pinning the CPU of every web worker.
+import logging
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor, TimeoutError as FutureTimeoutError
+
+from werkzeug.security import DEFAULT_PBKDF2_ITERATIONS, check_password_hash, generate_password_hash
+
+# Method used for new hashes; never fewer iterations than Werkzeug's own default
+PASSWORD_HASH_ITERATIONS = max(1_000_000, DEFAULT_PBKDF2_ITERATIONS)
+PASSWORD_HASH_METHOD = f'pbkdf2:sha256:{PASSWORD_HASH_ITERATIONS}'
+# pbkdf2 digests at least as strong as sha256; hashes with any other digest are upgraded
+_STRONG_PBKDF2_DIGESTS = {'sha256', 'sha384', 'sha512', 'sha3_256', 'sha3_384', 'sha3_512'}
+
+HASH_POOL_WORKERS = os.cpu_count() or 1
+# Hashing jobs allowed to be queued or running before new requests are turned away
+HASH_QUEUE_LIMIT = HASH_POOL_WORKERS * 8
+HASH_TIMEOUT_SECONDS = 10
+
+_pool = None
+_pool_lock = threading.Lock()
+_queue_slots = threading.BoundedSemaphore(HASH_QUEUE_LIMIT)
+
+
+class HashingBusyError(Exception):
+    """Raised when the hashing pool is saturated or a hash did not finish in time."""
+
+
+def _get_pool():
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = ProcessPoolExecutor(max_workers=HASH_POOL_WORKERS)
+        return _pool
+
+
+def _submit(function, *args):
+    if not _queue_slots.acquire(blocking=False):
+        raise HashingBusyError('Too many password hashing requests queued')
+    try:
+        future = _get_pool().submit(function, *args)
+    except Exception:
+        _queue_slots.release()
+        raise
+    future.add_done_callback(lambda _: _queue_slots.release())
+    return future
+
+
+def _run(function, *args):
+    future = _submit(function, *args)
+    try:
+        return future.result(timeout=HASH_TIMEOUT_SECONDS)
+    except FutureTimeoutError:
+        future.cancel()
+        raise HashingBusyError('Password hashing timed out')
+
+
+def hash_password(password):
+    """Hash a password in the hashing pool with PASSWORD_HASH_METHOD."""
+    return _run(generate_password_hash, password, PASSWORD_HASH_METHOD)
+
+
+def verify_password(stored_hash, password):
+    """Check a password against a stored hash in the hashing pool."""
+    return _run(check_password_hash, stored_hash, password)
+
+
+def needs_rehash(stored_hash):
+    """
+    Return True if a stored hash is weaker than PASSWORD_HASH_METHOD.
+    pbkdf2 hashes are upgraded when their digest is weaker than sha256 or they use fewer
+    iterations; scrypt hashes are kept, and hashes in any other format are replaced.
+    """
+    method = stored_hash.split('$', 1)[0]
+    algorithm, _, params = method.partition(':')
+    if algorithm == 'scrypt':
+        return False
+    if algorithm != 'pbkdf2':
+        return True
+    digest, _, iterations = params.partition(':')
+    try:
+        # Werkzeug falls back to its default when the method names no iteration count
+        iterations = int(iterations or DEFAULT_PBKDF2_ITERATIONS)
+    except ValueError:
+        return True
+    return digest not in _STRONG_PBKDF2_DIGESTS or iterations < PASSWORD_HASH_ITERATIONS
+
+
+def rehash_if_outdated(stored_hash, password, save):
+    """
+    Upgrade an outdated hash after a successful login without delaying the response.
+    Args:
+        stored_hash (str): The hash the password was just verified against.
+        password (str): The verified plain-text password.
+        save (callable): Called with the new hash once it has been computed.
+    Returns:
+        bool: True if a rehash was scheduled.
+    """
+    if not needs_rehash(stored_hash):
+        return False
+    try:
+        future = _submit(generate_password_hash, password, PASSWORD_HASH_METHOD)
+    except HashingBusyError:
+        # Busy right now; the hash is upgraded on a later login
+        return False
+
+    def _save(done):
+        if done.cancelled() or done.exception() is not None:
+            return
+        try:
+            save(done.result())
+        except Exception as e:
+            logging.error('Failed to store rehashed password: %s', e)
+
+    future.add_done_callback(_save)
+    return True
@@ -0,0 +1,163 @@
+# Per-request MongoDB query instrumentation.
+# A PyMongo command listener records the commands each request issues: how many, how long the
+# server took, how many documents came back and how often each query shape was repeated.
+# Requests over the thresholds, and shapes repeated more than QUERY_REPEAT_THRESHOLD times
+# (usually a find_one in a loop), are logged. The numbers are also sent in an X-Query-Stats
+# header and, in development, shown in a toolbar at the bottom of every page.
+import json
+import logging
+import threading
+from collections import Counter
+from contextvars import ContextVar
+
+from flask import g, render_template, request
+from pymongo import monitoring
+
+# Requests issuing more commands, or spending longer in MongoDB, than this are logged
+SLOW_REQUEST_COMMANDS = 50
+SLOW_REQUEST_DB_MS = 250
+# A query shape issued more often than this in one request is logged as a likely N+1
+QUERY_REPEAT_THRESHOLD = 5
+TOOLBAR_SHAPES = 10
+
+STATS_HEADER = 'X-Query-Stats'
+
+# Where each query command keeps its filter; other commands (getMore, hello, ...) get no shape
+_SHAPED_FIELDS = {'find': 'filter', 'aggregate': 'pipeline', 'count': 'query', 'distinct': 'query',
+                  'findAndModify': 'query', 'update': 'updates', 'delete': 'deletes', 'insert': None}
+
+# Stats of the request being handled; fetch_concurrently() carries it into its worker threads
+_current_stats = ContextVar('query_stats', default=None)
+
+
+def _shape(value):
+    # Keep field names and operators, replace values; lists of values collapse to a single '?'
+    if isinstance(value, dict):
+        return {key: _shape(item) for key, item in value.items()}
+    if isinstance(value, (list, tuple)):
+        shapes = []
+        for item in value:
+            if isinstance(item, dict):
+                shape = _shape(item)
+                if shape not in shapes:
+                    shapes.append(shape)
+        return shapes or '?'
+    return '?'
+
+
+def query_shape(command_name, command):
+    """
+    Describe a command independently of its values, e.g. 'find doctors {"_id": "?"}'.
+    Returns:
+        str: The shape, or None for commands that are not queries.
+    """
+    if command_name not in _SHAPED_FIELDS:
+        return None
+    field = _SHAPED_FIELDS[command_name]
+    shape = json.dumps(_shape(command.get(field)), sort_keys=True) if field else ''
+    return f'{command_name} {command.get(command_name)} {shape}'.rstrip()
+
+
+def _returned_documents(reply):
+    cursor = reply.get('cursor')
+    if cursor:
+        return len(cursor.get('firstBatch') or cursor.get('nextBatch') or ())
+    return 1 if reply.get('value') else 0
+
+
+class QueryStats:
+    """The MongoDB commands issued while handling one request."""
+
+    def __init__(self):
+        self.commands = 0
+        self.db_ms = 0.0
+        self.documents = 0
+        self.shapes = Counter()
+        # Concurrent dashboard queries report from several threads
+        self._lock = threading.Lock()
+
+    def started(self, shape):
+        with self._lock:
+            self.commands += 1
+            if shape is not None:
+                self.shapes[shape] += 1
+
+    def finished(self, duration_micros, documents=0):
+        with self._lock:
+            self.db_ms += duration_micros / 1000
+            self.documents += documents
+
+    def repeated(self, threshold=QUERY_REPEAT_THRESHOLD):
+        """The shapes issued more than threshold times, most repeated first, with their counts."""
+        return [(shape, count) for shape, count in self.shapes.most_common() if count > threshold]
+
+    def header(self):
+        return (f'commands={self.commands}; db_ms={self.db_ms:.1f}; documents={self.documents}; '
+                f'repeated={len(self.repeated())}')
+
+
+class QueryListener(monitoring.CommandListener):
+    """Adds every command issued during a request to that request's QueryStats."""
+
+    def started(self, event):
+        stats = _current_stats.get()
+        if stats is not None:
+            stats.started(query_shape(event.command_name, event.command))
+
+    def succeeded(self, event):
+        stats = _current_stats.get()
+        if stats is not None:
+            stats.finished(event.duration_micros, _returned_documents(event.reply))
+
+    def failed(self, event):
+        stats = _current_stats.get()
+        if stats is not None:
+            stats.finished(event.duration_micros)
+
+
+query_listener = QueryListener()
+
+
+def _log_query_stats(stats):
+    if stats.commands > SLOW_REQUEST_COMMANDS or stats.db_ms > SLOW_REQUEST_DB_MS:
+        logging.warning('%s %s issued %d MongoDB commands taking %.1f ms and returning %d documents',
+                        request.method, request.path, stats.commands, stats.db_ms, stats.documents)
+    for shape, count in stats.repeated():
+        logging.warning('%s %s issued the same query %d times, likely an N+1: %s',
+                        request.method, request.path, count, shape)
+
+
+def _inject_toolbar(response, stats):
+    html = response.get_data(as_text=True)
+    position = html.rfind('</body>')
+    if position == -1:
+        return
+    toolbar = render_template('_query_toolbar.html', stats=stats, shapes=stats.shapes.most_common(TOOLBAR_SHAPES),
+                              repeat_threshold=QUERY_REPEAT_THRESHOLD)
+    response.set_data(html[:position] + toolbar + html[position:])
+
+
+def init_query_stats(app):
+    """Collect query stats for every request of the app, and report them after each response."""
+
+    @app.before_request
+    def start_query_stats():
+        g.query_stats = QueryStats()
+        _current_stats.set(g.query_stats)
+
+    @app.after_request
+    def report_query_stats(response):
+        stats = g.get('query_stats')
+        if stats is None:
+            return response
+        _log_query_stats(stats)
+        if app.debug or app.config['QUERY_STATS_HEADER']:
+            response.headers[STATS_HEADER] = stats.header()
+        if (app.debug and app.config['QUERY_TOOLBAR'] and response.mimetype == 'text/html'
+                and not response.is_streamed and not response.direct_passthrough):
+            _inject_toolbar(response, stats)
+        return response
+
+    @app.teardown_request
+    def stop_query_stats(exception=None):
+        _current_stats.set(None)
@@ -3,30 +3,53 @@ from datetime import datetime
 
 from flask import render_template, redirect, url_for, flash, session
 from flask_login import login_user, login_required, logout_user, current_user
-from werkzeug.security import check_password_hash, generate_password_hash
+from app.passwords import hash_password, verify_password, rehash_if_outdated, HashingBusyError
 from app import app, mongo, login_manager
-from flask import send_from_directory, Flask, request, jsonify
+from flask import send_from_directory, Flask, request, jsonify, Response, stream_with_context
 from pymongo.errors import PyMongoError
-from app.models import Admin, Patient, Doctor
-from app.utils import (get_all_doctors, is_doctor_available, validate_appointment_date,
-                       get_busy_dates_by_doctor, get_patient_full_name, get_fixed_appointments_for_doctor,
-                       get_appointment_requests_for_doctor, get_pending_patients,
-                       get_total_appointments_count, get_all_appointments, get_approved_patients, AppointmentForm)
+from app.models import Admin, Patient, Doctor, PROJECTIONS
+from app.utils import (is_doctor_available, validate_appointment_date,
+                       get_patient_full_name, get_doctor_dashboard_data,
+                       get_total_appointments_count, get_all_appointments, get_approved_patients, AppointmentForm,
+                       enrich_appointments, reserve_appointment_slot, set_appointment_status,
+                       delete_appointment_by_id, get_admin_stats, invalidate_admin_stats, get_page,
+                       get_page_size, get_appointments_filter, get_appointments_page, EXPORT_FIELDS,
+                       export_documents, gzip_chunks, get_export_cursor, invalidate_cached_user,
+                       fetch_concurrently, format_appointment_date)
 from app.models import Appointment
 from flask import jsonify
 from bson.objectid import ObjectId, InvalidId
 from flask_wtf.csrf import generate_csrf
 import logging
-import cloudinary.uploader
-from PIL import Image
-import io
+from app.media import submit_profile_image, ImageRejectedError
+from app.metrics import approvals, bookings, logins
+from app.availability import (WEEKDAYS, SLOT_DURATIONS, MAX_AVAILABILITY_DAYS, ScheduleError, build_schedule,
+                              format_working_hours, get_schedule, get_available_slots, is_open_slot,
+                              get_appointment_conflict, calendar_locks, CalendarBusyError)
+from app.page_cache import cached_html
+from app.search import (search_doctors, suggest_doctors, refresh_doctor, FACETS, SUGGESTION_LIMIT,
+                        MAX_SUGGESTION_LIMIT)
+
+# Number of rows in each list on the admin dashboard
+DASHBOARD_LIST_SIZE = 10
+
+
+@app.template_filter('srcset')
+def srcset_filter(image_variants, image_format):
+    # Render the variants of one format as an <img>/<source> srcset value
+    return ', '.join(f"{variant['url']} {variant['width']}w" for variant in image_variants
+                     if variant['format'] == image_format)
 
 
 @app.route('/')
 def home():
-    doctors_collection = mongo.db.doctors
-    approved_doctors = doctors_collection.find({"registration_status": "approved"})
-    return render_template('homepage.html', doctors=approved_doctors)
+    # The homepage is the same for every visitor, so it is rendered once per directory version
+    def render():
+        approved_doctors = mongo.db.doctors.find({"registration_status": "approved"}, PROJECTIONS['doctor_card'])
+        return render_template('homepage.html', doctors=approved_doctors)
+
+    html, hit = cached_html('home', None, render)
+    return Response(html, headers={'X-Page-Cache': 'hit' if hit else 'miss'})
 
 
 @app.route('/patient_registration', methods=['GET', 'POST'])
@@ -43,13 +66,14 @@ def patient_registration():
         if len(data.get('username', '')) < 5:
             return jsonify({"error": "Username must be at least 5 characters long"}), 400
 
-        hashed_password = generate_password_hash(data['password'], method='pbkdf2:sha256')
+        hashed_password = hash_password(data['password'])
         data['password'] = hashed_password
 
         data['registration_status'] = 'pending'
 
         # Insert the patient data into MongoDB, adapted for demonstration
         mongo.db.patients.insert_one(data)
+        invalidate_admin_stats()
 
         flash("Patient registration successful", "success")
         return render_template('/patient/registration_pending.html', csrf_token=generate_csrf())
@@ -79,7 +103,7 @@ def register_doctor():
         # Additional validations can be added here as needed
 
         # Hash the password
-        hashed_password = generate_password_hash(data['password'], method='pbkdf2:sha256')
+        hashed_password = hash_password(data['password'])
 
         address = {
             "street": data.get('address_street', ''),
@@ -100,6 +124,7 @@ def register_doctor():
              'biography': data.get('biography', ''), 'education': education, 'experience': experience,
              'registration': registration
          })
+        invalidate_admin_stats()
 
         flash("Doctor registration successful", "success")
         return render_template('/patient/registration_pending.html', csrf_token=generate_csrf())
@@ -120,7 +145,7 @@ def register_admin():
             password = data['password']
 
             # Hash the password before storing it
-            hashed_password = generate_password_hash(password, method='pbkdf2:sha256')
+            hashed_password = hash_password(password)
 
             # Insert the admin data into MongoDB
             mongo.db.admins.insert_one({
@@ -148,9 +173,12 @@ def approve_registration(patient_id):
 
         # Update registration status to 'approved' for the specified patient ID
         result = mongo.db.patients.update_one({'_id': object_id}, {'$set': {'registration_status': 'approved'}})
+        invalidate_admin_stats()
+        invalidate_cached_user('patient')
 
         # Check if the update was successful
         if result.matched_count > 0:
+            approvals.inc('patient')
             message = f"Registration for patient with ID {patient_id} approved"
             status = "success"
         else:
@@ -171,9 +199,12 @@ def approve_doctor(doctor_id):
 
         # Update approval status to 'approved' for the specified doctor ID
         result = mongo.db.doctors.update_one({'_id': object_id}, {'$set': {'approval_status': 'approved'}})
+        invalidate_cached_user('doctor')
+        refresh_doctor(object_id)
 
         # Check if the update was successful
         if result.matched_count > 0:
+            approvals.inc('doctor')
             message = f"Approval for doctor with ID {doctor_id} granted."
             status = "success"
         else:
@@ -190,7 +221,14 @@ def approve_doctor(doctor_id):
 def reject_registration(username):
     # Update registration status to 'rejected' for the specified username
     mongo.db.patients.update_one({'username': username}, {'$set': {'registration_status': 'rejected'}})
-    mongo.db.doctors.update_one({'username': username}, {'$set': {'registration_status': 'rejected'}})
+    doctor = mongo.db.doctors.find_one_and_update({'username': username},
+                                                  {'$set': {'registration_status': 'rejected'}}, {'_id': 1})
+    invalidate_admin_stats()
+    invalidate_cached_user('patient', username)
+    invalidate_cached_user('doctor', username)
+    if doctor:
+        # A rejected doctor must leave the cached home page and search results
+        refresh_doctor(doctor['_id'])
 
     return jsonify({"message": f"Registration for {username} rejected"})
 
@@ -208,14 +246,15 @@ def admin_login():
             flash('Password is required.', 'error')
             return render_template('/admin/admin_login.html', csrf_token=generate_csrf())
 
-        print("Before find_one call")
         admin_data = mongo.db.admins.find_one({'username': admin_username})
-        print("After find_one call", admin_data)
 
-        if admin_data and check_password_hash(admin_data['password'], admin_password):
+        if admin_data and verify_password(admin_data['password'], admin_password):
             # Successful login
+            rehash_if_outdated(admin_data['password'], admin_password, lambda new_hash: mongo.db.admins.update_one(
+                {'_id': admin_data['_id']}, {'$set': {'password': new_hash}}))
             user = Admin(admin_data['username'])
             login_user(user)
+            logins.inc('admin', 'success')
 
             # Store the user identifier (username) in the session
             session['user_id'] = user.get_id()
@@ -223,6 +262,7 @@ def admin_login():
             # Redirect to the admin dashboard or the originally requested page (if 'next' exists)
             return redirect(request.args.get('next') or url_for('admin_dashboard'))
         else:
+            logins.inc('admin', 'failure')
             flash('Invalid credentials. Please try again.', 'error')
 
     return render_template('/admin/admin_login.html', csrf_token=generate_csrf())
@@ -232,31 +272,23 @@ def admin_login():
 @login_required
 def admin_dashboard():
     # Only authenticated users can access this route
-    # Show the admin dashboard
-    patients_cursor = mongo.db.patients.find()
-    doctor_cursor = mongo.db.doctors.find()
-    # No need to fetch pending doctors
-
-    # Convert cursors to lists for counting and passing to template
-    all_patients = list(patients_cursor)
-    all_doctors = list(doctor_cursor)  # Use the function to get total doctors count
-    total_appointments_count = get_total_appointments_count()
-
-    # Fetch all appointments and patients
-    all_appointments = get_all_appointments()
-    all_patients = len(all_patients)
-    all_doctors = len(all_doctors)
-    doctors = get_all_doctors()
-    pending_patients = get_pending_patients()
-    approved_patients = get_approved_patients()
-    sample_appointment = all_appointments[0] if all_appointments else None
-    # print("smple", all_appointments)
+    # Show the admin dashboard; totals come from the cached count-only stats
+    stats = get_admin_stats()
+
+    # Fetch the latest appointments, doctors and patients; the full lists are paginated on their own pages
+    all_appointments, _ = get_appointments_page(page_size=DASHBOARD_LIST_SIZE)
+    doctors, _ = get_page(mongo.db.doctors, page_size=DASHBOARD_LIST_SIZE, projection=PROJECTIONS['doctor_card'])
+    pending_patients, _ = get_page(mongo.db.patients, {'registration_status': 'pending'},
+                                   page_size=DASHBOARD_LIST_SIZE, projection=PROJECTIONS['patient_summary'])
+    approved_patients, _ = get_page(mongo.db.patients, {'registration_status': 'approved'},
+                                    page_size=DASHBOARD_LIST_SIZE, projection=PROJECTIONS['patient_summary'])
 
     return render_template('admin/admin_dashboard.html',
-                           all_patients=all_patients,
-                           all_doctors=all_doctors,
+                           all_patients=stats['total_patients'],
+                           all_doctors=stats['total_doctors'],
                            doctors=doctors,
-                           total_appointments_count=total_appointments_count,
+                           total_appointments_count=stats['total_appointments'],
+                           stats=stats,
                            all_appointments=all_appointments, pending_patients=pending_patients,
                            approved_patients=approved_patients)
 
@@ -269,11 +301,14 @@ def patient_login():
         password = request.form['password']
 
         # Query the database to check if the phone number exists
-        patient_data = mongo.db.patients.find_one({'phone_number': phone_number})
+        patient_data = mongo.db.patients.find_one({'phone_number': phone_number}, PROJECTIONS['credentials'])
 
-        if patient_data and check_password_hash(patient_data['password'], password):
-            # Password is correct, set session variables
+        if patient_data and verify_password(patient_data['password'], password):
+            # Password is correct, upgrade an outdated hash and set session variables
+            rehash_if_outdated(patient_data['password'], password, lambda new_hash: mongo.db.patients.update_one(
+                {'_id': patient_data['_id']}, {'$set': {'password': new_hash}}))
             session['patient_id'] = str(patient_data['_id'])  # Store patient_id in session
+            logins.inc('patient', 'success')
 
             registration_status = patient_data.get('registration_status', 'pending')
 
@@ -285,6 +320,7 @@ def patient_login():
                 return redirect(url_for('patient_dashboard'))
         else:
             # Invalid login attempt
+            logins.inc('patient', 'failure')
             flash('Invalid phone number or password.', 'error')
 
     return render_template('/patient/patient_login.html', csrf_token=generate_csrf())
@@ -304,20 +340,49 @@ def create_appointment():
 
     # Check if date and time are valid
     if not validate_appointment_date(date, time):
+        bookings.inc('past_date')
         flash('You cannot book appointments on past dates or times.', 'error')
         return redirect(url_for('book_appointment'))
 
-    # Check doctor's availability
-    if not is_doctor_available(doctor_id, date, time):
-        flash('The selected doctor is not available at the chosen date and time.', 'error')
-        return redirect(url_for('book_appointment'))
-
     # Create Appointment instance
     appointment = Appointment(patient_oid, doctor_oid, date, time)
 
-    # Save appointment to database
-    mongo.db.appointments.insert_one(appointment.to_dict())
+    # Only slots offered by the doctor's working hours can be booked. Bookings are deliberately
+    # exactly one slot long; the overlap check below handles any length, for appointments that
+    # were booked before schedules existed or after a doctor changed their slot duration
+    doctor = mongo.db.doctors.find_one({'_id': doctor_oid}, {'schedule': 1})
+    if not doctor or not is_open_slot(get_schedule(doctor), appointment.start, appointment.end):
+        bookings.inc('outside_hours')
+        flash("The selected time is outside the doctor's working hours.", 'error')
+        return redirect(url_for('book_appointment'))
+
+    try:
+        # Bookings of this doctor or patient on the same day wait for each other, so the
+        # conflict check still holds when the appointment is inserted
+        with calendar_locks(appointment.start.date(), doctor_oid, patient_oid):
+            # Neither the doctor nor the patient may have another appointment overlapping this one
+            conflict = get_appointment_conflict(doctor_oid, patient_oid, appointment.start, appointment.end)
+            # Save appointment to database, failing if the doctor's slot is already taken
+            booked = conflict is None and reserve_appointment_slot(appointment) is not None
+    except CalendarBusyError:
+        bookings.inc('busy')
+        flash('The server is busy, please try again shortly.', 'error')
+        return redirect(url_for('book_appointment'))
+
+    if conflict:
+        bookings.inc(f'{conflict}_conflict')
+    if conflict == 'patient':
+        flash('You already have an appointment at the chosen time.', 'error')
+        return redirect(url_for('book_appointment'))
+    if conflict == 'doctor':
+        flash('The selected doctor is not available at the chosen date and time.', 'error')
+        return redirect(url_for('book_appointment'))
+    if not booked:
+        bookings.inc('slot_taken')
+        flash('The selected doctor is not available at the chosen date and time.', 'error')
+        return redirect(url_for('book_appointment'))
 
+    bookings.inc('booked')
     flash('Appointment request has been submitted successfully.', 'success')
     return redirect(url_for('booking_success', doctor_id=doctor_id, date=date, time=time))
 
@@ -337,7 +402,7 @@ def booking_success():
             return redirect(url_for('error_page'))
 
         try:
-            doctor_info = mongo.db.doctors.find_one({'_id': doctor_oid})
+            doctor_info = mongo.db.doctors.find_one({'_id': doctor_oid}, PROJECTIONS['doctor_card'])
         except PyMongoError as e:
             flash('Database error occurred.', 'error')
             return redirect(url_for('error_page'))
@@ -366,41 +431,36 @@ def patient_dashboard():
     patient_id = session['patient_id']
     try:
         patient_oid = ObjectId(patient_id)
-        patient_data = mongo.db.patients.find_one({'_id': patient_oid})
-        app.logger.debug('Patient IDs: %s', patient_data)
+        # The patient and their appointments are independent, so fetch them in parallel.
+        # The dashboard lists no doctors of its own, so neither the directory nor busy dates are read.
+        results = fetch_concurrently({
+            'patient': lambda: Patient.find_one({'_id': patient_oid}, PROJECTIONS['patient_summary']),
+            'appointments': lambda: enrich_appointments(
+                mongo.db.appointments.find({'patient_id': patient_oid}, PROJECTIONS['appointment_row']),
+                with_patients=False),
+        })
+        patient = results['patient']
     except:
         flash('An error occurred.', 'error')
         return redirect(url_for('patient_login'))
 
-    if not patient_data:
+    if not patient:
         flash('Patient data not found.', 'error')
         return redirect(url_for('patient_login'))
 
-    appointments = mongo.db.appointments.find({'patient_id': patient_oid})
-
-    appointments_list = list(appointments)
+    appointments_list = results['appointments']
 
     for appointment in appointments_list:
-        if 'date' in appointment:
-            appointment['formatted_date'] = datetime.strptime(appointment['date'], '%Y-%m-%d').strftime('%d %B %Y')
-
-        doctor_oid = appointment['doctor_id']
-        doctor_info = mongo.db.doctors.find_one({'_id': doctor_oid})
-        appointment['doctor_info'] = doctor_info
+        appointment['formatted_date'] = format_appointment_date(appointment)
 
-    registration_status = patient_data.get('registration_status', 'pending')
-    patient_full_name = f"{patient_data.get('first_name', '')} {patient_data.get('last_name', '')}".strip()
-
-    #  get_all_doctors() and get_busy_dates_by_doctor() are defined in utils.py
-    doctors = get_all_doctors()
-    busy_dates_by_doctor = get_busy_dates_by_doctor()
+    registration_status = patient.registration_status
+    patient_full_name = f"{patient.first_name or ''} {patient.last_name or ''}".strip()
 
     if registration_status == 'pending':
         return render_template('/patient/registration_pending.html')
     elif registration_status == 'approved':
         return render_template('/patient/patient_dashboard.html', patient_full_name=patient_full_name,
-                               doctors=doctors, busy_dates_by_doctor=busy_dates_by_doctor, patient_id=patient_id,
-                               patient_info=patient_data, appointments=appointments_list)
+                               patient_id=patient_id, patient_info=patient, appointments=appointments_list)
     else:
         flash('Unexpected registration status.', 'error')
         return redirect(url_for('home'))
@@ -413,15 +473,19 @@ def doctor_login():
         password = request.form['password']
 
         # Check if doctor exists in the database
-        doctor = mongo.db.doctors.find_one({'phone_number': phone_number})
+        doctor = mongo.db.doctors.find_one({'phone_number': phone_number}, PROJECTIONS['credentials'])
 
-        if doctor and check_password_hash(doctor['password'], password):
+        if doctor and verify_password(doctor['password'], password):
             # Doctor exists and password is correct
+            rehash_if_outdated(doctor['password'], password, lambda new_hash: mongo.db.doctors.update_one(
+                {'_id': doctor['_id']}, {'$set': {'password': new_hash}}))
             session['doctor_id'] = str(doctor['_id'])  # Store doctor_id in session
+            logins.inc('doctor', 'success')
             flash('Login successful', 'success')
             return redirect(url_for('doctor_dashboard'))
         else:
             # Invalid credentials
+            logins.inc('doctor', 'failure')
             flash('Invalid phone number or password', 'error')
 
     return render_template('doctor/doctor_login.html', csrf_token=generate_csrf())
@@ -437,39 +501,34 @@ def doctor_dashboard():
     # Convert string doctor_id back to ObjectId for database query
     doctor_oid = ObjectId(doctor_id)
 
-    doctor = mongo.db.doctors.find_one({'_id': doctor_oid})
-    print("doctor", doctor)
+    # Retrieve the doctor and, in one aggregation, their appointment requests and fixed appointments
+    results = fetch_concurrently({
+        'doctor': lambda: Doctor.find_one({'_id': doctor_oid}, PROJECTIONS['doctor_card']),
+        'dashboard': lambda: get_doctor_dashboard_data(doctor_id),
+    })
+    doctor = results['doctor']
     if not doctor:
         flash('Doctor not found', 'error')
         return redirect(url_for('doctor_login'))
 
-    # Retrieve appointment requests for the specific doctor
-    appointment_requests = get_appointment_requests_for_doctor(doctor_id)
-
-    # Retrieve fixed appointments for the specific doctor
-    fixed_appointments = get_fixed_appointments_for_doctor(doctor_id)
-    for appointment in appointment_requests + fixed_appointments:
-        if 'date' in appointment:
-            appointment['formatted_date'] = datetime.strptime(appointment['date'], '%Y-%m-%d').strftime('%d %B %Y')
-        if appointment.get('patient_info'):
-            patient = appointment['patient_info']
-            patient['full_name'] = f"{patient.get('first_name', '')} {patient.get('last_name', '')}".strip()
-
+    dashboard = results['dashboard']
     return render_template('doctor/doctor_dashboard.html', doctor=doctor,
-                           appointment_requests=appointment_requests, fixed_appointments=fixed_appointments, csrf_token=generate_csrf())
+                           appointment_requests=dashboard['appointment_requests'],
+                           fixed_appointments=dashboard['fixed_appointments'],
+                           appointment_counts=dashboard['counts'], csrf_token=generate_csrf())
 
 
 @app.route('/approve_appointment/<appointment_id>', methods=['GET', 'POST'])
 def approve_appointment(appointment_id):
     try:
         appointment_id = ObjectId(appointment_id)
-        appointment = mongo.db.appointments.find_one({'_id': appointment_id})
+        appointment = set_appointment_status(appointment_id, 'approved')
 
         if not appointment:
             flash('Appointment not found', 'error')
             return redirect(url_for('doctor_dashboard'))  # Adjust as necessary for your route structure
 
-        mongo.db.appointments.update_one({'_id': appointment_id}, {'$set': {'status': 'approved'}})
+        approvals.inc('appointment')
         flash('Appointment approved successfully', 'success')
 
     except Exception as e:
@@ -482,46 +541,56 @@ def approve_appointment(appointment_id):
 def delete_appointment(appointment_id):
     # Convert appointment_id to ObjectId
     appointment_id = ObjectId(appointment_id)
-    # Find the appointment by its ID
-    appointment = mongo.db.appointments.find_one({'_id': appointment_id})
+    # Delete the appointment by its ID
+    appointment = delete_appointment_by_id(appointment_id)
 
-    # Check if the appointment exists
+    # Check if the appointment existed
     if not appointment:
         return jsonify({"message": "Appointment not found"}), 404
 
-    # Delete the appointment
-    mongo.db.appointments.delete_one({'_id': appointment_id})
-
     return jsonify({"message": "Appointment deleted"}), 200
 
 
 @app.route('/search_doctor')
 def search_doctor():
-    address_city = request.args.get('address_city')
-    name = request.args.get('name')
-    gender = request.args.get('gender')
-
-    query = {}
-    if address_city:
-        query["address.city"] = address_city
-    if name:
-        # If your database is set up to support text search on the 'name' field
-        query["$text"] = {"$search": name}
-    if gender:
-        # Assuming gender is stored directly and doesn't need text search
-        query["gender"] = gender
-
-    doctors_collection = mongo.db.doctors
-
-    # Apply the query filters when fetching doctors from the database
-    doctors = doctors_collection.find(query)
-
-    # Convert doctors to a list if necessary (depending on your template rendering needs)
-    doctors_list = list(doctors)
-
-    current_gender = request.args.get('gender', '')
+    # 'address' is the location box on the homepage, 'address_city' the one on this page
+    name = request.args.get('name', '')
+    location = request.args.get('address_city') or request.args.get('address', '')
+    filters = {facet: request.args.getlist(facet) for facet in FACETS}
+
+    # The results depend only on the query and the directory, so they are rendered once per
+    # query and directory version; the rest of the page varies with the session
+    def render():
+        # Answered from the in-memory index of approved doctors, without querying MongoDB
+        results = search_doctors(text=name, location=location, filters=filters)
+        return render_template('/doctor/_search_results.html', doctors=results['doctors'],
+                               facets=results['facets'], total=results['total'], filters=filters, name=name,
+                               location=location, current_gender=request.args.get('gender', ''))
+
+    results_html, hit = cached_html('search_doctor', request.args, render)
+    response = app.make_response(render_template('/doctor/search_doctor.html', results_html=results_html))
+    response.headers['X-Page-Cache'] = 'hit' if hit else 'miss'
+    return response
+
+
+@app.route('/search_doctor/suggest')
+def suggest_doctor():
+    try:
+        limit = min(max(int(request.args.get('limit', SUGGESTION_LIMIT)), 1), MAX_SUGGESTION_LIMIT)
+    except ValueError:
+        limit = SUGGESTION_LIMIT
+
+    # Where choosing each kind of suggestion leads
+    suggestions = suggest_doctors(request.args.get('q', ''), limit)
+    for suggestion in suggestions:
+        if suggestion['kind'] == 'doctor':
+            suggestion['url'] = url_for('book_appointment', doctor_id=suggestion['doctor_id'])
+        elif suggestion['kind'] == 'city':
+            suggestion['url'] = url_for('search_doctor', address_city=suggestion['label'])
+        else:
+            suggestion['url'] = url_for('search_doctor', name=suggestion['label'])
 
-    return render_template('/doctor/search_doctor.html', doctors=doctors_list, current_gender=current_gender)
+    return jsonify({'query': request.args.get('q', ''), 'suggestions': suggestions})
 
 
 @app.route('/book_appointment')
@@ -540,7 +609,7 @@ def book_appointment():
         return redirect(url_for('/error_page'))
 
     try:
-        doctor_info = mongo.db.doctors.find_one({'_id': doctor_oid})
+        doctor_info = mongo.db.doctors.find_one({'_id': doctor_oid}, PROJECTIONS['doctor_card'])
         if not doctor_info:
             flash('Doctor not found.', 'error')
             return redirect(url_for('/error_page'))
@@ -553,12 +622,44 @@ def book_appointment():
     if not patient_id:
         flash('You need to be logged in to book an appointment.', 'error')
         return redirect(url_for('patient_login'))  # Adjust with your login route
-    print("pid", patient_id)
-    print("did", doctor_id)
     return render_template('/patient/book_appointment.html', doctor_id=doctor_id,
                            doctor_info=doctor_info, patient_id=patient_id, form=form)
 
 
+@app.errorhandler(HashingBusyError)
+def hashing_busy(e):
+    # Login and registration are shed while the password hashing pool is saturated
+    app.logger.warning('Password hashing unavailable: %s', e)
+    if request.is_json:
+        return jsonify({"error": "The server is busy, please try again shortly."}), 503
+    flash('The server is busy, please try again shortly.', 'error')
+    return redirect(request.url)
+
+
+@app.route('/doctor_availability/<doctor_id>')
+def doctor_availability(doctor_id):
+    try:
+        doctor_oid = ObjectId(doctor_id)
+    except InvalidId:
+        return jsonify({"error": "Invalid doctor ID"}), 400
+
+    try:
+        start_date = datetime.strptime(request.args['start'], '%Y-%m-%d').date() \
+            if request.args.get('start') else datetime.now().date()
+        days = int(request.args.get('days', 7))
+    except ValueError:
+        return jsonify({"error": "start must be YYYY-MM-DD and days a number"}), 400
+    if not 1 <= days <= MAX_AVAILABILITY_DAYS:
+        return jsonify({"error": f"days must be between 1 and {MAX_AVAILABILITY_DAYS}"}), 400
+
+    doctor = mongo.db.doctors.find_one({'_id': doctor_oid}, {'schedule': 1})
+    if not doctor:
+        return jsonify({"error": "Doctor not found"}), 404
+
+    availability = get_available_slots(doctor, start_date, days)
+    return jsonify({'doctor_id': doctor_id, 'start': start_date.isoformat(), 'days': days, **availability})
+
+
 @app.route('/error_page')
 def error_page():
 
@@ -567,20 +668,20 @@ def error_page():
 
 @app.route('/admin_appointments')
 def admin_appointments():
+    filters = {
+        'status': request.args.get('status', ''),
+        'date_from': request.args.get('date_from', ''),
+        'date_to': request.args.get('date_to', ''),
+    }
     try:
-        appointments = mongo.db.appointments.find()
-        # Optionally, enrich appointments with patient and doctor info
-        appointments_list = []
-        for appointment in appointments:
-            try:
-                appointment['patient_info'] = mongo.db.patients.find_one({'_id': appointment['patient_id']})
-                appointment['doctor_info'] = mongo.db.doctors.find_one({'_id': appointment['doctor_id']})
-            except KeyError:
-                # Handle missing patient_id or doctor_id
-                continue
-            appointments_list.append(appointment)
+        query = get_appointments_filter(**filters)
+        # Skip appointments with a missing patient_id or doctor_id
+        query.update({'patient_id': {'$exists': True}, 'doctor_id': {'$exists': True}})
+        # Enrich the page with patient and doctor info in one batched query per collection
+        appointments_list, next_token = get_appointments_page(query, request.args.get('after'),
+                                                              get_page_size(request.args.get('limit')))
         return render_template('/admin/admin_appointments.html', appointments=appointments_list,
-                               csrf_token=generate_csrf())
+                               next_token=next_token, filters=filters, csrf_token=generate_csrf())
     except PyMongoError as e:
         flash(f"Database error: {e}", 'error')
         return redirect(url_for('admin_dashboard', csrf_token=generate_csrf()))
@@ -593,25 +694,21 @@ def update_appointment_status():
     appointment_id = data.get('appointment_id')
     new_status = data.get('new_status')
 
-    # Server-side logging
-    print(f"Attempting to update appointment {appointment_id} to status {new_status}")
-    print(data)
     try:
-        result = mongo.db.appointments.update_one(
-            {'_id': ObjectId(appointment_id)},
-            {'$set': {'status': new_status}}
-        )
+        previous = set_appointment_status(ObjectId(appointment_id), new_status)
 
-        if result.modified_count > 0:
-            print(f"Successfully updated appointment {appointment_id} to status {new_status}")
+        if previous and previous.get('status') != new_status:
+            if new_status == 'approved':
+                approvals.inc('appointment')
+            app.logger.debug('Updated appointment %s to status %s', appointment_id, new_status)
             flash('Appointment status updated successfully.', 'success')
             return jsonify({'message': 'Success'})
         else:
-            print(f"No changes made for appointment {appointment_id}")
+            app.logger.debug('No changes made for appointment %s', appointment_id)
             flash('No changes made to appointment status.', 'info')
             return jsonify({'message': 'No changes made'}), 200
     except Exception as e:
-        print(f"Failed to update appointment status: {str(e)}")
+        app.logger.warning('Failed to update the status of appointment %s: %s', appointment_id, e)
         flash(f"Failed to update appointment status: {str(e)}", 'error')
         return jsonify({'message': 'Failed to update status'}), 500
 
@@ -620,18 +717,58 @@ def update_appointment_status():
 @app.route('/admin/appointments/delete/<appointment_id>', methods=['POST'])
 def admin_delete_appointment(appointment_id):
     try:
-        mongo.db.appointments.delete_one({'_id': ObjectId(appointment_id)})
+        delete_appointment_by_id(ObjectId(appointment_id))
         flash('Appointment deleted successfully.', 'success')
     except PyMongoError as e:
         flash(f"Failed to delete appointment: {e}", 'error')
     return redirect(url_for('admin_appointments'))
 
 
+@app.route('/admin/export/<collection_name>')
+@login_required
+def admin_export(collection_name):
+    if collection_name not in EXPORT_FIELDS:
+        return jsonify({"error": f"Unknown collection: {collection_name}"}), 404
+
+    export_format = request.args.get('format', 'csv')
+    if export_format not in ('csv', 'ndjson'):
+        return jsonify({"error": "Format must be csv or ndjson"}), 400
+
+    # Optional projection, limited to the exportable fields
+    fields = EXPORT_FIELDS[collection_name]
+    if request.args.get('fields'):
+        requested = request.args['fields'].split(',')
+        fields = [field for field in fields if field in requested]
+        if not fields:
+            return jsonify({"error": "No exportable fields requested"}), 400
+
+    query = {}
+    if collection_name == 'appointments':
+        query = get_appointments_filter(request.args.get('status'), request.args.get('date_from'),
+                                        request.args.get('date_to'))
+    elif request.args.get('status'):
+        query = {'registration_status': request.args['status']}
+
+    chunks = export_documents(get_export_cursor(collection_name, fields, query), fields, export_format)
+    filename = f'{collection_name}.{export_format}'
+    mimetype = 'text/csv' if export_format == 'csv' else 'application/x-ndjson'
+    if request.args.get('gzip'):
+        chunks = gzip_chunks(chunks)
+        filename += '.gz'
+        mimetype = 'application/gzip'
+
+    return Response(stream_with_context(chunks), mimetype=mimetype,
+                    headers={'Content-Disposition': f'attachment; filename={filename}'})
+
+
 @app.route('/admin/patients')
 def admin_patients():
-    patients = mongo.db.patients.find()
-    patients_list = list(patients)
-    return render_template('/admin/admin_patients.html', patients=patients_list, csrf_token=generate_csrf())
+    status = request.args.get('status', '')
+    query = {'registration_status': status} if status else {}
+    patients_list, next_token = get_page(mongo.db.patients, query, request.args.get('after'),
+                                         get_page_size(request.args.get('limit')), PROJECTIONS['patient_summary'])
+    return render_template('/admin/admin_patients.html', patients=patients_list, next_token=next_token,
+                           filters={'status': status}, csrf_token=generate_csrf())
 
 
 @app.route('/admin/patients/update_status/<patient_id>', methods=['POST'])
@@ -640,10 +777,14 @@ def update_patients_status(patient_id):
     try:
         object_id = ObjectId(patient_id)
         result = mongo.db.patients.update_one({'_id': object_id}, {'$set': {'registration_status': new_status}})
+        invalidate_admin_stats()
+        invalidate_cached_user('patient')
 
         if result.matched_count == 0:
             flash('Patient not found.', 'error')
         else:
+            if new_status == 'approved' and result.modified_count:
+                approvals.inc('patient')
             flash('Patient status updated successfully.', 'success')
     except Exception as e:
         flash(f'An error occurred: {str(e)}', 'error')
@@ -656,6 +797,8 @@ def delete_patient(patient_id):
     try:
         object_id = ObjectId(patient_id)
         result = mongo.db.patients.delete_one({'_id': object_id})
+        invalidate_admin_stats()
+        invalidate_cached_user('patient')
 
         if result.deleted_count == 0:
             message = "Patient not found"
@@ -673,9 +816,12 @@ def delete_patient(patient_id):
 
 @app.route('/admin/doctors')
 def admin_doctors():
-    doctors = mongo.db.doctors.find()
-    doctors_list = list(doctors)
-    return render_template('/admin/admin_doctors.html', doctors=doctors_list, csrf_token=generate_csrf())
+    status = request.args.get('status', '')
+    query = {'registration_status': status} if status else {}
+    doctors_list, next_token = get_page(mongo.db.doctors, query, request.args.get('after'),
+                                        get_page_size(request.args.get('limit')), PROJECTIONS['doctor_card'])
+    return render_template('/admin/admin_doctors.html', doctors=doctors_list, next_token=next_token,
+                           filters={'status': status}, csrf_token=generate_csrf())
 
 
 @app.route('/admin/doctors/update_status/<doctor_id>', methods=['POST'])
@@ -684,10 +830,15 @@ def update_doctor_status(doctor_id):
     try:
         object_id = ObjectId(doctor_id)
         result = mongo.db.doctors.update_one({'_id': object_id}, {'$set': {'registration_status': new_status}})
+        invalidate_admin_stats()
+        invalidate_cached_user('doctor')
+        refresh_doctor(object_id)
 
         if result.matched_count == 0:
             flash('Doctor not found.', 'error')
         else:
+            if new_status == 'approved' and result.modified_count:
+                approvals.inc('doctor')
             flash('Doctor status updated successfully.', 'success')
     except Exception as e:
         flash(f'An error occurred: {str(e)}', 'error')
@@ -702,6 +853,9 @@ def delete_doctor(doctor_id):
         object_id = ObjectId(doctor_id)
 
         result = mongo.db.doctors.delete_one({'_id': object_id})
+        invalidate_admin_stats()
+        invalidate_cached_user('doctor')
+        refresh_doctor(object_id)
 
         if result.deleted_count == 0:
             return render_template('admin/error_message.html', message="Doctor not found")
@@ -747,7 +901,7 @@ def doctor_profile_settings():
     # Convert string doctor_id back to ObjectId for database query
     doctor_oid = ObjectId(doctor_id)
 
-    doctor = mongo.db.doctors.find_one({'_id': doctor_oid})
+    doctor = Doctor.find_one({'_id': doctor_oid}, PROJECTIONS['doctor_profile'])
 
     if not doctor:
         flash('Doctor not found', 'error')
@@ -756,30 +910,25 @@ def doctor_profile_settings():
     if request.method == 'POST':
         data = request.form.to_dict(flat=True)
 
-        # Handle image upload to Cloudinary if a file is provided
-        if 'image' in request.files:
-            image_to_upload = request.files['image']
-
-            if image_to_upload:
-                # Open the image file using its stream
-                img = Image.open(image_to_upload.stream)  # Adjusted here
-
-                # Resize the image
-                img = img.resize((369, 445))  # Specify desired size
-
-                # Save the resized image to a bytes buffer
-                img_byte_arr = io.BytesIO()
-                img.save(img_byte_arr, format='JPEG')  # Ensure format is explicitly set if original format is unknown
-
-                # Seek to the start of the bytes buffer
-                img_byte_arr.seek(0)
-
-                # Upload the image from the bytes buffer
-                result = cloudinary.uploader.upload(img_byte_arr, resource_type='image')
-                image_url = result.get('secure_url')
-
-                # Update image_url in the data dictionary to be stored
-                data['image_url'] = image_url
+        # Hand an uploaded image to the background workers; they resize and upload it
+        # and set image_url on the profile when they are done
+        image_submitted = False
+        if 'image' in request.files and request.files['image']:
+            try:
+                image_submitted = submit_profile_image('doctors', doctor, request.files['image']) is not None
+            except ImageRejectedError as e:
+                flash(str(e), 'error')
+                return redirect(url_for('doctor_profile_settings'))
+
+        # Working hours are only part of the form once the doctor has a slot duration to submit
+        schedule = None
+        if data.get('slot_minutes'):
+            try:
+                schedule = build_schedule(data['slot_minutes'],
+                                          {day: data.get(f'hours_{day}') for day in WEEKDAYS})
+            except ScheduleError as e:
+                flash(str(e), 'error')
+                return redirect(url_for('doctor_profile_settings'))
 
         # Prepare the update dictionary
         update_data = {
@@ -806,27 +955,31 @@ def doctor_profile_settings():
             'registration': [{
                 "registration_name": data.get('registration_name'),
                 "year": data.get('year')
-            }]
+            }],
+            'schedule': schedule
         }
 
         # Only include fields that are not None
         update_data = {k: v for k, v in update_data.items() if v is not None}
 
-        # Update the doctor's profile in MongoDB
-        mongo.db.doctors.update_one({'_id': doctor_oid}, {'$set': update_data})
+        # Write only the fields the form actually changed
+        for field, value in update_data.items():
+            setattr(doctor, field, value)
+        if doctor.save():
+            invalidate_cached_user('doctor', doctor.username)
+            refresh_doctor(doctor_oid)
 
-        flash('Profile updated successfully.', 'success')
+        if image_submitted:
+            flash('Profile updated successfully. Your new photo will appear shortly.', 'success')
+        else:
+            flash('Profile updated successfully.', 'success')
         return redirect(url_for('doctor_dashboard', csrf_token=generate_csrf()))
 
     # GET request: Load the update form with the current user's data
-    doctor_data = mongo.db.doctors.find_one({'_id': doctor_oid})
-    if doctor_data:
-        return render_template('doctor/doctor_profile_settings.html', doctor=doctor_data, csrf_token=generate_csrf())
-
-    else:
-        flash('Doctor profile not found.', 'error')
-        print("data", doctor_data)
-        return redirect(url_for('doctor_dashboard', csrf_token=generate_csrf()))
+    schedule = get_schedule(doctor)
+    working_hours = {day: format_working_hours(schedule['hours'].get(day, [])) for day in WEEKDAYS}
+    return render_template('doctor/doctor_profile_settings.html', doctor=doctor, csrf_token=generate_csrf(),
+                           schedule=schedule, working_hours=working_hours, slot_durations=SLOT_DURATIONS)
 
 
 @app.route('/doctor_appointment')
@@ -837,18 +990,18 @@ def doctor_appointment():
         return redirect(url_for('doctor_login'))
 
     doctor_oid = ObjectId(doctor_id)
-    doctor = mongo.db.doctors.find_one({'_id': doctor_oid})
+    doctor = Doctor.find_one({'_id': doctor_oid}, PROJECTIONS['doctor_card'])
 
     if not doctor:
         flash('Doctor not found', 'error')
         return redirect(url_for('doctor_login'))
 
-    appointments_cursor = mongo.db.appointments.find({'doctor_id': doctor_oid})
+    appointments_cursor = mongo.db.appointments.find({'doctor_id': doctor_oid}, PROJECTIONS['appointment_row'])
 
     # Convert cursor to list and enrich with patient info
-    appointments_list = []
-    for appointment in appointments_cursor:
-        patient = mongo.db.patients.find_one({'_id': appointment['patient_id']})
+    appointments_list = enrich_appointments(appointments_cursor, with_doctors=False)
+    for appointment in appointments_list:
+        patient = appointment.pop('patient_info')
         if patient:
             patient_full_name = f"{patient.get('first_name', '')} {patient.get('last_name', '')}".strip()
 
@@ -856,7 +1009,6 @@ def doctor_appointment():
             appointment['patient_address'] = patient.get('address')
             appointment['patient_phone'] = patient.get('phone_number')
             appointment['patient_image_url'] = patient.get('image_url', 'assets/img/patients/default.jpg')
-        appointments_list.append(appointment)
 
     return render_template('/doctor/doctor_appointment.html', appointments=appointments_list, doctor=doctor)
 
@@ -869,13 +1021,14 @@ def accept_appointment(appointment_id):
         return redirect(url_for('doctor_login'))
 
     doctor_oid = ObjectId(doctor_id)
-    doctor = mongo.db.doctors.find_one({'_id': doctor_oid})
+    doctor = mongo.db.doctors.find_one({'_id': doctor_oid}, PROJECTIONS['doctor_card'])
 
     if not doctor:
         flash('Doctor not found', 'error')
         return redirect(url_for('doctor_login'))
     try:
-        mongo.db.appointments.update_one({'_id': ObjectId(appointment_id)}, {'$set': {'status': 'approved'}})
+        set_appointment_status(ObjectId(appointment_id), 'approved')
+        approvals.inc('appointment')
         flash('Appointment accepted successfully.', 'success')
     except Exception as e:
         flash(f'Error accepting appointment: {str(e)}', 'error')
@@ -886,7 +1039,7 @@ def accept_appointment(appointment_id):
 @login_required
 def cancel_appointment(appointment_id):
     try:
-        mongo.db.appointments.update_one({'_id': ObjectId(appointment_id)}, {'$set': {'status': 'cancelled'}})
+        set_appointment_status(ObjectId(appointment_id), 'cancelled')
         flash('Appointment cancelled successfully.', 'success')
     except Exception as e:
         flash(f'Error cancelling appointment: {str(e)}', 'error')
@@ -901,7 +1054,7 @@ def patient_profile_settings():
         return redirect(url_for('patient_login'))
 
     patient_oid = ObjectId(patient_id)
-    patient = mongo.db.patients.find_one({'_id': patient_oid})
+    patient = Patient.find_one({'_id': patient_oid}, PROJECTIONS['patient_profile'])
 
     if not patient:
         flash('Patient not found', 'error')
@@ -910,12 +1063,14 @@ def patient_profile_settings():
     if request.method == 'POST':
         data = request.form.to_dict(flat=True)
 
-        # Handle image upload similarly as done for doctors, adjust the fields accordingly
-        image_url = None
+        # Handle image upload the same way as for doctors; image_url is set in the background
+        image_submitted = False
         if 'image' in request.files and request.files['image']:
-            image_to_upload = request.files['image']
-            result = cloudinary.uploader.upload(image_to_upload, resource_type='image')
-            image_url = result.get('secure_url')
+            try:
+                image_submitted = submit_profile_image('patients', patient, request.files['image']) is not None
+            except ImageRejectedError as e:
+                flash(str(e), 'error')
+                return redirect(url_for('patient_profile_settings'))
 
         # Prepare the update data, ensure to capture all form inputs correctly
         update_data = {
@@ -932,19 +1087,17 @@ def patient_profile_settings():
                 "country": data.get('address_country'),
                 "postcode": data.get('address_postcode'),
             },
-            'image_url': image_url  # Ensure this is only updated if a new image is uploaded
         }
 
-        # Only include 'image_url' in the update if a new image was uploaded
-        if image_url:
-            update_data['image_url'] = image_url
+        # Write only the fields the form actually changed
+        for field, value in update_data.items():
+            setattr(patient, field, value)
+        if patient.save():
+            invalidate_cached_user('patient', patient.username)
+        if image_submitted:
+            flash('Profile updated successfully. Your new photo will appear shortly.', 'success')
         else:
-            # Remove the 'image_url' key if no new image was uploaded
-            update_data.pop('image_url', None)
-
-        # Update patient profile in MongoDB
-        mongo.db.patients.update_one({'_id': patient_oid}, {'$set': update_data})
-        flash('Profile updated successfully.', 'success')
+            flash('Profile updated successfully.', 'success')
         return redirect(url_for('patient_success_message'))
 
     return render_template('patient/patient_profile_settings.html', patient=patient, csrf_token=generate_csrf())
@@ -0,0 +1,467 @@
+# In-memory search over the approved doctors.
+# The directory is small and changes rarely, so every worker keeps its own inverted index of
+# doctor names, specialties, hospitals and cities, plus a prefix trie for typeahead suggestions,
+# and answers searches without querying MongoDB.
+# Routes that approve, edit or delete a doctor refresh that doctor in the index and bump the
+# directory version; an index that missed a version bumped by another worker is reloaded in full.
+import heapq
+import threading
+import unicodedata
+from bisect import bisect_left
+from collections import defaultdict
+from time import monotonic
+
+from app import mongo
+from app.models import PROJECTIONS
+from app.page_cache import bump_directory_version, get_directory_version
+from app.utils import TTLCache, to_object_id
+
+FACETS = ('gender', 'city', 'specialty')
+
+# Reload the index at least this often, even if the directory version did not change
+SEARCH_INDEX_MAX_AGE_SECONDS = 300
+# Terms shorter than this are only matched exactly or by prefix, never fuzzily
+MIN_FUZZY_TERM_LENGTH = 4
+
+# Score of a term matching a token exactly, by prefix, or with one typo
+EXACT_SCORE, PREFIX_SCORE, FUZZY_SCORE = 3, 2, 1
+
+SUGGESTION_LIMIT = 8
+MAX_SUGGESTION_LIMIT = 20
+# Typeahead results kept per (prefix, limit); emptied whenever the suggestions change
+SUGGESTION_CACHE_SIZE = 2048
+
+
+def tokenize(text):
+    """Split text into lowercase tokens with accents removed, e.g. "Zoë O'Neil" -> ['zoe', 'o', 'neil']."""
+    text = unicodedata.normalize('NFKD', str(text or '')).encode('ascii', 'ignore').decode('ascii')
+    return ''.join(c if c.isalnum() else ' ' for c in text.lower()).split()
+
+
+def _deletes(token):
+    # Every variant of token with one character removed; two tokens within one edit
+    # (insert, delete or substitute) of each other share the token itself or such a variant
+    return {token[:i] + token[i + 1:] for i in range(len(token))}
+
+
+def _within_one_edit(a, b):
+    if abs(len(a) - len(b)) > 1:
+        return False
+    if len(a) == len(b):
+        return sum(x != y for x, y in zip(a, b)) <= 1
+    shorter, longer = (a, b) if len(a) < len(b) else (b, a)
+    return any(longer[:i] + longer[i + 1:] == shorter for i in range(len(longer)))
+
+
+class _FieldIndex:
+    """Inverted index of one searchable field, matching terms exactly, by prefix and by one typo."""
+
+    def __init__(self):
+        self._postings = defaultdict(set)
+        self._variants = defaultdict(set)
+        self._sorted_tokens = []
+        self._dirty = False
+
+    def add(self, doctor_id, tokens):
+        for token in tokens:
+            if token not in self._postings:
+                self._dirty = True
+                for variant in _deletes(token) | {token}:
+                    self._variants[variant].add(token)
+            self._postings[token].add(doctor_id)
+
+    def remove(self, doctor_id, tokens):
+        for token in tokens:
+            postings = self._postings.get(token)
+            if postings is None:
+                continue
+            postings.discard(doctor_id)
+            if not postings:
+                del self._postings[token]
+                self._dirty = True
+                for variant in _deletes(token) | {token}:
+                    self._variants[variant].discard(token)
+                    if not self._variants[variant]:
+                        del self._variants[variant]
+
+    def match(self, term):
+        """Return the best score of term against each doctor's tokens, keyed by doctor id."""
+        if self._dirty:
+            self._sorted_tokens = sorted(self._postings)
+            self._dirty = False
+
+        scores = {}
+
+        def _score(token, score):
+            for doctor_id in self._postings[token]:
+                if scores.get(doctor_id, 0) < score:
+                    scores[doctor_id] = score
+
+        # Tokens starting with term are a contiguous run of the sorted vocabulary
+        position = bisect_left(self._sorted_tokens, term)
+        while position < len(self._sorted_tokens) and self._sorted_tokens[position].startswith(term):
+            token = self._sorted_tokens[position]
+            _score(token, EXACT_SCORE if token == term else PREFIX_SCORE)
+            position += 1
+
+        if len(term) >= MIN_FUZZY_TERM_LENGTH:
+            candidates = set()
+            for variant in _deletes(term) | {term}:
+                candidates |= self._variants.get(variant, set())
+            for token in candidates:
+                if token != term and _within_one_edit(term, token):
+                    _score(token, FUZZY_SCORE)
+        return scores
+
+
+def _facet_values(doctor):
+    address = doctor.get('address') or {}
+    return {
+        'gender': (doctor.get('gender') or '').strip(),
+        'city': (address.get('city') or '').strip(),
+        'specialty': (doctor.get('specialty') or '').strip(),
+    }
+
+
+def _facet_key(value):
+    return ' '.join(tokenize(value))
+
+
+# Trie node key holding the suggestions that end at a node; never a character of a phrase
+_TERMINAL = ''
+
+
+class SuggestionTrie:
+    """
+    Prefix trie of typeahead suggestions.
+    Each suggestion is inserted at the start of each of its words, so "card" finds "Cardiology"
+    and "smi" finds "Anna Smith". Suggestions shared by several doctors, such as a city, are
+    reference counted and rank higher the more doctors they cover.
+    """
+
+    def __init__(self):
+        self._root = {}
+        self._suggestions = {}
+        self._cache = TTLCache(maxsize=SUGGESTION_CACHE_SIZE, ttl=SEARCH_INDEX_MAX_AGE_SECONDS)
+
+    def __len__(self):
+        return len(self._suggestions)
+
+    @staticmethod
+    def _phrases(label):
+        tokens = tokenize(label)
+        return {' '.join(tokens[i:]) for i in range(len(tokens))}
+
+    def add(self, key, kind, label, **extra):
+        """Add a suggestion, or count one more doctor for a suggestion already in the trie."""
+        self._cache.clear()
+        suggestion = self._suggestions.get(key)
+        if suggestion is not None:
+            suggestion['count'] += 1
+            return
+        self._suggestions[key] = {'kind': kind, 'label': label, 'count': 1, **extra}
+        for phrase in self._phrases(label):
+            node = self._root
+            for char in phrase:
+                node = node.setdefault(char, {})
+            node.setdefault(_TERMINAL, set()).add(key)
+
+    def discard(self, key):
+        """Count one doctor fewer for a suggestion, removing it when no doctor is left."""
+        suggestion = self._suggestions.get(key)
+        if suggestion is None:
+            return
+        self._cache.clear()
+        suggestion['count'] -= 1
+        if suggestion['count'] > 0:
+            return
+        del self._suggestions[key]
+        for phrase in self._phrases(suggestion['label']):
+            path = [self._root]
+            for char in phrase:
+                path.append(path[-1][char])
+            path[-1][_TERMINAL].discard(key)
+            if not path[-1][_TERMINAL]:
+                del path[-1][_TERMINAL]
+            # Prune the nodes that no longer lead to any suggestion
+            for depth in range(len(phrase), 0, -1):
+                if path[depth]:
+                    break
+                del path[depth - 1][phrase[depth - 1]]
+
+    def suggest(self, prefix, limit=SUGGESTION_LIMIT):
+        """
+        Return up to limit suggestions with a word starting with prefix, most doctors first.
+        Returns:
+            list: Dicts with the 'kind', 'label' and 'count' of each suggestion, plus any
+            extra fields it was added with.
+        """
+        prefix = ' '.join(tokenize(prefix))
+        if not prefix:
+            return []
+        cached = self._cache.get((prefix, limit))
+        if cached is not None:
+            return cached
+
+        node = self._root
+        for char in prefix:
+            node = node.get(char)
+            if node is None:
+                return []
+
+        keys = set()
+        stack = [node]
+        while stack:
+            node = stack.pop()
+            for char, child in node.items():
+                if char == _TERMINAL:
+                    keys |= child
+                else:
+                    stack.append(child)
+
+        best = heapq.nsmallest(limit, keys, key=lambda key: (-self._suggestions[key]['count'],
+                                                              self._suggestions[key]['label'].lower()))
+        suggestions = [dict(self._suggestions[key]) for key in best]
+        self._cache.set((prefix, limit), suggestions)
+        return suggestions
+
+
+class DoctorSearchIndex:
+    """
+    Search index over approved doctors.
+    Free text is matched against name, specialty, hospital and city; every term must match
+    some field, by prefix or with at most one typo. Results can be narrowed by the gender,
+    city and specialty facets, whose counts are returned with each search.
+    """
+
+    TEXT_FIELDS = ('name', 'specialty', 'hospital', 'city')
+
+    def __init__(self):
+        self._lock = threading.RLock()
+        self._clear()
+        self.loaded_at = None
+        # The directory version the index reflects
+        self.version = None
+
+    def _clear(self):
+        # Doctors are indexed under small ints, which hash far faster than ObjectIds in set operations
+        self._keys = {}
+        self._next_key = 0
+        self._doctors = {}
+        self._tokens = {}
+        self._facets = {}
+        self._sort_keys = {}
+        self._fields = {field: _FieldIndex() for field in self.TEXT_FIELDS}
+        # Doctor ids per facet value, and the label shown for each value
+        self._facet_postings = {facet: defaultdict(set) for facet in FACETS}
+        self._facet_labels = {}
+        self._trie = SuggestionTrie()
+
+    @staticmethod
+    def _field_tokens(doctor):
+        address = doctor.get('address') or {}
+        return {
+            'name': set(tokenize(' '.join(filter(None, (doctor.get('first_name'), doctor.get('last_name'),
+                                                           doctor.get('username')))))),
+            'specialty': set(tokenize(doctor.get('specialty'))),
+            'hospital': set(tokenize(doctor.get('hospital'))),
+            'city': set(tokenize(address.get('city'))),
+        }
+
+    def __len__(self):
+        return len(self._doctors)
+
+    def load(self, doctors, version=None):
+        """Replace the whole index with the given doctor documents, as of a directory version."""
+        with self._lock:
+            self._clear()
+            for doctor in doctors:
+                self._add(doctor)
+            self.loaded_at = monotonic()
+            self.version = version
+
+    def _add(self, doctor):
+        doctor_id = self._next_key
+        self._next_key += 1
+        self._keys[doctor['_id']] = doctor_id
+        field_tokens = self._field_tokens(doctor)
+        for field, tokens in field_tokens.items():
+            self._fields[field].add(doctor_id, tokens)
+
+        facet_keys = {}
+        for facet, value in _facet_values(doctor).items():
+            key = _facet_key(value)
+            if key:
+                facet_keys[facet] = key
+                self._facet_postings[facet][key].add(doctor_id)
+                self._facet_labels[(facet, key)] = value
+
+        self._doctors[doctor_id] = doctor
+        self._tokens[doctor_id] = field_tokens
+        self._facets[doctor_id] = facet_keys
+        self._sort_keys[doctor_id] = ((doctor.get('last_name') or '').lower(),
+                                      (doctor.get('first_name') or '').lower())
+        for key, kind, label in self._suggestion_entries(doctor):
+            extra = {'doctor_id': str(doctor['_id'])} if kind == 'doctor' else {}
+            self._trie.add(key, kind, label, **extra)
+
+    @staticmethod
+    def _suggestion_entries(doctor):
+        # (key, kind, label) of every suggestion a doctor contributes to the typeahead
+        name = ' '.join(filter(None, (doctor.get('first_name'), doctor.get('last_name'))))
+        entries = [(('doctor', doctor['_id']), 'doctor', name or doctor.get('username') or '')]
+        for kind, value in (('specialty', doctor.get('specialty')), ('hospital', doctor.get('hospital')),
+                            ('city', (doctor.get('address') or {}).get('city'))):
+            value = (value or '').strip()
+            if _facet_key(value):
+                entries.append(((kind, _facet_key(value)), kind, value))
+        return [entry for entry in entries if _facet_key(entry[2])]
+
+    def remove(self, doctor_id):
+        with self._lock:
+            doctor_id = self._keys.pop(doctor_id, None)
+            if doctor_id is None:
+                return
+            field_tokens = self._tokens.pop(doctor_id)
+            for key, _, _ in self._suggestion_entries(self._doctors[doctor_id]):
+                self._trie.discard(key)
+            for field, tokens in field_tokens.items():
+                self._fields[field].remove(doctor_id, tokens)
+            for facet, key in self._facets.pop(doctor_id).items():
+                postings = self._facet_postings[facet][key]
+                postings.discard(doctor_id)
+                if not postings:
+                    del self._facet_postings[facet][key]
+                    del self._facet_labels[(facet, key)]
+            del self._doctors[doctor_id]
+            del self._sort_keys[doctor_id]
+
+    def upsert(self, doctor):
+        """Add a doctor to the index, replacing any earlier version of them."""
+        with self._lock:
+            self.remove(doctor['_id'])
+            self._add(doctor)
+
+    def suggest(self, prefix, limit=SUGGESTION_LIMIT):
+        """Typeahead suggestions of doctor names, specialties, hospitals and cities; see SuggestionTrie.suggest()."""
+        with self._lock:
+            return self._trie.suggest(prefix, limit)
+
+    def _match_text(self, terms, fields):
+        # Doctors matching every term in at least one of fields, with their summed scores
+        totals = None
+        for term in terms:
+            best = {}
+            for field in fields:
+                for doctor_id, score in self._fields[field].match(term).items():
+                    if best.get(doctor_id, 0) < score:
+                        best[doctor_id] = score
+            if totals is None:
+                totals = best
+            else:
+                totals = {doctor_id: totals[doctor_id] + score for doctor_id, score in best.items()
+                          if doctor_id in totals}
+            if not totals:
+                break
+        return totals
+
+    def search(self, text='', location='', filters=None, limit=None):
+        """
+        Search the index.
+        Args:
+            text (str): Free text matched against name, specialty, hospital and city.
+            location (str): Free text matched against the city only.
+            filters (dict): Accepted values per facet, e.g. {'gender': ['female']}; values
+                            within a facet are alternatives.
+            limit (int): Return at most this many doctors.
+        Returns:
+            dict: 'doctors' (best matches first), 'total', and 'facets', mapping each of FACETS
+            to a list of {'value', 'label', 'count'}. Each facet is counted with the other
+            facets' filters applied but not its own, so its alternatives stay visible.
+        """
+        wanted = {facet: {_facet_key(value) for value in values if value}
+                  for facet, values in (filters or {}).items() if facet in FACETS}
+
+        with self._lock:
+            # None while no text was given, meaning every doctor matches with score 0
+            scores = None
+            for query, fields in ((text, self.TEXT_FIELDS), (location, ('city',))):
+                terms = tokenize(query)
+                if terms:
+                    matched = self._match_text(terms, fields) or {}
+                    scores = matched if scores is None else {doctor_id: scores[doctor_id] + score
+                                                             for doctor_id, score in matched.items()
+                                                             if doctor_id in scores}
+            candidates = set(self._doctors if scores is None else scores)
+
+            selected = {}
+            for facet, keys in wanted.items():
+                if keys:
+                    postings = self._facet_postings[facet]
+                    selected[facet] = set().union(*(postings.get(key, ()) for key in keys))
+
+            results = candidates.intersection(*selected.values())
+
+            facets = {}
+            for facet in FACETS:
+                base = candidates.intersection(*(ids for other, ids in selected.items() if other != facet))
+                counts = [{'value': key, 'label': self._facet_labels[(facet, key)], 'count': len(base & ids)}
+                          for key, ids in self._facet_postings[facet].items()]
+                facets[facet] = sorted((count for count in counts if count['count']),
+                                       key=lambda f: (-f['count'], f['label'].lower()))
+
+            if scores is None:
+                ordered = sorted(results, key=self._sort_keys.__getitem__)
+            else:
+                ordered = sorted(results, key=lambda doctor_id: (-scores[doctor_id], self._sort_keys[doctor_id]))
+            doctors = [self._doctors[doctor_id] for doctor_id in ordered[:limit]]
+
+        return {'doctors': doctors, 'total': len(results), 'facets': facets}
+
+
+doctor_index = DoctorSearchIndex()
+
+# Search results are rendered as doctor cards, which also carry every searchable field
+_SEARCH_PROJECTION = PROJECTIONS['doctor_card']
+
+
+def get_doctor_index():
+    """Return the shared index, reloading it if the directory changed elsewhere or it is older than SEARCH_INDEX_MAX_AGE_SECONDS."""
+    version = get_directory_version()
+    if (doctor_index.loaded_at is None or doctor_index.version != version
+            or monotonic() - doctor_index.loaded_at > SEARCH_INDEX_MAX_AGE_SECONDS):
+        doctor_index.load(mongo.db.doctors.find({'registration_status': 'approved'}, _SEARCH_PROJECTION), version)
+    return doctor_index
+
+
+def search_doctors(text='', location='', filters=None, limit=None):
+    """Search the approved doctors; see DoctorSearchIndex.search()."""
+    return get_doctor_index().search(text, location, filters, limit)
+
+
+def suggest_doctors(prefix, limit=SUGGESTION_LIMIT):
+    """Typeahead suggestions for the doctor search boxes; see DoctorSearchIndex.suggest()."""
+    return get_doctor_index().suggest(prefix, limit)
+
+
+def refresh_doctor(doctor_id):
+    """
+    Record that a doctor was approved, edited or deleted.
+    Bumps the directory version, which invalidates the cached public pages, and re-reads the
+    doctor into this worker's index.
+    """
+    version = bump_directory_version()
+    doctor_oid = to_object_id(doctor_id)
+    if doctor_oid is None or doctor_index.loaded_at is None:
+        # Nothing to refresh before the first load, which reads every doctor anyway
+        return
+    doctor = mongo.db.doctors.find_one({'_id': doctor_oid, 'registration_status': 'approved'}, _SEARCH_PROJECTION)
+    with doctor_index._lock:
+        if doctor is None:
+            doctor_index.remove(doctor_oid)
+        else:
+            doctor_index.upsert(doctor)
+        # If this was the only change since the index was loaded, it is now current again;
+        # otherwise another worker changed the directory too and the next search reloads it
+        if doctor_index.version == version - 1:
+            doctor_index.version = version
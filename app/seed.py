@@ -0,0 +1,169 @@
+# Synthetic doctors, patients and appointments for load testing and benchmarks.
+# Documents are shaped like the ones the registration and booking forms create and are written
+# with insert_many in batches. Every seeded user's password is SEED_PASSWORD.
+import random
+from datetime import date, timedelta
+
+from bson import ObjectId
+
+from app.models import Appointment, ensure_indexes
+from app.passwords import hash_password
+from app.utils import rebuild_busy_dates
+
+SEED_PASSWORD = 'password'
+SEED_ADMIN_USERNAME = 'admin'
+SEED_BATCH_SIZE = 10000
+
+FIRST_NAMES = ['Anna', 'Ben', 'Chloe', 'Daniel', 'Emma', 'Farah', 'George', 'Hannah', 'Imran', 'Julia', 'Kwame',
+               'Laura', 'Mohammed', 'Nina', 'Oliver', 'Priya', 'Quentin', 'Rosa', 'Samuel', 'Tara', 'Usman',
+               'Victoria', 'William', 'Yasmin', 'Zoe']
+LAST_NAMES = ['Smith', 'Jones', 'Taylor', 'Brown', 'Williams', 'Wilson', 'Johnson', 'Davies', 'Patel', 'Wright',
+              'Robinson', 'Thompson', 'Evans', 'Walker', 'White', 'Roberts', 'Green', 'Hall', 'Khan', 'Lewis',
+              'Clarke', 'Jackson', 'Wood', 'Harris', 'Okafor', 'Martin', 'Cooper', 'Hill', 'Ward', 'Morris']
+SPECIALTIES = ['Cardiology', 'Dermatology', 'Neurology', 'Oncology', 'Pediatrics', 'Urology', 'Psychiatry',
+               'Radiology', 'Ophthalmology', 'Orthopedics', 'Gastroenterology', 'Endocrinology']
+CITIES = ['London', 'Leeds', 'Manchester', 'Bristol', 'Liverpool', 'Glasgow', 'Cardiff', 'Belfast', 'Sheffield',
+          'Nottingham', 'Leicester', 'Edinburgh']
+HOSPITALS = ['General', 'Royal', 'St Mary', 'Queen Elizabeth', 'City', 'Memorial', 'University', 'Victoria']
+STREETS = ['High Street', 'Station Road', 'Church Lane', 'Park Avenue', 'Victoria Road', 'Mill Lane']
+POSTCODE_AREAS = ['E', 'N', 'SW', 'LS', 'M', 'BS', 'L', 'G', 'CF', 'BT', 'S', 'NG']
+BLOOD_GROUPS = ['A+', 'A-', 'B+', 'B-', 'AB+', 'AB-', 'O+', 'O-']
+
+# Appointment slots offered by the default schedule: 30 minutes, Monday to Friday, 09:00-17:00
+SLOT_MINUTES = 30
+SLOTS_PER_DAY = 16
+FIRST_SLOT_MINUTES = 9 * 60
+# How the statuses of seeded appointments are spread
+APPOINTMENT_STATUSES = ('requested', 'approved', 'cancelled')
+APPOINTMENT_STATUS_WEIGHTS = (30, 55, 15)
+
+
+def _birth_date(rng, first_year, last_year):
+    return f'{rng.randint(first_year, last_year)}-{rng.randint(1, 12):02d}-{rng.randint(1, 28):02d}'
+
+
+def _address(rng):
+    postcode = f'{rng.choice(POSTCODE_AREAS)}{rng.randint(1, 20)} {rng.randint(1, 9)}{rng.choice("ABDEFGHJ")}' \
+               f'{rng.choice("LNPQRSTU")}'
+    return {'street': f'{rng.randint(1, 200)} {rng.choice(STREETS)}', 'city': rng.choice(CITIES),
+            'country': 'United Kingdom', 'postcode': postcode}
+
+
+def generate_doctors(count, password_hash, rng):
+    """Yield doctor documents; about nine in ten are approved."""
+    for i in range(count):
+        specialty = rng.choice(SPECIALTIES)
+        graduated = rng.randint(1980, 2015)
+        yield {
+            '_id': ObjectId(), 'username': f'doctor{i}', 'first_name': rng.choice(FIRST_NAMES),
+            'last_name': rng.choice(LAST_NAMES), 'date_of_birth': _birth_date(rng, 1950, 1990),
+            'gender': rng.choice(('male', 'female')), 'phone_number': f'07{i:09d}', 'email': f'doctor{i}@example.com',
+            'password': password_hash, 'address': _address(rng), 'hospital': f'{rng.choice(HOSPITALS)} Hospital',
+            'specialty': specialty, 'registration_status': 'approved' if rng.random() < 0.9 else 'pending',
+            'biography': f'Consultant in {specialty.lower()} with {2024 - graduated} years of practice.',
+            'education': [{'degree': 'MBBS', 'college_institute': f'University of {rng.choice(CITIES)}',
+                           'year_of_completion': str(graduated)}],
+            'experience': [{'hospital_name': f'{rng.choice(HOSPITALS)} Hospital', 'from': str(graduated + 1),
+                            'to': str(graduated + rng.randint(2, 8)), 'designation': 'Registrar'}],
+            'registration': [{'registration_name': f'GMC {rng.randint(1000000, 9999999)}',
+                              'year': str(graduated + 1)}],
+        }
+
+
+def generate_patients(count, password_hash, rng):
+    """Yield patient documents; most are approved, some are still pending."""
+    for i in range(count):
+        yield {
+            '_id': ObjectId(), 'username': f'patient{i}', 'first_name': rng.choice(FIRST_NAMES),
+            'last_name': rng.choice(LAST_NAMES), 'date_of_birth': _birth_date(rng, 1940, 2010),
+            'gender': rng.choice(('male', 'female')), 'phone_number': f'08{i:09d}', 'email': f'patient{i}@example.com',
+            'password': password_hash, 'address': _address(rng), 'blood_group': rng.choice(BLOOD_GROUPS),
+            'registration_status': 'approved' if rng.random() < 0.95 else 'pending',
+        }
+
+
+def _weekdays(first_day):
+    day = first_day
+    while True:
+        if day.weekday() < 5:
+            yield day
+        day += timedelta(days=1)
+
+
+def generate_appointments(count, doctor_ids, patient_ids, first_day, rng):
+    """
+    Yield appointment documents spread evenly over the doctors.
+    Each doctor's appointments fill consecutive 30 minute weekday slots from first_day on, so no
+    doctor slot is booked twice and the unique slot index accepts every appointment.
+    """
+    days = []
+    weekdays = _weekdays(first_day)
+    statuses = rng.choices(APPOINTMENT_STATUSES, APPOINTMENT_STATUS_WEIGHTS, k=count)
+    for i in range(count):
+        slot = i // len(doctor_ids)
+        day_index, slot_in_day = divmod(slot, SLOTS_PER_DAY)
+        while len(days) <= day_index:
+            days.append(next(weekdays).isoformat())
+        start = FIRST_SLOT_MINUTES + slot_in_day * SLOT_MINUTES
+        end = start + SLOT_MINUTES
+        time = f'{start // 60:02d}:{start % 60:02d} - {end // 60:02d}:{end % 60:02d}'
+        appointment = Appointment(rng.choice(patient_ids), doctor_ids[i % len(doctor_ids)], days[day_index], time,
+                                  status=statuses[i])
+        yield {'_id': ObjectId(), **appointment.to_document()}
+
+
+def insert_in_batches(collection, documents, batch_size=SEED_BATCH_SIZE):
+    """Insert documents with one insert_many per batch. Returns the ids of the inserted documents."""
+    ids = []
+    batch = []
+    for document in documents:
+        batch.append(document)
+        if len(batch) == batch_size:
+            collection.insert_many(batch, ordered=False)
+            ids.extend(item['_id'] for item in batch)
+            batch = []
+    if batch:
+        collection.insert_many(batch, ordered=False)
+        ids.extend(item['_id'] for item in batch)
+    return ids
+
+
+def seed_database(db, doctors, patients, appointments, batch_size=SEED_BATCH_SIZE, seed=0, history_days=90,
+                  log=print):
+    """
+    Fill a database with synthetic doctors, patients and appointments, then build the indexes
+    and the busy_dates collection. An admin named SEED_ADMIN_USERNAME is created if missing.
+    Args:
+        db: The database to fill.
+        doctors (int): Number of doctors.
+        patients (int): Number of patients.
+        appointments (int): Number of appointments; needs at least one doctor and one patient.
+        batch_size (int): Documents per insert_many.
+        seed (int): Seed of the random generator, so runs with the same arguments are comparable.
+        history_days (int): How far in the past the first appointments are.
+        log (callable): Receives progress messages.
+    Returns:
+        dict: The number of documents inserted per collection.
+    """
+    rng = random.Random(seed)
+    # Hashing is deliberately slow, so every seeded user shares one hash
+    password_hash = hash_password(SEED_PASSWORD)
+
+    log(f'Inserting {doctors} doctors')
+    doctor_ids = insert_in_batches(db.doctors, generate_doctors(doctors, password_hash, rng), batch_size)
+    log(f'Inserting {patients} patients')
+    patient_ids = insert_in_batches(db.patients, generate_patients(patients, password_hash, rng), batch_size)
+    appointment_ids = []
+    if appointments and doctor_ids and patient_ids:
+        log(f'Inserting {appointments} appointments')
+        first_day = date.today() - timedelta(days=history_days)
+        appointment_ids = insert_in_batches(
+            db.appointments, generate_appointments(appointments, doctor_ids, patient_ids, first_day, rng), batch_size)
+    db.admins.update_one({'username': SEED_ADMIN_USERNAME},
+                         {'$setOnInsert': {'username': SEED_ADMIN_USERNAME, 'password': password_hash}}, upsert=True)
+
+    # Indexes are built once the data is in, which is much faster than maintaining them per insert
+    log('Building indexes and busy dates')
+    ensure_indexes(db)
+    rebuild_busy_dates(db)
+    return {'doctors': len(doctor_ids), 'patients': len(patient_ids), 'appointments': len(appointment_ids)}
@@ -0,0 +1,45 @@
+// Typeahead for the doctor search boxes.
+// Inputs with a data-autocomplete URL fill their <datalist> from that endpoint as the user types;
+// picking a doctor's name goes straight to their booking page.
+document.addEventListener('DOMContentLoaded', function () {
+    document.querySelectorAll('input[data-autocomplete]').forEach(function (input) {
+        var list = document.getElementById(input.getAttribute('list'));
+        var suggestions = [];
+        var lastQuery = '';
+        var timer = null;
+
+        input.addEventListener('input', function () {
+            clearTimeout(timer);
+
+            var picked = suggestions.find(function (suggestion) { return suggestion.label === input.value; });
+            if (picked && picked.kind === 'doctor') {
+                window.location.href = picked.url;
+                return;
+            }
+
+            var query = input.value.trim();
+            if (query.length < 2 || query === lastQuery) {
+                return;
+            }
+            // Wait for a pause in typing before asking the server
+            timer = setTimeout(function () {
+                lastQuery = query;
+                fetch(input.dataset.autocomplete + '?q=' + encodeURIComponent(query))
+                    .then(function (response) { return response.ok ? response.json() : {suggestions: []}; })
+                    .then(function (data) {
+                        if (input.value.trim() !== query) {
+                            return;
+                        }
+                        suggestions = data.suggestions;
+                        list.innerHTML = '';
+                        suggestions.forEach(function (suggestion) {
+                            var option = document.createElement('option');
+                            option.value = suggestion.label;
+                            option.label = suggestion.kind.charAt(0).toUpperCase() + suggestion.kind.slice(1);
+                            list.appendChild(option);
+                        });
+                    });
+            }, 150);
+        });
+    });
+});
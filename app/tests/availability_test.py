@@ -0,0 +1,196 @@
+import unittest
+from datetime import date, datetime, timedelta
+from unittest.mock import MagicMock, patch
+
+from bson.objectid import ObjectId
+from pymongo.errors import DuplicateKeyError
+
+from app.availability import (CALENDAR_LOCK_ATTEMPTS, DEFAULT_SCHEDULE, CalendarBusyError, IntervalIndex, ScheduleError,
+                              build_schedule, calendar_locks, compile_schedule, get_appointment_conflict,
+                              get_available_slots, is_open_slot, parse_working_hours)
+
+
+class AvailabilityTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.db = MagicMock()
+        self.db.appointments.find.return_value = []
+        self.doctor = {'_id': ObjectId(), 'schedule': build_schedule(30, {
+            'monday': '09:00-10:30, 14:00-15:00',
+            'wednesday': '09:15-10:00',
+        })}
+        self.monday = date(2030, 1, 7)
+        self.now = datetime(2030, 1, 1, 12, 0)
+
+    def test_parse_working_hours(self):
+        self.assertEqual(parse_working_hours('09:00-12:30, 14:00-17:00'), [['09:00', '12:30'], ['14:00', '17:00']])
+        self.assertEqual(parse_working_hours(''), [])
+        for invalid in ('09:00', '17:00-09:00', '25:00-26:00', 'nine-five'):
+            with self.assertRaises(ScheduleError):
+                parse_working_hours(invalid)
+
+    def test_build_schedule_rejects_unknown_slot_duration(self):
+        with self.assertRaises(ScheduleError):
+            build_schedule(7, {})
+
+    def test_compile_schedule_bitmaps(self):
+        bitmaps = compile_schedule(self.doctor['schedule'])
+
+        # Monday: slots 18-20 (09:00-10:30) and 28-29 (14:00-15:00); Wednesday only fits 09:30-10:00
+        self.assertEqual(bitmaps[0], 0b111 << 18 | 0b11 << 28)
+        self.assertEqual(bitmaps[2], 1 << 19)
+        self.assertEqual(bitmaps[1], 0)
+
+    def test_open_slots_exclude_booked_appointments(self):
+        self.db.appointments.find.return_value = [
+            {'start': datetime(2030, 1, 7, 9, 30), 'end': datetime(2030, 1, 7, 10, 0)},
+            # Appointments that are not aligned to the slots block every slot they overlap
+            {'start': datetime(2030, 1, 7, 14, 15), 'end': datetime(2030, 1, 7, 14, 45)},
+        ]
+
+        availability = get_available_slots(self.doctor, self.monday, 3, now=self.now, db=self.db)
+
+        self.assertEqual(availability['slot_minutes'], 30)
+        self.assertEqual(availability['slots'], {
+            '2030-01-07': ['09:00 - 09:30', '10:00 - 10:30'],
+            '2030-01-08': [],
+            '2030-01-09': ['09:30 - 10:00'],
+        })
+        query = self.db.appointments.find.call_args[0][0]
+        self.assertEqual(query['start'], {'$gte': datetime(2030, 1, 7), '$lt': datetime(2030, 1, 10)})
+
+    def test_started_and_past_slots_are_not_offered(self):
+        now = datetime(2030, 1, 7, 9, 30, 5)
+
+        availability = get_available_slots(self.doctor, date(2030, 1, 6), 2, now=now, db=self.db)
+
+        self.assertEqual(availability['slots'], {
+            '2030-01-06': [],
+            '2030-01-07': ['10:00 - 10:30', '14:00 - 14:30', '14:30 - 15:00'],
+        })
+
+    def test_default_schedule_for_doctors_without_one(self):
+        availability = get_available_slots({'_id': ObjectId()}, self.monday, 1, now=self.now, db=self.db)
+
+        self.assertEqual(len(availability['slots']['2030-01-07']), 16)
+        self.assertEqual(availability['slot_minutes'], DEFAULT_SCHEDULE['slot_minutes'])
+
+    def test_is_open_slot(self):
+        schedule = self.doctor['schedule']
+
+        self.assertTrue(is_open_slot(schedule, datetime(2030, 1, 7, 9, 0), datetime(2030, 1, 7, 9, 30)))
+        self.assertFalse(is_open_slot(schedule, datetime(2030, 1, 7, 11, 0), datetime(2030, 1, 7, 11, 30)))
+        self.assertFalse(is_open_slot(schedule, datetime(2030, 1, 7, 9, 15), datetime(2030, 1, 7, 9, 45)))
+        self.assertFalse(is_open_slot(schedule, datetime(2030, 1, 7, 9, 0), datetime(2030, 1, 7, 10, 0)))
+
+
+class AppointmentConflictTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.db = MagicMock()
+        self.doctor_id = ObjectId()
+        self.patient_id = ObjectId()
+
+    def _at(self, hour, minute=0):
+        return datetime(2030, 1, 7, hour, minute)
+
+    def test_interval_index_overlaps(self):
+        index = IntervalIndex([(self._at(9), self._at(12, 30)), (self._at(14), self._at(15))])
+
+        self.assertTrue(index.overlaps(self._at(10), self._at(11)))
+        self.assertTrue(index.overlaps(self._at(12), self._at(14, 30)))
+        self.assertFalse(index.overlaps(self._at(12, 30), self._at(14)))
+        self.assertFalse(index.overlaps(self._at(8), self._at(9)))
+        self.assertFalse(index.overlaps(self._at(15), self._at(16)))
+
+    def test_interval_index_with_overlapping_intervals(self):
+        # A long interval hidden behind a shorter one that starts later must still be found
+        index = IntervalIndex([(self._at(9), self._at(17)), (self._at(10), self._at(10, 30))])
+        index.add(self._at(11), self._at(11, 30))
+
+        self.assertEqual(len(index), 3)
+        self.assertTrue(index.overlaps(self._at(16), self._at(16, 30)))
+
+    def test_interval_index_add_matches_rebuild(self):
+        index = IntervalIndex([(self._at(10), self._at(10, 30))])
+        index.add(self._at(9), self._at(11))
+        index.add(self._at(12), self._at(12, 15))
+        index.add(self._at(9, 30), self._at(13))
+
+        rebuilt = IntervalIndex(index._intervals)
+        self.assertEqual((index._starts, index._max_ends), (rebuilt._starts, rebuilt._max_ends))
+
+    def test_doctor_conflict(self):
+        self.db.appointments.find.return_value = [
+            {'doctor_id': self.doctor_id, 'patient_id': ObjectId(), 'start': self._at(9), 'end': self._at(12, 30)},
+        ]
+
+        conflict = get_appointment_conflict(self.doctor_id, self.patient_id, self._at(10), self._at(11), db=self.db)
+
+        self.assertEqual(conflict, 'doctor')
+        self.assertEqual(self.db.appointments.find.call_args.kwargs['sort'], [('start', 1)])
+        query = self.db.appointments.find.call_args[0][0]
+        self.assertEqual(query['$or'], [{'doctor_id': self.doctor_id}, {'patient_id': self.patient_id}])
+        self.assertEqual(query['start'], {'$gte': datetime(2030, 1, 6), '$lt': self._at(11)})
+
+    def test_patient_conflict_with_another_doctor(self):
+        self.db.appointments.find.return_value = [
+            {'doctor_id': ObjectId(), 'patient_id': self.patient_id, 'start': self._at(10, 15), 'end': self._at(10, 45)},
+        ]
+
+        conflict = get_appointment_conflict(self.doctor_id, self.patient_id, self._at(10), self._at(10, 30), db=self.db)
+
+        self.assertEqual(conflict, 'patient')
+
+    def test_no_conflict_for_adjacent_appointments(self):
+        self.db.appointments.find.return_value = [
+            {'doctor_id': self.doctor_id, 'patient_id': self.patient_id, 'start': self._at(9), 'end': self._at(10)},
+            # Booked before appointments had an end; occupies only its first minute
+            {'doctor_id': self.doctor_id, 'patient_id': ObjectId(), 'start': self._at(11), 'end': self._at(11)},
+        ]
+
+        conflict = get_appointment_conflict(self.doctor_id, self.patient_id, self._at(10), self._at(11), db=self.db)
+
+        self.assertIsNone(conflict)
+        self.assertEqual(get_appointment_conflict(self.doctor_id, None, self._at(10, 30),
+                                                  self._at(10, 30) + timedelta(minutes=45), db=self.db), 'doctor')
+
+    def test_calendar_locks_are_taken_and_released(self):
+        with calendar_locks(date(2030, 1, 7), self.doctor_id, self.patient_id, db=self.db):
+            lock_ids = [call.args[0]['_id'] for call in self.db.calendar_locks.insert_one.call_args_list]
+            self.db.calendar_locks.delete_many.assert_not_called()
+
+        self.assertEqual(lock_ids, [f'doctor:{self.doctor_id}:2030-01-07', f'patient:{self.patient_id}:2030-01-07'])
+        query = self.db.calendar_locks.delete_many.call_args.args[0]
+        self.assertEqual(query['_id'], {'$in': lock_ids})
+        self.assertEqual(query['owner'], self.db.calendar_locks.insert_one.call_args.args[0]['owner'])
+
+    @patch('app.availability.sleep')
+    def test_held_calendar_lock_makes_booking_busy(self, mock_sleep):
+        self.db.calendar_locks.insert_one.side_effect = [None, DuplicateKeyError('held')] + \
+            [DuplicateKeyError('held')] * CALENDAR_LOCK_ATTEMPTS
+        self.db.calendar_locks.delete_one.return_value.deleted_count = 0
+
+        with self.assertRaises(CalendarBusyError):
+            with calendar_locks(date(2030, 1, 7), self.doctor_id, self.patient_id, db=self.db):
+                self.fail('The block must not run without both locks')
+
+        self.assertEqual(mock_sleep.call_count, CALENDAR_LOCK_ATTEMPTS)
+        # The lock that was taken is released again
+        self.assertEqual(self.db.calendar_locks.delete_many.call_args.args[0]['_id'],
+                         {'$in': [f'doctor:{self.doctor_id}:2030-01-07']})
+
+    @patch('app.availability.sleep')
+    def test_expired_calendar_lock_is_taken_over(self, mock_sleep):
+        self.db.calendar_locks.insert_one.side_effect = [DuplicateKeyError('held'), None]
+        self.db.calendar_locks.delete_one.return_value.deleted_count = 1
+
+        with calendar_locks(date(2030, 1, 7), self.doctor_id, db=self.db):
+            pass
+
+        mock_sleep.assert_not_called()
+        self.assertEqual(self.db.calendar_locks.insert_one.call_count, 2)
+
+
+if __name__ == '__main__':
+    unittest.main()
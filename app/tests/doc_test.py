@@ -5,6 +5,8 @@ from bson import ObjectId
 from werkzeug.security import generate_password_hash
 
 from app import app  # Ensure this correctly imports your Flask app
+from app.models import Doctor
+from app.passwords import PASSWORD_HASH_METHOD
 from flask import url_for, json
 
 
@@ -47,26 +49,27 @@ class DoctorRegistrationTestCase(unittest.TestCase):
         assert response.status_code == 400
         assert b"Phone number must be exactly 11 digits" in response.data
 
-    @patch('app.mongo.db.doctors.find_one')
-    def test_doctor_login_success(self, mock_find_one):
-        mock_find_one.return_value = {
+    @patch('app.routes.mongo')
+    def test_doctor_login_success(self, mock_mongo):
+        mock_mongo.db.doctors.find_one.return_value = {
             '_id': ObjectId('65fd6c5a0d6fbf0263c56072'),
             'phone_number': '0798765563',
-            'password': generate_password_hash('validpassword')
+            # Hashed with the current method, so the login does not rehash it in the background
+            'password': generate_password_hash('validpassword', PASSWORD_HASH_METHOD)
         }
 
         response = self.client.post('/doctor_login', data={
             'phone_number': '0798765563',
             'password': 'validpassword'
-        }, follow_redirects=True)
+        })
 
         # Check for redirect to doctor_dashboard
-        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.status_code, 302)
+        self.assertTrue(response.location.endswith('/doctor_dashboard'))
 
-    @patch('app.mongo.db.doctors.find_one')
-    @patch('app.utils.get_appointment_requests_for_doctor')
-    @patch('app.utils.get_fixed_appointments_for_doctor')
-    def test_doctor_dashboard_access(self, mock_get_fixed_appointments, mock_get_appointment_requests, mock_find_one):
+    @patch('app.routes.Doctor.find_one')
+    @patch('app.routes.get_doctor_dashboard_data')
+    def test_doctor_dashboard_access(self, mock_get_dashboard_data, mock_find_one):
         # Setup mock data for doctor and appointments
         doctor_id = '66003d720cfcff3c4b8a0357'
         mock_doctor = {
@@ -84,9 +87,12 @@ class DoctorRegistrationTestCase(unittest.TestCase):
         }]
 
         # Mock database responses
-        mock_find_one.return_value = mock_doctor
-        mock_get_appointment_requests.return_value = mock_appointment_requests
-        mock_get_fixed_appointments.return_value = mock_fixed_appointments
+        mock_find_one.return_value = Doctor.from_document(mock_doctor)
+        mock_get_dashboard_data.return_value = {
+            'appointment_requests': mock_appointment_requests,
+            'fixed_appointments': mock_fixed_appointments,
+            'counts': {'requested': 1, 'approved': 1},
+        }
 
         with self.client.session_transaction() as sess:
             sess['doctor_id'] = doctor_id
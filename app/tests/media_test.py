@@ -0,0 +1,122 @@
+import io
+import os
+import tempfile
+import unittest
+from unittest.mock import patch
+
+from bson.objectid import ObjectId
+from PIL import Image
+from werkzeug.datastructures import FileStorage
+
+from app import app
+from app.media import (PROFILE_IMAGES, DOCTOR_IMAGE_VARIANT_WIDTHS, ImageRejectedError, resize_image,
+                       submit_profile_image, validate_image, generate_doctor_image_variants)
+from app.models import Doctor, Patient
+
+
+def _jpeg_bytes(size):
+    output = io.BytesIO()
+    Image.new('RGB', size, 'red').save(output, format='JPEG')
+    return output.getvalue()
+
+
+def _upload(data):
+    return FileStorage(io.BytesIO(data), filename='photo.jpg')
+
+
+class ProfileImageTestCase(unittest.TestCase):
+
+    def setUp(self):
+        # Store images on the local filesystem instead of Cloudinary
+        self.media_dir = tempfile.TemporaryDirectory()
+        self.config = patch.dict(app.config, {'MEDIA_BACKEND': 'local', 'MEDIA_LOCAL_DIR': self.media_dir.name})
+        self.config.start()
+
+    def tearDown(self):
+        self.config.stop()
+        self.media_dir.cleanup()
+
+    def test_resize_large_jpeg(self):
+        size = PROFILE_IMAGES['doctors']['size']
+        resized = Image.open(io.BytesIO(resize_image(_jpeg_bytes((4000, 3000)), size)))
+
+        self.assertEqual(resized.size, size)
+        self.assertEqual(resized.format, 'JPEG')
+
+    def test_resize_keeping_aspect(self):
+        resized = Image.open(io.BytesIO(resize_image(_jpeg_bytes((1600, 800)), (400, 400), keep_aspect=True)))
+
+        self.assertEqual(resized.size, (400, 200))
+
+    @patch('app.media.refresh_doctor')
+    @patch('app.media.mongo')
+    def test_image_is_stored_under_content_key(self, mock_mongo, mock_refresh):
+        mock_mongo.db.media.find_one.return_value = None
+        doctor = Doctor.from_document({'_id': ObjectId()})
+
+        image_url = submit_profile_image('doctors', doctor, _upload(_jpeg_bytes((800, 600)))).result(timeout=10)
+
+        filename = os.path.basename(image_url)
+        self.assertTrue(image_url.startswith('/static/uploads/'))
+        self.assertTrue(os.path.exists(os.path.join(self.media_dir.name, filename)))
+        update = mock_mongo.db.__getitem__.return_value.update_one.call_args.args
+        self.assertEqual(update[0], {'_id': doctor._id})
+        self.assertEqual(update[1]['$set']['image_url'], image_url)
+        self.assertEqual(update[1]['$set']['image_hash'], filename[:-len('.jpg')])
+        mock_refresh.assert_called_once_with(doctor._id)
+
+    @patch('app.media.mongo')
+    def test_doctor_variants_in_each_width_and_format(self, mock_mongo):
+        mock_mongo.db.media.find_one.return_value = None
+
+        variants = generate_doctor_image_variants(_jpeg_bytes((1200, 1400)))
+
+        self.assertEqual([(v['width'], v['format']) for v in variants],
+                         [(w, f) for w in DOCTOR_IMAGE_VARIANT_WIDTHS for f in ('jpeg', 'webp')])
+        webp = [v for v in variants if v['format'] == 'webp'][0]
+        with Image.open(os.path.join(self.media_dir.name, os.path.basename(webp['url']))) as img:
+            self.assertEqual(img.format, 'WEBP')
+            self.assertEqual(img.width, DOCTOR_IMAGE_VARIANT_WIDTHS[0])
+
+    @patch('app.media.mongo')
+    def test_doctor_variants_are_not_upscaled(self, mock_mongo):
+        mock_mongo.db.media.find_one.return_value = None
+
+        # The stored main photo, as the backfill reads it
+        variants = generate_doctor_image_variants(_jpeg_bytes(PROFILE_IMAGES['doctors']['size']))
+
+        self.assertEqual(sorted({v['width'] for v in variants}), [185, 369])
+
+    @patch('app.media.mongo')
+    def test_known_content_is_not_uploaded_again(self, mock_mongo):
+        mock_mongo.db.media.find_one.return_value = {'url': 'https://example.com/existing.jpg'}
+        patient = Patient.from_document({'_id': ObjectId()})
+
+        image_url = submit_profile_image('patients', patient, _upload(_jpeg_bytes((800, 600)))).result(timeout=10)
+
+        self.assertEqual(image_url, 'https://example.com/existing.jpg')
+        self.assertEqual(os.listdir(self.media_dir.name), [])
+
+    @patch('app.media.refresh_doctor')
+    @patch('app.media.mongo')
+    def test_unchanged_photo_is_skipped(self, mock_mongo, mock_refresh):
+        data = _jpeg_bytes((800, 600))
+        doctor = Doctor.from_document({'_id': ObjectId()})
+        submit_profile_image('doctors', doctor, _upload(data)).result(timeout=10)
+        doctor.image_hash = mock_mongo.db.__getitem__.return_value.update_one.call_args.args[1]['$set']['image_hash']
+
+        self.assertIsNone(submit_profile_image('doctors', doctor, _upload(data)))
+
+    def test_rejects_oversized_and_invalid_uploads(self):
+        with self.assertRaises(ImageRejectedError):
+            validate_image(b'not an image')
+        with patch('app.media.MAX_IMAGE_DIMENSION', 100):
+            with self.assertRaises(ImageRejectedError):
+                validate_image(_jpeg_bytes((200, 50)))
+        with patch('app.media.MAX_IMAGE_BYTES', 10):
+            with self.assertRaises(ImageRejectedError):
+                validate_image(_jpeg_bytes((20, 20)))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,75 @@
+import unittest
+from types import SimpleNamespace
+from unittest.mock import patch
+
+from app import app
+from app.metrics import Counter, Histogram, MetricsRegistry, logins, pool_in_use, pool_listener
+
+
+class MetricsRegistryTestCase(unittest.TestCase):
+
+    def test_histogram_buckets_are_cumulative(self):
+        histogram = Histogram('latency_seconds', 'Latency.', ('endpoint',), buckets=(0.1, 1.0))
+        for value in (0.05, 0.1, 0.5, 3.0):
+            histogram.observe(value, 'home')
+
+        self.assertEqual(histogram.render().splitlines()[2:], [
+            'latency_seconds_bucket{endpoint="home",le="0.1"} 2',
+            'latency_seconds_bucket{endpoint="home",le="1.0"} 3',
+            'latency_seconds_bucket{endpoint="home",le="+Inf"} 4',
+            'latency_seconds_sum{endpoint="home"} 3.65',
+            'latency_seconds_count{endpoint="home"} 4',
+        ])
+
+    def test_counter_labels_are_checked_and_escaped(self):
+        counter = Counter('events_total', 'Events.', ('kind',))
+        counter.inc('say "hi"')
+        counter.inc('say "hi"', amount=2)
+
+        self.assertIn('events_total{kind="say \\"hi\\""} 3', counter.render())
+        with self.assertRaises(ValueError):
+            counter.inc()
+
+    def test_names_are_unique(self):
+        registry = MetricsRegistry()
+        registry.gauge('size', 'Size.')
+
+        with self.assertRaises(ValueError):
+            registry.counter('size', 'Size.')
+
+    def test_pool_listener_tracks_checked_out_connections(self):
+        event = SimpleNamespace(address=('db.example', 27017))
+        pool_listener.connection_checked_out(event)
+        pool_listener.connection_checked_out(event)
+        pool_listener.connection_checked_in(event)
+
+        self.assertIn('mongo_pool_connections_in_use{address="db.example:27017"} 1', pool_in_use.render())
+
+
+class MetricsEndpointTestCase(unittest.TestCase):
+
+    def setUp(self):
+        app.config['WTF_CSRF_ENABLED'] = False
+        self.client = app.test_client()
+
+    @patch('app.routes.verify_password', return_value=False)
+    @patch('app.routes.mongo')
+    def test_scrape_reports_requests_and_logins(self, mock_mongo, mock_verify):
+        mock_mongo.db.doctors.find_one.return_value = None
+        self.client.post('/doctor_login', data={'phone_number': '0700', 'password': 'wrong'})
+        self.client.get('/no/such/page')
+
+        response = self.client.get('/metrics')
+        text = response.get_data(as_text=True)
+
+        self.assertTrue(response.content_type.startswith('text/plain; version=0.0.4'))
+        self.assertIn('http_request_duration_seconds_count{endpoint="doctor_login",method="POST",status="200"}',
+                      text)
+        self.assertIn('http_request_duration_seconds_count{endpoint="unmatched",method="GET",status="404"}', text)
+        self.assertRegex(text, r'logins_total\{role="doctor",result="failure"\} [1-9]')
+        self.assertIn('# TYPE mongo_pool_max_size gauge', text)
+        self.assertIn(logins.render(), text)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,157 @@
+import unittest
+from unittest.mock import MagicMock, patch
+
+from bson.objectid import ObjectId
+
+from app import app, load_user
+from app.models import INDEXES, Admin, Appointment, Doctor, check_indexes
+from app.utils import invalidate_cached_user
+
+
+def _server_indexes(collection_name):
+    indexes = [{'name': '_id_', 'key': {'_id': 1}}]
+    for model in INDEXES[collection_name]:
+        document = dict(model.document)
+        key = dict(document['key'])
+        if 'text' in key.values():
+            document['key'] = {'_fts': 'text', '_ftsx': 1}
+            document['weights'] = {field: 1 for field in key}
+        indexes.append(document)
+    return indexes
+
+
+class CheckIndexesTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.collections = {name: MagicMock() for name in INDEXES}
+        for name, collection in self.collections.items():
+            collection.list_indexes.return_value = _server_indexes(name)
+        self.db = MagicMock()
+        self.db.__getitem__.side_effect = self.collections.__getitem__
+
+    def test_no_drift_when_indexes_match(self):
+        self.assertEqual(check_indexes(self.db), {})
+
+    def test_reports_missing_changed_and_unexpected(self):
+        indexes = _server_indexes('patients')
+        indexes = [index for index in indexes if index['name'] != 'username']
+        indexes[1] = {'name': 'phone_number', 'key': {'phone_number': -1}}
+        indexes.append({'name': 'legacy', 'key': {'email': 1}})
+        self.collections['patients'].list_indexes.return_value = indexes
+
+        drift = check_indexes(self.db)
+
+        self.assertEqual(drift, {'patients': {'missing': ['username'],
+                                              'changed': ['phone_number'],
+                                              'unexpected': ['legacy']}})
+
+
+class LoadUserTestCase(unittest.TestCase):
+
+    def setUp(self):
+        invalidate_cached_user('admin')
+
+    def tearDown(self):
+        invalidate_cached_user('admin')
+
+    def test_session_id_is_tagged_with_role(self):
+        self.assertEqual(Admin('alice').get_id(), 'admin:alice')
+
+    @patch('app.models.Patient.get')
+    @patch('app.models.Doctor.get')
+    @patch('app.models.Admin.get', return_value=Admin('alice'))
+    def test_tagged_id_reads_one_collection_and_is_cached(self, mock_admin, mock_doctor, mock_patient):
+        self.assertEqual(load_user('admin:alice').username, 'alice')
+        self.assertEqual(load_user('admin:alice').username, 'alice')
+
+        mock_admin.assert_called_once_with('alice')
+        mock_patient.assert_not_called()
+        mock_doctor.assert_not_called()
+
+        invalidate_cached_user('admin', 'alice')
+        load_user('admin:alice')
+        self.assertEqual(mock_admin.call_count, 2)
+
+    @patch('app.models.Patient.get', return_value=None)
+    @patch('app.models.Doctor.get', return_value=None)
+    @patch('app.models.Admin.get', return_value=Admin('alice'))
+    def test_untagged_id_falls_back_to_every_collection(self, mock_admin, mock_doctor, mock_patient):
+        self.assertEqual(load_user('alice').username, 'alice')
+
+        mock_patient.assert_called_once_with('alice')
+        mock_doctor.assert_called_once_with('alice')
+
+
+class ModelTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.doctor_id = ObjectId()
+        self.document = {'_id': self.doctor_id, 'username': 'drwho', 'first_name': 'Ann', 'last_name': 'Smith',
+                         'specialty': 'Cardiology', 'password': 'hash'}
+
+    def test_from_document_fills_defaults_without_changes(self):
+        doctor = Doctor.from_document(self.document)
+
+        self.assertEqual((doctor._id, doctor.first_name, doctor.hospital), (self.doctor_id, 'Ann', None))
+        self.assertEqual(doctor.registration_status, 'pending')
+        self.assertEqual(doctor.to_document(), {})
+        self.assertFalse(hasattr(doctor, '__dict__'))
+
+    def test_to_document_holds_only_changed_fields(self):
+        doctor = Doctor.from_document(self.document)
+        doctor.first_name = 'Ann'
+        doctor.last_name = 'Jones'
+
+        self.assertEqual(doctor.to_document(), {'last_name': 'Jones'})
+
+    @patch('app.models.mongo')
+    def test_save_sets_changed_fields_once(self, mock_mongo):
+        doctor = Doctor.from_document(self.document)
+        doctor.specialty = 'Neurology'
+
+        self.assertTrue(doctor.save())
+        self.assertFalse(doctor.save())
+        mock_mongo.db.__getitem__.return_value.update_one.assert_called_once_with(
+            {'_id': self.doctor_id}, {'$set': {'specialty': 'Neurology'}})
+
+    @patch('app.models.mongo')
+    def test_lazy_fields_are_read_on_first_access(self, mock_mongo):
+        doctors = mock_mongo.db.__getitem__.return_value
+        doctors.find_one.return_value = {'_id': self.doctor_id, 'education': [{'degree': 'MD'}]}
+        doctor = Doctor.from_document(self.document)
+
+        self.assertEqual(doctor.education, [{'degree': 'MD'}])
+        self.assertEqual(doctor.experience, [])
+        doctors.find_one.assert_called_once_with(
+            {'_id': self.doctor_id}, {'education': 1, 'experience': 1, 'registration': 1})
+        self.assertEqual(Doctor.from_document({**self.document, 'education': []}).education, [])
+        self.assertEqual(doctors.find_one.call_count, 1)
+
+    def test_new_instance_documents_every_field(self):
+        appointment = Appointment(ObjectId(), ObjectId(), '2030-01-01', '09:00 - 09:30')
+
+        document = appointment.to_document()
+
+        self.assertEqual(document['status'], 'requested')
+        self.assertEqual(set(document), set(Appointment.fields))
+
+    @patch('app.routes.refresh_doctor')
+    @patch('app.models.mongo')
+    def test_profile_settings_write_only_changed_fields(self, mock_mongo, mock_refresh):
+        doctors = mock_mongo.db.__getitem__.return_value
+        doctors.find_one.return_value = self.document
+        app.config['WTF_CSRF_ENABLED'] = False
+        client = app.test_client()
+        with client.session_transaction() as session:
+            session['doctor_id'] = str(self.doctor_id)
+
+        client.post('/doctor_profile_settings', data={'first_name': 'Ann', 'last_name': 'Jones'})
+
+        update = doctors.update_one.call_args.args[1]['$set']
+        self.assertEqual(update['last_name'], 'Jones')
+        self.assertNotIn('first_name', update)
+        mock_refresh.assert_called_once_with(self.doctor_id)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,77 @@
+import unittest
+from unittest.mock import patch
+
+from werkzeug.datastructures import MultiDict
+
+from app import app
+from app import page_cache
+from app.page_cache import PageCache, cached_html
+
+
+class PageCacheTestCase(unittest.TestCase):
+
+    def setUp(self):
+        page_cache.page_cache.clear()
+        patcher = patch('app.page_cache.mongo')
+        self.mock_mongo = patcher.start()
+        self.addCleanup(patcher.stop)
+        self.mock_mongo.db.counters.find_one.return_value = {'version': 1}
+        # Make every test read the version from the (mocked) database first
+        page_cache._directory_version = None
+
+    def test_lru_eviction_by_entries_and_size(self):
+        cache = PageCache(max_bytes=10000, max_entries=2)
+        cache.set('a', 'x' * 100)
+        cache.set('b', 'y' * 100)
+        cache.get('a')
+        cache.set('c', 'z' * 100)
+
+        # 'b' was least recently used
+        self.assertIsNone(cache.get('b'))
+        self.assertIsNotNone(cache.get('a'))
+
+        cache = PageCache(max_bytes=5000, max_entries=100)
+        for key in range(10):
+            cache.set(key, 'x' * 1000)
+        self.assertLessEqual(cache.size, 5000)
+        self.assertIsNone(cache.get(0))
+        self.assertIsNotNone(cache.get(9))
+
+        # Entries larger than a quarter of the cache are not stored at all
+        cache.set('huge', 'x' * 2000)
+        self.assertIsNone(cache.get('huge'))
+
+    def test_cached_html_keyed_by_args_and_version(self):
+        renders = []
+
+        def render():
+            renders.append(1)
+            return '<p>page</p>'
+
+        html, hit = cached_html('page', MultiDict([('gender', 'male'), ('city', 'leeds')]), render)
+        self.assertEqual((str(html), hit), ('<p>page</p>', False))
+        # The order of query arguments does not matter
+        self.assertTrue(cached_html('page', MultiDict([('city', 'leeds'), ('gender', 'male')]), render)[1])
+        self.assertFalse(cached_html('page', MultiDict([('city', 'york')]), render)[1])
+        self.assertEqual(len(renders), 2)
+
+        self.mock_mongo.db.counters.find_one_and_update.return_value = {'version': 2}
+        self.assertEqual(page_cache.bump_directory_version(), 2)
+        self.assertEqual(len(page_cache.page_cache), 0)
+        self.assertFalse(cached_html('page', MultiDict([('city', 'leeds'), ('gender', 'male')]), render)[1])
+
+    @patch('app.routes.mongo')
+    def test_home_is_rendered_once_per_version(self, mock_routes_mongo):
+        mock_routes_mongo.db.doctors.find.return_value = []
+        client = app.test_client()
+
+        self.assertEqual(client.get('/').headers['X-Page-Cache'], 'miss')
+        response = client.get('/')
+
+        self.assertEqual(response.headers['X-Page-Cache'], 'hit')
+        self.assertIn(b'Search Doctor', response.data)
+        self.assertEqual(mock_routes_mongo.db.doctors.find.call_count, 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
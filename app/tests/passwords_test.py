@@ -0,0 +1,56 @@
+import threading
+import unittest
+from unittest.mock import patch
+
+from werkzeug.security import generate_password_hash
+
+from app import passwords
+
+
+class PasswordHashingTestCase(unittest.TestCase):
+
+    def test_hash_and_verify_in_pool(self):
+        stored_hash = passwords.hash_password('s3cret')
+
+        self.assertTrue(stored_hash.startswith(passwords.PASSWORD_HASH_METHOD + '$'))
+        self.assertTrue(passwords.verify_password(stored_hash, 's3cret'))
+        self.assertFalse(passwords.verify_password(stored_hash, 'wrong'))
+
+    def test_needs_rehash_for_outdated_parameters(self):
+        self.assertTrue(passwords.needs_rehash(generate_password_hash('s3cret', 'pbkdf2:sha256:1000')))
+        self.assertTrue(passwords.needs_rehash(generate_password_hash('s3cret', 'pbkdf2:sha1:2000000')))
+        self.assertFalse(passwords.needs_rehash(generate_password_hash('s3cret', passwords.PASSWORD_HASH_METHOD)))
+
+    def test_stronger_or_equal_hashes_are_not_downgraded(self):
+        # Werkzeug's own defaults must never be rewritten with fewer iterations
+        self.assertFalse(passwords.needs_rehash(generate_password_hash('s3cret', 'pbkdf2:sha256')))
+        self.assertFalse(passwords.needs_rehash(generate_password_hash('s3cret')))
+        self.assertFalse(passwords.needs_rehash(
+            generate_password_hash('s3cret', f'pbkdf2:sha512:{passwords.PASSWORD_HASH_ITERATIONS * 2}')))
+        self.assertGreaterEqual(passwords.PASSWORD_HASH_ITERATIONS, 1_000_000)
+
+    def test_outdated_hash_is_saved_after_rehash(self):
+        saved = []
+        done = threading.Event()
+
+        def save(new_hash):
+            saved.append(new_hash)
+            done.set()
+
+        scheduled = passwords.rehash_if_outdated(generate_password_hash('s3cret', 'pbkdf2:sha256:1000'), 's3cret', save)
+
+        self.assertTrue(scheduled)
+        self.assertTrue(done.wait(passwords.HASH_TIMEOUT_SECONDS))
+        self.assertFalse(passwords.needs_rehash(saved[0]))
+        self.assertTrue(passwords.verify_password(saved[0], 's3cret'))
+
+    @patch.object(passwords, '_queue_slots')
+    def test_saturated_pool_raises_busy(self, mock_slots):
+        mock_slots.acquire.return_value = False
+
+        with self.assertRaises(passwords.HashingBusyError):
+            passwords.hash_password('s3cret')
+
+
+if __name__ == '__main__':
+    unittest.main()
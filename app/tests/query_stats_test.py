@@ -0,0 +1,120 @@
+import unittest
+from types import SimpleNamespace
+from unittest.mock import patch
+
+from bson.objectid import ObjectId
+
+from app import app
+from app.query_stats import (QUERY_REPEAT_THRESHOLD, STATS_HEADER, QueryStats, _current_stats, query_listener,
+                             query_shape)
+from app.utils import fetch_concurrently
+
+
+def _find(collection, query, documents=1):
+    # Report a find the way PyMongo's command monitoring would
+    query_listener.started(SimpleNamespace(command_name='find', command={'find': collection, 'filter': query}))
+    query_listener.succeeded(SimpleNamespace(duration_micros=1500,
+                                             reply={'cursor': {'firstBatch': [{}] * documents}}))
+
+
+class QueryShapeTestCase(unittest.TestCase):
+
+    def test_values_are_replaced(self):
+        self.assertEqual(query_shape('find', {'find': 'doctors', 'filter': {'_id': ObjectId()}}),
+                         'find doctors {"_id": "?"}')
+        self.assertEqual(query_shape('find', {'find': 'doctors', 'filter': {'_id': {'$in': [1, 2, 3]}}}),
+                         query_shape('find', {'find': 'doctors', 'filter': {'_id': {'$in': [4]}}}))
+
+    def test_pipelines_keep_their_stages(self):
+        shape = query_shape('aggregate', {'aggregate': 'appointments',
+                                          'pipeline': [{'$match': {'doctor_id': 1}}, {'$limit': 5}]})
+
+        self.assertEqual(shape, 'aggregate appointments [{"$match": {"doctor_id": "?"}}, {"$limit": "?"}]')
+
+    def test_bookkeeping_commands_have_no_shape(self):
+        self.assertIsNone(query_shape('getMore', {'getMore': 123, 'collection': 'doctors'}))
+        self.assertEqual(query_shape('insert', {'insert': 'appointments'}), 'insert appointments')
+
+
+class QueryStatsTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.stats = QueryStats()
+        self.token = _current_stats.set(self.stats)
+
+    def tearDown(self):
+        _current_stats.reset(self.token)
+
+    def test_listener_records_current_request(self):
+        _find('doctors', {'_id': 1}, documents=3)
+        query_listener.failed(SimpleNamespace(duration_micros=500))
+
+        self.assertEqual((self.stats.commands, self.stats.db_ms, self.stats.documents), (1, 2.0, 3))
+        self.assertEqual(self.stats.header(), 'commands=1; db_ms=2.0; documents=3; repeated=0')
+
+    def test_repeated_shapes_are_reported(self):
+        for _ in range(QUERY_REPEAT_THRESHOLD + 1):
+            _find('doctors', {'_id': ObjectId()})
+        _find('patients', {'_id': ObjectId()})
+
+        self.assertEqual(self.stats.repeated(), [('find doctors {"_id": "?"}', QUERY_REPEAT_THRESHOLD + 1)])
+
+    def test_concurrent_queries_count_towards_request(self):
+        fetch_concurrently({'a': lambda: _find('doctors', {}), 'b': lambda: _find('patients', {})})
+
+        self.assertEqual(self.stats.commands, 2)
+
+    def test_commands_outside_requests_are_ignored(self):
+        _current_stats.set(None)
+        _find('doctors', {})
+
+        self.assertEqual(self.stats.commands, 0)
+
+
+class QueryStatsRequestTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.client = app.test_client()
+
+    def tearDown(self):
+        app.config['QUERY_STATS_HEADER'] = False
+
+    def _suggest_with_n_plus_one(self, prefix, limit):
+        for _ in range(QUERY_REPEAT_THRESHOLD + 1):
+            _find('doctors', {'_id': ObjectId()})
+        return []
+
+    @patch('app.routes.suggest_doctors')
+    def test_header_and_n_plus_one_warning(self, mock_suggest):
+        mock_suggest.side_effect = self._suggest_with_n_plus_one
+        app.config['QUERY_STATS_HEADER'] = True
+
+        with self.assertLogs(level='WARNING') as logs:
+            response = self.client.get('/search_doctor/suggest?q=an')
+
+        self.assertEqual(response.headers[STATS_HEADER], 'commands=6; db_ms=9.0; documents=6; repeated=1')
+        self.assertIn('likely an N+1: find doctors {"_id": "?"}', logs.output[0])
+
+    @patch('app.routes.suggest_doctors', return_value=[])
+    def test_header_is_off_by_default(self, mock_suggest):
+        response = self.client.get('/search_doctor/suggest?q=an')
+
+        self.assertNotIn(STATS_HEADER, response.headers)
+
+    def test_toolbar_in_debug_pages(self):
+        app.config['QUERY_TOOLBAR'] = True
+        app.debug = True
+        try:
+            response = self.client.get('/registration_pending')
+        finally:
+            app.debug = False
+            app.config['QUERY_TOOLBAR'] = False
+
+        html = response.get_data(as_text=True)
+        self.assertIn('id="query-toolbar"', html)
+        self.assertLess(html.index('id="query-toolbar"'), html.rindex('</body>'))
+        self.assertIn('commands=0', response.headers[STATS_HEADER])
+
+
+if __name__ == '__main__':
+    unittest.main()
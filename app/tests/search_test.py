@@ -0,0 +1,189 @@
+import unittest
+from unittest.mock import patch
+
+from bson.objectid import ObjectId
+
+from app import app
+from app.page_cache import page_cache
+from app.search import DoctorSearchIndex, SuggestionTrie, get_doctor_index, refresh_doctor, tokenize
+
+
+def _doctor(first_name, last_name, specialty, city, gender='female', hospital='General Hospital'):
+    return {'_id': ObjectId(), 'username': f'{first_name}{last_name}'.lower(), 'first_name': first_name,
+            'last_name': last_name, 'specialty': specialty, 'hospital': hospital, 'gender': gender,
+            'address': {'city': city}}
+
+
+def _use_fresh_doctor_index(test_case):
+    # Give the test its own shared index, so documents loaded here do not leak into other tests
+    patcher = patch('app.search.doctor_index', DoctorSearchIndex())
+    test_case.addCleanup(patcher.stop)
+    return patcher.start()
+
+
+class DoctorSearchIndexTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.smith = _doctor('Anna', 'Smith', 'Cardiology', 'London')
+        self.jones = _doctor('Bob', 'Jones', 'Dermatology', 'Manchester', gender='male')
+        self.smithson = _doctor('Carl', 'Smithson', 'Cardiology', 'london', gender='male',
+                                hospital='St Mary Hospital')
+        self.index = DoctorSearchIndex()
+        self.index.load([self.smith, self.jones, self.smithson])
+        self.doctor_index = _use_fresh_doctor_index(self)
+
+    def _names(self, results):
+        return [doctor['last_name'] for doctor in results['doctors']]
+
+    def test_tokenize(self):
+        self.assertEqual(tokenize("Zoë O'Neil"), ['zoe', 'o', 'neil'])
+
+    def test_prefix_match_ranks_exact_first(self):
+        self.assertEqual(self._names(self.index.search('smith')), ['Smith', 'Smithson'])
+        self.assertEqual(self._names(self.index.search('cardio')), ['Smith', 'Smithson'])
+
+    def test_typo_tolerant_match(self):
+        self.assertEqual(self._names(self.index.search('dermatolgy')), ['Jones'])
+        self.assertEqual(self._names(self.index.search('jnoes')), [])
+        self.assertEqual(self._names(self.index.search('manchster')), ['Jones'])
+
+    def test_every_term_must_match(self):
+        self.assertEqual(self._names(self.index.search('cardiology mary')), ['Smithson'])
+        self.assertEqual(self._names(self.index.search('cardiology bob')), [])
+
+    def test_location_matches_city_only(self):
+        self.assertEqual(self._names(self.index.search(location='LONDON')), ['Smith', 'Smithson'])
+        self.assertEqual(self._names(self.index.search(location='mary')), [])
+
+    def test_facet_filters_and_counts(self):
+        results = self.index.search(filters={'city': ['london'], 'gender': ['male']})
+
+        self.assertEqual(self._names(results), ['Smithson'])
+        # Each facet is counted without its own filter, so the other choices stay visible
+        self.assertEqual([(f['value'], f['count']) for f in results['facets']['gender']],
+                         [('female', 1), ('male', 1)])
+        self.assertEqual([(f['label'], f['count']) for f in results['facets']['city']],
+                         [('london', 1), ('Manchester', 1)])
+        self.assertEqual(results['facets']['specialty'], [{'value': 'cardiology', 'label': 'Cardiology', 'count': 1}])
+
+    def test_incremental_updates(self):
+        self.index.upsert({**self.jones, 'specialty': 'Neurology'})
+        self.index.remove(self.smith['_id'])
+
+        self.assertEqual(self._names(self.index.search('neuro')), ['Jones'])
+        self.assertEqual(self._names(self.index.search('dermatology')), [])
+        self.assertEqual(self._names(self.index.search('anna')), [])
+        self.assertEqual(len(self.index), 2)
+
+    @patch('app.search.bump_directory_version')
+    @patch('app.search.mongo')
+    def test_refresh_doctor(self, mock_mongo, mock_bump):
+        self.doctor_index.load([self.smith], version=4)
+
+        mock_bump.return_value = 5
+        mock_mongo.db.doctors.find_one.return_value = {**self.smith, 'specialty': 'Oncology'}
+        refresh_doctor(str(self.smith['_id']))
+        self.assertEqual(len(self.doctor_index.search('oncology')['doctors']), 1)
+        self.assertEqual(self.doctor_index.version, 5)
+
+        # Doctors that are no longer approved, or deleted, are dropped
+        mock_mongo.db.doctors.find_one.return_value = None
+        refresh_doctor(self.smith['_id'])
+        self.assertEqual(len(self.doctor_index), 0)
+
+        # Another worker changed the directory in between, so the index is left to be reloaded
+        mock_bump.return_value = 7
+        refresh_doctor(self.smith['_id'])
+        self.assertEqual(self.doctor_index.version, 5)
+
+    @patch.dict(app.config, {'WTF_CSRF_ENABLED': False})
+    @patch('app.routes.refresh_doctor')
+    @patch('app.routes.mongo')
+    def test_rejected_doctor_is_refreshed(self, mock_mongo, mock_refresh):
+        mock_mongo.db.doctors.find_one_and_update.return_value = {'_id': self.smith['_id']}
+
+        app.test_client().post('/reject_registration/annasmith')
+
+        mock_refresh.assert_called_once_with(self.smith['_id'])
+
+    @patch('app.search.mongo')
+    @patch('app.search.get_directory_version', return_value=3)
+    def test_index_reloads_after_version_change(self, mock_version, mock_mongo):
+        self.doctor_index.load([self.smith], version=3)
+        mock_mongo.db.doctors.find.return_value = [self.smith, self.jones]
+
+        self.assertEqual(len(get_doctor_index()), 1)
+        mock_version.return_value = 4
+        self.assertEqual(len(get_doctor_index()), 2)
+        self.assertEqual(self.doctor_index.version, 4)
+
+    @patch('app.page_cache.get_directory_version', return_value=0)
+    @patch('app.search.get_directory_version', return_value=0)
+    def test_search_page_renders_from_index(self, *mocks):
+        self.doctor_index.load([self.smith, self.jones], version=0)
+        self.addCleanup(page_cache.clear)
+
+        response = app.test_client().get('/search_doctor?name=smith&gender=female')
+
+        self.assertEqual(response.status_code, 200)
+        self.assertIn(b'annasmith', response.data)
+        self.assertNotIn(b'bobjones', response.data)
+        self.assertIn(b'1 doctor found', response.data)
+
+
+class SuggestionTrieTestCase(unittest.TestCase):
+
+    def test_suggest_by_word_prefix(self):
+        trie = SuggestionTrie()
+        trie.add('a', 'doctor', 'Anna Smith')
+        trie.add('b', 'hospital', 'St Mary Hospital')
+
+        self.assertEqual([s['label'] for s in trie.suggest('smi')], ['Anna Smith'])
+        self.assertEqual([s['label'] for s in trie.suggest('mary hos')], ['St Mary Hospital'])
+        self.assertEqual(trie.suggest('x'), [])
+        self.assertEqual(trie.suggest('  '), [])
+
+    def test_shared_suggestions_are_counted_and_ranked(self):
+        trie = SuggestionTrie()
+        trie.add('leeds', 'city', 'Leeds')
+        trie.add('london', 'city', 'London')
+        trie.add('london', 'city', 'London')
+
+        self.assertEqual([(s['label'], s['count']) for s in trie.suggest('l', limit=1)], [('London', 2)])
+
+        trie.discard('london')
+        trie.discard('london')
+        self.assertEqual([s['label'] for s in trie.suggest('l')], ['Leeds'])
+        self.assertEqual(len(trie), 1)
+
+        trie.discard('leeds')
+        self.assertEqual(trie._root, {})
+
+    def test_index_keeps_suggestions_in_step(self):
+        index = DoctorSearchIndex()
+        smith = _doctor('Anna', 'Smith', 'Cardiology', 'London')
+        index.load([smith, _doctor('Bob', 'Jones', 'Cardiology', 'Leeds')])
+
+        self.assertEqual([(s['kind'], s['label'], s['count']) for s in index.suggest('card')],
+                         [('specialty', 'Cardiology', 2)])
+
+        index.upsert({**smith, 'last_name': 'Carter'})
+        self.assertEqual([s['label'] for s in index.suggest('car')], ['Cardiology', 'Anna Carter'])
+        self.assertEqual(index.suggest('smith'), [])
+        self.assertEqual(index.suggest('anna')[0]['doctor_id'], str(smith['_id']))
+
+    @patch('app.search.get_directory_version', return_value=0)
+    def test_suggest_endpoint(self, mock_version):
+        doctor = _doctor('Anna', 'Smith', 'Cardiology', 'London')
+        _use_fresh_doctor_index(self).load([doctor], version=0)
+
+        response = app.test_client().get('/search_doctor/suggest?q=lon')
+
+        self.assertEqual(response.status_code, 200)
+        suggestion = response.get_json()['suggestions'][0]
+        self.assertEqual(suggestion['kind'], 'city')
+        self.assertIn('address_city=London', suggestion['url'])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,36 @@
+import random
+import unittest
+from datetime import date, datetime
+from unittest.mock import MagicMock
+
+from bson.objectid import ObjectId
+
+from app.seed import generate_appointments, generate_doctors, insert_in_batches
+
+
+class SeedTestCase(unittest.TestCase):
+
+    def test_appointments_never_share_a_doctor_slot(self):
+        doctor_ids = [ObjectId() for _ in range(3)]
+        patient_ids = [ObjectId() for _ in range(5)]
+
+        appointments = list(generate_appointments(200, doctor_ids, patient_ids, date(2024, 1, 5), random.Random(0)))
+
+        slots = {(item['doctor_id'], item['date'], item['time']) for item in appointments}
+        self.assertEqual(len(slots), 200)
+        self.assertTrue(all(datetime.strptime(item['date'], '%Y-%m-%d').weekday() < 5 for item in appointments))
+        self.assertEqual(appointments[0]['time'], '09:00 - 09:30')
+        self.assertIn('start', appointments[0])
+
+    def test_documents_are_inserted_in_batches(self):
+        collection = MagicMock()
+        doctors = generate_doctors(25, 'hash', random.Random(0))
+
+        ids = insert_in_batches(collection, doctors, batch_size=10)
+
+        self.assertEqual([len(call.args[0]) for call in collection.insert_many.call_args_list], [10, 10, 5])
+        self.assertEqual(len(set(ids)), 25)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,308 @@
+import gzip
+from datetime import datetime
+import threading
+import time
+import unittest
+from unittest.mock import patch, MagicMock
+from bson.objectid import ObjectId
+
+from pymongo.errors import DuplicateKeyError
+
+from app.models import Appointment, PROJECTIONS
+from app.utils import (enrich_appointments, reserve_appointment_slot, set_appointment_status,
+                       delete_appointment_by_id, get_busy_dates_by_doctor, get_admin_stats,
+                       invalidate_admin_stats, get_page, get_page_size, get_appointments_filter,
+                       export_documents, gzip_chunks, fetch_concurrently, get_doctor_dashboard_data,
+                       format_appointment_date, migrate_appointment_datetimes)
+
+
+class EnrichAppointmentsTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.patient_id = ObjectId('660d31266a03fcb618df8081')
+        self.doctor_id = ObjectId('66003d1f0cfcff3c4b8a0356')
+
+    @patch('app.utils.mongo')
+    def test_fetches_each_collection_once(self, mock_mongo):
+        mock_mongo.db.patients.find.return_value = [{'_id': self.patient_id, 'first_name': 'Ada'}]
+        mock_mongo.db.doctors.find.return_value = [{'_id': self.doctor_id, 'username': 'drwho'}]
+        appointments = [
+            {'patient_id': self.patient_id, 'doctor_id': self.doctor_id},
+            {'patient_id': str(self.patient_id), 'doctor_id': self.doctor_id},
+            {'doctor_id': self.doctor_id},
+        ]
+
+        result = enrich_appointments(appointments)
+
+        mock_mongo.db.patients.find.assert_called_once_with({'_id': {'$in': [self.patient_id]}},
+                                                         PROJECTIONS['patient_summary'])
+        mock_mongo.db.doctors.find.assert_called_once_with({'_id': {'$in': [self.doctor_id]}},
+                                                        PROJECTIONS['doctor_card'])
+        self.assertEqual(result[0]['patient_info']['first_name'], 'Ada')
+        self.assertEqual(result[1]['patient_info']['first_name'], 'Ada')
+        self.assertIsNone(result[2]['patient_info'])
+        self.assertEqual(result[2]['doctor_info']['username'], 'drwho')
+
+    @patch('app.utils.mongo')
+    def test_skips_query_without_references(self, mock_mongo):
+        result = enrich_appointments([{'status': 'requested'}], with_doctors=False)
+
+        mock_mongo.db.patients.find.assert_not_called()
+        self.assertIsNone(result[0]['patient_info'])
+        self.assertNotIn('doctor_info', result[0])
+
+
+class ReserveAppointmentSlotTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.appointment = Appointment(ObjectId(), ObjectId(), '2030-01-01', '09:00 - 09:30')
+
+    @patch('app.utils.mongo')
+    def test_returns_inserted_id(self, mock_mongo):
+        mock_mongo.db.appointments.insert_one.return_value = MagicMock(inserted_id='new-id')
+
+        self.assertEqual(reserve_appointment_slot(self.appointment), 'new-id')
+        mock_mongo.db.appointments.insert_one.assert_called_once_with(self.appointment.to_document())
+
+    @patch('app.utils.mongo')
+    def test_returns_none_when_slot_taken(self, mock_mongo):
+        mock_mongo.db.appointments.insert_one.side_effect = DuplicateKeyError('E11000 duplicate key')
+
+        self.assertIsNone(reserve_appointment_slot(self.appointment))
+        mock_mongo.db.busy_dates.update_one.assert_not_called()
+
+    @patch('app.utils.mongo')
+    def test_marks_date_busy(self, mock_mongo):
+        reserve_appointment_slot(self.appointment)
+
+        mock_mongo.db.busy_dates.update_one.assert_called_once_with(
+            {'_id': self.appointment.doctor_id}, {'$inc': {'dates.2030-01-01': 1}}, upsert=True)
+
+
+class BusyDatesTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.appointment_id = ObjectId()
+        self.doctor_id = ObjectId()
+
+    @patch('app.utils.mongo')
+    def test_cancelling_releases_date(self, mock_mongo):
+        mock_mongo.db.appointments.find_one_and_update.return_value = {
+            '_id': self.appointment_id, 'doctor_id': self.doctor_id, 'date': '2030-01-01', 'status': 'requested'}
+
+        set_appointment_status(self.appointment_id, 'cancelled')
+
+        first_call = mock_mongo.db.busy_dates.update_one.call_args_list[0]
+        self.assertEqual(first_call.args, ({'_id': self.doctor_id}, {'$inc': {'dates.2030-01-01': -1}}))
+
+    @patch('app.utils.mongo')
+    def test_approving_keeps_date_busy(self, mock_mongo):
+        mock_mongo.db.appointments.find_one_and_update.return_value = {
+            '_id': self.appointment_id, 'doctor_id': self.doctor_id, 'date': '2030-01-01', 'status': 'requested'}
+
+        set_appointment_status(self.appointment_id, 'approved')
+
+        mock_mongo.db.busy_dates.update_one.assert_not_called()
+
+    @patch('app.utils.mongo')
+    def test_deleting_cancelled_appointment_keeps_counts(self, mock_mongo):
+        mock_mongo.db.appointments.find_one_and_delete.return_value = {
+            '_id': self.appointment_id, 'doctor_id': self.doctor_id, 'date': '2030-01-01', 'status': 'cancelled'}
+
+        delete_appointment_by_id(self.appointment_id)
+
+        mock_mongo.db.busy_dates.update_one.assert_not_called()
+
+    @patch('app.utils.mongo')
+    def test_reads_only_requested_doctors(self, mock_mongo):
+        # The server returns only upcoming dates with active appointments, as key/value pairs
+        mock_mongo.db.busy_dates.find.return_value = [
+            {'_id': self.doctor_id, 'dates': [{'k': '2030-01-02', 'v': 1}, {'k': '2030-01-01', 'v': 2}]}]
+
+        busy_dates = get_busy_dates_by_doctor([self.doctor_id])
+
+        query, projection = mock_mongo.db.busy_dates.find.call_args.args
+        self.assertEqual(query, {'_id': {'$in': [self.doctor_id]}})
+        self.assertEqual(projection['dates']['$filter']['cond']['$and'][0],
+                         {'$gte': ['$$this.k', datetime.now().date().isoformat()]})
+        self.assertEqual(busy_dates, {str(self.doctor_id): ['2030-01-01', '2030-01-02']})
+
+
+class AdminStatsTestCase(unittest.TestCase):
+
+    def setUp(self):
+        invalidate_admin_stats()
+
+    def tearDown(self):
+        invalidate_admin_stats()
+
+    @patch('app.utils.mongo')
+    def test_counts_are_cached_until_invalidated(self, mock_mongo):
+        mock_mongo.db.patients.estimated_document_count.return_value = 3
+        mock_mongo.db.doctors.count_documents.return_value = 1
+
+        stats = get_admin_stats()
+        get_admin_stats()
+
+        self.assertEqual(stats['total_patients'], 3)
+        self.assertEqual(stats['pending_doctors'], 1)
+        mock_mongo.db.patients.find.assert_not_called()
+        self.assertEqual(mock_mongo.db.patients.estimated_document_count.call_count, 1)
+
+        invalidate_admin_stats()
+        get_admin_stats()
+
+        self.assertEqual(mock_mongo.db.patients.estimated_document_count.call_count, 2)
+
+
+class KeysetPaginationTestCase(unittest.TestCase):
+
+    def test_next_token_is_last_id_on_page(self):
+        ids = [ObjectId() for _ in range(3)]
+        collection = MagicMock()
+        collection.find.return_value.sort.return_value.limit.return_value = [{'_id': _id} for _id in ids]
+
+        documents, next_token = get_page(collection, {'status': 'approved'}, page_size=2)
+
+        collection.find.assert_called_once_with({'status': 'approved'}, None)
+        collection.find.return_value.sort.return_value.limit.assert_called_once_with(3)
+        self.assertEqual([d['_id'] for d in documents], ids[:2])
+        self.assertEqual(next_token, str(ids[1]))
+
+    def test_after_token_continues_below_last_id(self):
+        after = ObjectId()
+        collection = MagicMock()
+        collection.find.return_value.sort.return_value.limit.return_value = []
+
+        documents, next_token = get_page(collection, after=str(after))
+
+        collection.find.assert_called_once_with({'_id': {'$lt': after}}, None)
+        self.assertEqual(documents, [])
+        self.assertIsNone(next_token)
+
+    def test_page_size_is_capped(self):
+        self.assertEqual(get_page_size('100000'), 200)
+        self.assertEqual(get_page_size('abc'), 50)
+        self.assertEqual(get_page_size('0'), 1)
+
+    def test_appointments_filter(self):
+        self.assertEqual(get_appointments_filter('approved', '2030-01-01', '2030-01-31'),
+                         {'status': 'approved', 'start': {'$gte': datetime(2030, 1, 1), '$lt': datetime(2030, 2, 1)}})
+        self.assertEqual(get_appointments_filter(date_from='not a date'), {})
+        self.assertEqual(get_appointments_filter(), {})
+
+
+class ExportTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.documents = [
+            {'_id': ObjectId('660d31266a03fcb618df8081'), 'first_name': 'Ada', 'address': {'city': 'Leeds'}},
+            {'_id': ObjectId('66003d1f0cfcff3c4b8a0356'), 'first_name': 'Bo'},
+        ]
+
+    def test_csv_export(self):
+        output = ''.join(export_documents(iter(self.documents), ['_id', 'first_name', 'address']))
+
+        self.assertEqual(output.splitlines(), [
+            '_id,first_name,address',
+            '660d31266a03fcb618df8081,Ada,"{""city"": ""Leeds""}"',
+            '66003d1f0cfcff3c4b8a0356,Bo,',
+        ])
+
+    def test_ndjson_export_is_gzipped_incrementally(self):
+        chunks = gzip_chunks(export_documents(iter(self.documents), ['first_name'], 'ndjson'))
+
+        output = gzip.decompress(b''.join(chunks)).decode('utf-8')
+
+        self.assertEqual(output, '{"first_name": "Ada"}\n{"first_name": "Bo"}\n')
+
+    @patch('app.utils.EXPORT_CHUNK_SIZE', 10)
+    def test_export_is_chunked(self):
+        chunks = list(export_documents(iter(self.documents * 5), ['first_name'], 'ndjson'))
+
+        self.assertGreater(len(chunks), 1)
+
+
+class FetchConcurrentlyTestCase(unittest.TestCase):
+
+    def test_queries_run_in_parallel(self):
+        barrier = threading.Barrier(3, timeout=2)
+
+        def query(value):
+            barrier.wait()  # only passes if all three queries are running at once
+            return value
+
+        results = fetch_concurrently({name: (lambda n=name: query(n)) for name in ('a', 'b', 'c')})
+
+        self.assertEqual(results, {'a': 'a', 'b': 'b', 'c': 'c'})
+
+    def test_slow_query_times_out(self):
+        with self.assertRaises(TimeoutError):
+            fetch_concurrently({'slow': lambda: time.sleep(1), 'fast': lambda: 1}, timeout=0.05)
+
+    def test_query_exception_is_raised(self):
+        def failing():
+            raise ValueError('boom')
+
+        with self.assertRaises(ValueError):
+            fetch_concurrently({'failing': failing})
+
+
+class DoctorDashboardDataTestCase(unittest.TestCase):
+
+    @patch('app.utils.mongo')
+    def test_single_aggregation_split_by_status(self, mock_mongo):
+        doctor_id = ObjectId()
+        mock_mongo.db.appointments.aggregate.return_value = iter([{
+            'appointment_requests': [{'status': 'requested', 'formatted_date': '20 April 2024'}],
+            'fixed_appointments': [],
+            'counts': [{'_id': 'requested', 'count': 1}],
+        }])
+
+        data = get_doctor_dashboard_data(str(doctor_id))
+
+        mock_mongo.db.appointments.aggregate.assert_called_once()
+        pipeline = mock_mongo.db.appointments.aggregate.call_args.args[0]
+        self.assertEqual(pipeline[0]['$match']['doctor_id'], doctor_id)
+        self.assertEqual(pipeline[1]['$project'], PROJECTIONS['appointment_row'])
+        self.assertEqual(set(pipeline[2]['$facet']), {'appointment_requests', 'fixed_appointments', 'counts'})
+        # Patients are joined with only the fields the dashboard shows, never the password hash
+        lookup = pipeline[2]['$facet']['appointment_requests'][1]['$lookup']
+        self.assertEqual(lookup['pipeline'], [{'$project': PROJECTIONS['patient_summary']}])
+        self.assertEqual(data['counts'], {'requested': 1, 'approved': 0})
+        self.assertEqual(data['appointment_requests'][0]['formatted_date'], '20 April 2024')
+        self.assertEqual(data['fixed_appointments'], [])
+
+
+class AppointmentDatetimeTestCase(unittest.TestCase):
+
+    def test_format_uses_native_start(self):
+        self.assertEqual(format_appointment_date({'start': datetime(2024, 4, 27, 9), 'date': 'ignored'}),
+                         '27 April 2024')
+        self.assertEqual(format_appointment_date({'date': '2024-04-27'}), '27 April 2024')
+        self.assertIsNone(format_appointment_date({}))
+
+    def test_migration_converts_in_batches(self):
+        ids = [ObjectId() for _ in range(3)]
+        db = MagicMock()
+        find_limit = db.appointments.find.return_value.sort.return_value.limit
+        find_limit.side_effect = [
+            [{'_id': ids[0], 'date': '2024-04-27', 'time': '09:00 - 12:30'},
+             {'_id': ids[1], 'date': 'bad', 'time': '09:00'}],
+            [{'_id': ids[2], 'date': '2024-04-28', 'time': '10:00'}],
+            [],
+        ]
+        db.appointments.bulk_write.return_value = MagicMock(modified_count=1)
+
+        migrated, skipped = migrate_appointment_datetimes(batch_size=2, pause=0, db=db)
+
+        self.assertEqual((migrated, skipped), (2, 1))
+        self.assertEqual(db.appointments.find.call_args_list[1].args[0],
+                         {'start': {'$exists': False}, '_id': {'$gt': ids[1]}})
+        first_update = db.appointments.bulk_write.call_args_list[0].args[0][0]
+        self.assertEqual(first_update._doc, {'$set': {'start': datetime(2024, 4, 27, 9),
+                                                      'end': datetime(2024, 4, 27, 12, 30)}})
+
+
+if __name__ == '__main__':
+    unittest.main()
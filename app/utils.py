@@ -1,6 +1,21 @@
+import contextvars
+import csv
+import io
+import threading
+import zlib
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeoutError
+from time import monotonic, sleep
+
 from app import mongo
-from datetime import datetime
+from app.models import ACTIVE_APPOINTMENT_STATUSES, PROJECTIONS, parse_appointment_slot
+from app.availability import get_appointment_conflict
+from datetime import datetime, timedelta
 from bson import ObjectId
+from bson.errors import InvalidId
+from bson import json_util
+from pymongo import DESCENDING, UpdateOne
+from pymongo.errors import DuplicateKeyError
 
 
 from flask_wtf import FlaskForm
@@ -17,60 +32,181 @@ class AppointmentForm(FlaskForm):
     submit = SubmitField('Book Appointment')
 
 
+# Threads used to run independent dashboard queries side by side. They share the PyMongo
+# connection pool, which is thread-safe and much larger than this.
+QUERY_POOL_WORKERS = 16
+QUERY_TIMEOUT_SECONDS = 5
+
+_query_executor = ThreadPoolExecutor(max_workers=QUERY_POOL_WORKERS, thread_name_prefix='query')
+
+
+def fetch_concurrently(queries, timeout=QUERY_TIMEOUT_SECONDS):
+    """
+    Run independent read queries in parallel, so a page waits for the slowest query
+    rather than for the sum of all of them.
+    The callables must not call fetch_concurrently themselves.
+    Args:
+        queries (dict): Zero-argument callables keyed by name.
+        timeout (float): Seconds each query may take, measured from the start of the batch.
+    Returns:
+        dict: The result of each query, keyed by the same names.
+    Raises:
+        TimeoutError: If a query does not finish in time (unfinished queries are cancelled).
+        Exception: The first exception raised by a query.
+    """
+    # Each query runs in a copy of the caller's context, so its commands count towards the request
+    futures = {name: _query_executor.submit(contextvars.copy_context().run, query) for name, query in queries.items()}
+    deadline = monotonic() + timeout
+    try:
+        return {name: future.result(timeout=max(0, deadline - monotonic())) for name, future in futures.items()}
+    except FutureTimeoutError:
+        raise TimeoutError(f'Queries did not finish within {timeout}s')
+    finally:
+        for future in futures.values():
+            future.cancel()
+
+
 def get_available_doctors():
-    doctors = mongo.db.doctors.find({'registration_status': 'approved'})
+    doctors = mongo.db.doctors.find({'registration_status': 'approved'}, {'username': 1})
     return [doctor['username'] for doctor in doctors]
 
 
 def is_doctor_available(doctor_id, date, time):
 
     doctor_oid = ObjectId(doctor_id)
+    start, end = parse_appointment_slot(date, time)
+
+    # Available unless an active appointment of the doctor overlaps the slot, e.g.
+    # "09:00 - 12:30" blocks "10:00 - 11:00"
+    return get_appointment_conflict(doctor_oid, None, start, end) is None
 
-    # Count appointments for the given doctor, date, and time
-    appointments_count = mongo.db.appointments.count_documents({
-        'doctor_id': doctor_oid,
-        'date': date,
-        'time': time
-    })
 
-    # If there are no appointments for this doctor at the given date and time, they are available
-    return appointments_count == 0
+def reserve_appointment_slot(appointment, db=None):
+    """
+    Claim a doctor's (date, time) slot by inserting the appointment in a single atomic write.
+    The unique 'doctor_slot_unique' index rejects a second active appointment for the same slot,
+    so concurrent bookers cannot double-book it. A successful booking also marks the date busy.
+    Args:
+        appointment (Appointment): The appointment to book.
+        db: The database to write to, defaults to mongo.db.
+    Returns:
+        ObjectId: The id of the new appointment, or None if the slot is already taken.
+    """
+    db = db if db is not None else mongo.db
+    try:
+        inserted_id = db.appointments.insert_one(appointment.to_document()).inserted_id
+    except DuplicateKeyError:
+        return None
+    _adjust_busy_date(appointment.doctor_id, appointment.date, 1, db)
+    invalidate_admin_stats()
+    return inserted_id
 
 
 def get_all_doctors():
-    return mongo.db.doctors.find()
+    return mongo.db.doctors.find({}, PROJECTIONS['doctor_card'])
 
 
 from bson import ObjectId
 
 
-def get_busy_dates_by_doctor():
-    busy_dates_by_doctor = {}
-    appointments = mongo.db.appointments.find()
+def _adjust_busy_date(doctor_id, date, delta, db=None):
+    """Add delta to the number of active appointments a doctor has on a date in the busy_dates collection."""
+    db = db if db is not None else mongo.db
+    doctor_oid = to_object_id(doctor_id)
+    if doctor_oid is None or not date:
+        return
+    field = f'dates.{date}'
+    db.busy_dates.update_one({'_id': doctor_oid}, {'$inc': {field: delta}}, upsert=True)
+    if delta < 0:
+        # Drop the date once its last active appointment is gone
+        db.busy_dates.update_one({'_id': doctor_oid, field: {'$lte': 0}}, {'$unset': {field: ''}})
+
+
+def _is_active(appointment):
+    return appointment.get('status', 'requested') in ACTIVE_APPOINTMENT_STATUSES
+
+
+def set_appointment_status(appointment_id, new_status):
+    """
+    Update the status of an appointment and keep the busy_dates collection in step.
+    Args:
+        appointment_id (ObjectId): The appointment to update.
+        new_status (str): The new status, e.g. 'approved' or 'cancelled'.
+    Returns:
+        dict: The appointment as it was before the update, or None if it does not exist.
+    """
+    previous = mongo.db.appointments.find_one_and_update({'_id': appointment_id}, {'$set': {'status': new_status}})
+    if previous:
+        was_active = _is_active(previous)
+        is_active = new_status in ACTIVE_APPOINTMENT_STATUSES
+        if was_active != is_active:
+            _adjust_busy_date(previous.get('doctor_id'), previous.get('date'), 1 if is_active else -1)
+        invalidate_admin_stats()
+    return previous
+
+
+def delete_appointment_by_id(appointment_id):
+    """
+    Delete an appointment and release its date in the busy_dates collection.
+    Args:
+        appointment_id (ObjectId): The appointment to delete.
+    Returns:
+        dict: The deleted appointment, or None if it does not exist.
+    """
+    deleted = mongo.db.appointments.find_one_and_delete({'_id': appointment_id})
+    if deleted:
+        if _is_active(deleted):
+            _adjust_busy_date(deleted.get('doctor_id'), deleted.get('date'), -1)
+        invalidate_admin_stats()
+    return deleted
+
+
+def rebuild_busy_dates(db=None):
+    """
+    Recompute the busy_dates collection from the raw appointments collection.
+    Only dates from today on are kept, which also drops the history the live updates accumulate.
+    Returns:
+        int: The number of doctors with at least one busy date.
+    """
+    db = db if db is not None else mongo.db
+    per_doctor = {}
+    appointments = db.appointments.find({'doctor_id': {'$exists': True},
+                                         'status': {'$in': ACTIVE_APPOINTMENT_STATUSES},
+                                         'date': {'$gte': datetime.now().date().isoformat()}},
+                                        {'doctor_id': 1, 'date': 1})
     for appointment in appointments:
-        # Check if 'doctor_id' key exists in the document
-        if 'doctor_id' in appointment:
-            # Ensure doctor_id is a string for consistent dictionary keys
-            doctor_id_str = str(appointment['doctor_id'])
-            date = appointment['date']
-            if doctor_id_str not in busy_dates_by_doctor:
-                busy_dates_by_doctor[doctor_id_str] = [date]
-            else:
-                if date not in busy_dates_by_doctor[doctor_id_str]:
-                    busy_dates_by_doctor[doctor_id_str].append(date)
-        else:
-            # Handle case where 'doctor_id' is not present, e.g., log a warning
-            print(f"Warning: Appointment {appointment['_id']} missing 'doctor_id'")
+        dates = per_doctor.setdefault(appointment['doctor_id'], {})
+        dates[appointment['date']] = dates.get(appointment['date'], 0) + 1
 
-    return busy_dates_by_doctor
+    db.busy_dates.delete_many({})
+    if per_doctor:
+        db.busy_dates.insert_many([{'_id': doctor_id, 'dates': dates} for doctor_id, dates in per_doctor.items()])
+    return len(per_doctor)
 
 
-def validate_appointment_date(date, time):
-    # Split the time string to get only the start time if it's a range
-    start_time = time.split(' - ')[0]  # Assumes time is in the format "09:00 - 12:30"
+def get_busy_dates_by_doctor(doctor_ids):
+    """
+    Get the upcoming dates on which doctors already have active appointments.
+    Reads the busy_dates documents of the given doctors only, and past dates are filtered out on
+    the server, so the cost depends on the doctors asked for rather than on their booking history.
+    Args:
+        doctor_ids (iterable): Ids of the doctors to look up.
+    Returns:
+        dict: Sorted lists of busy dates from today on, keyed by the doctor id as a string.
+    """
+    today = datetime.now().date().isoformat()
+    projection = {'dates': {'$filter': {
+        'input': {'$objectToArray': {'$ifNull': ['$dates', {}]}},
+        'cond': {'$and': [{'$gte': ['$$this.k', today]}, {'$gt': ['$$this.v', 0]}]},
+    }}}
+    busy_dates = get_documents_by_ids(mongo.db.busy_dates, doctor_ids, projection)
+    return {str(doctor_id): sorted(date['k'] for date in document.get('dates') or [])
+            for doctor_id, document in busy_dates.items()}
+
 
-    # Combine date and start_time into a single datetime object
-    appointment_datetime = datetime.strptime(f"{date} {start_time}", "%Y-%m-%d %H:%M")
+def validate_appointment_date(date, time):
+    # Get the start of the slot as a datetime; time is in the format "09:00 - 12:30"
+    appointment_datetime, _ = parse_appointment_slot(date, time)
 
     # Get the current datetime
     now = datetime.now()
@@ -79,6 +215,59 @@ def validate_appointment_date(date, time):
     return appointment_datetime >= now
 
 
+def format_appointment_date(appointment):
+    """
+    Format an appointment's date as e.g. "27 April 2024" from its native start datetime.
+    Appointments not yet migrated by migrate_appointment_datetimes() fall back to the date string.
+    """
+    start = appointment.get('start')
+    if start is None and appointment.get('date'):
+        start = datetime.strptime(appointment['date'], '%Y-%m-%d')
+    return start.strftime('%d %B %Y') if start else None
+
+
+def migrate_appointment_datetimes(batch_size=500, pause=0.1, db=None, log=None):
+    """
+    Add native start/end datetimes to appointments that only have date and time strings.
+    Runs online: documents are converted in small batches by _id with a pause between batches,
+    and each update only applies if the document still has no start.
+    Args:
+        batch_size (int): Documents converted per bulk write.
+        pause (float): Seconds to sleep between batches, to limit load on a live database.
+        db: The database to migrate, defaults to mongo.db.
+        log (callable): Called with a progress message after each batch.
+    Returns:
+        tuple: Number of documents migrated and number skipped because their date or time is invalid.
+    """
+    db = db if db is not None else mongo.db
+    migrated = skipped = 0
+    last_id = None
+    while True:
+        query = {'start': {'$exists': False}}
+        if last_id is not None:
+            query['_id'] = {'$gt': last_id}
+        batch = list(db.appointments.find(query, {'date': 1, 'time': 1}).sort('_id', 1).limit(batch_size))
+        if not batch:
+            break
+        last_id = batch[-1]['_id']
+
+        updates = []
+        for appointment in batch:
+            try:
+                start, end = parse_appointment_slot(appointment['date'], appointment['time'])
+            except (KeyError, TypeError, ValueError):
+                skipped += 1
+                continue
+            updates.append(UpdateOne({'_id': appointment['_id'], 'start': {'$exists': False}},
+                                     {'$set': {'start': start, 'end': end}}))
+        if updates:
+            migrated += db.appointments.bulk_write(updates, ordered=False).modified_count
+        if log:
+            log(f'Migrated {migrated} appointments ({skipped} skipped)')
+        sleep(pause)
+    return migrated, skipped
+
+
 def get_patient_full_name(patient):
     """
     Get the full name of a patient by concatenating their first name and last name.
@@ -93,53 +282,125 @@ def get_patient_full_name(patient):
         return None
 
 
-def get_appointment_requests_for_doctor(doctor_id):
-    appointments = mongo.db.appointments.find({'doctor_id': ObjectId(doctor_id), 'status': 'requested'})
-    appointments_list = list(appointments)
+def to_object_id(value):
+    """Coerce a stored reference (ObjectId or hex string) to an ObjectId, or None if it is invalid."""
+    if isinstance(value, ObjectId) or value is None:
+        return value
+    try:
+        return ObjectId(value)
+    except (InvalidId, TypeError):
+        return None
 
-    for appointment in appointments_list:
-        patient_id = appointment.get('patient_id')
-        if patient_id:
-            # Fetch the patient information for each appointment
-            patient_info = mongo.db.patients.find_one({'_id': ObjectId(patient_id)})
-            # Add the patient information to the appointment document
-            appointment['patient_info'] = patient_info
-        else:
-            appointment['patient_info'] = None
 
-    return appointments_list
+def get_documents_by_ids(collection, ids, projection=None):
+    """
+    Fetch many documents from a collection with a single $in query.
+    Args:
+        collection: The PyMongo collection to read from.
+        ids (iterable): ObjectIds (or hex strings) to fetch.
+        projection (dict): Fields to return, e.g. one of models.PROJECTIONS; all fields if None.
+    Returns:
+        dict: Documents keyed by their _id.
+    """
+    object_ids = {oid for oid in (to_object_id(_id) for _id in ids) if oid is not None}
+    if not object_ids:
+        return {}
+    return {document['_id']: document for document in collection.find({'_id': {'$in': list(object_ids)}}, projection)}
 
 
-from bson.objectid import ObjectId
+def enrich_appointments(appointments, with_patients=True, with_doctors=True):
+    """
+    Attach 'patient_info' and 'doctor_info' to appointments.
+    The referenced patients and doctors are fetched with one $in query per collection
+    instead of a find_one per appointment, then joined in memory. Only the fields of a
+    patient summary and a doctor card are read.
+    Args:
+        appointments (iterable): Appointment documents or a cursor over them.
+        with_patients (bool): Attach 'patient_info'.
+        with_doctors (bool): Attach 'doctor_info'.
+    Returns:
+        list: The appointments, each with the requested info attached (None when missing).
+    """
+    appointments_list = list(appointments)
+
+    if with_patients:
+        patients = get_documents_by_ids(mongo.db.patients,
+                                        (a.get('patient_id') for a in appointments_list if a.get('patient_id')),
+                                        PROJECTIONS['patient_summary'])
+        for appointment in appointments_list:
+            appointment['patient_info'] = patients.get(to_object_id(appointment.get('patient_id')))
+
+    if with_doctors:
+        doctors = get_documents_by_ids(mongo.db.doctors,
+                                       (a.get('doctor_id') for a in appointments_list if a.get('doctor_id')),
+                                       PROJECTIONS['doctor_card'])
+        for appointment in appointments_list:
+            appointment['doctor_info'] = doctors.get(to_object_id(appointment.get('doctor_id')))
+
+    return appointments_list
 
 
-def get_fixed_appointments_for_doctor(doctor_id):
+MONTH_NAMES = ['January', 'February', 'March', 'April', 'May', 'June', 'July',
+               'August', 'September', 'October', 'November', 'December']
+
+
+def _doctor_dashboard_join():
+    """Pipeline stages that attach the patient and a '%d %B %Y' formatted date to each appointment."""
+    # Appointments not yet migrated to native datetimes fall back to parsing the date string
+    appointment_date = {'$ifNull': ['$start', {'$dateFromString': {'dateString': '$date', 'format': '%Y-%m-%d',
+                                                                    'onError': None}}]}
+    full_name = {'$trim': {'input': {'$concat': [{'$ifNull': ['$$patient.first_name', '']}, ' ',
+                                                 {'$ifNull': ['$$patient.last_name', '']}]}}}
+    return [
+        {'$lookup': {'from': 'patients', 'localField': 'patient_id', 'foreignField': '_id',
+                     'pipeline': [{'$project': PROJECTIONS['patient_summary']}], 'as': 'patient_info'}},
+        {'$addFields': {
+            'patient_info': {'$let': {
+                'vars': {'patient': {'$arrayElemAt': ['$patient_info', 0]}},
+                'in': {'$cond': [{'$ifNull': ['$$patient', False]},
+                                 {'$mergeObjects': ['$$patient', {'full_name': full_name}]},
+                                 None]},
+            }},
+            # $dateToString has no portable month-name specifier, so the name is looked up
+            'formatted_date': {'$let': {
+                'vars': {'date': appointment_date},
+                'in': {'$concat': [{'$dateToString': {'date': '$$date', 'format': '%d'}}, ' ',
+                                   {'$arrayElemAt': [MONTH_NAMES, {'$subtract': [{'$month': '$$date'}, 1]}]}, ' ',
+                                   {'$dateToString': {'date': '$$date', 'format': '%Y'}}]},
+            }},
+        }},
+    ]
+
+
+def get_doctor_dashboard_data(doctor_id):
     """
-    Retrieve fixed (confirmed) appointments for a specific doctor and include patient information.
-    :param doctor_id: The ObjectId of the doctor.
-    :return: A list of fixed appointments with patient information.
+    Load everything the doctor dashboard shows in a single aggregation.
+    $facet splits the doctor's appointments by status and $lookup attaches each patient,
+    so requests, approved appointments and their counts come back in one round trip.
+    Args:
+        doctor_id (str): The doctor's id.
+    Returns:
+        dict: 'appointment_requests' and 'fixed_appointments' lists (with 'patient_info' and
+              'formatted_date'), and 'counts' keyed by status.
     """
-    try:
-        # Convert string doctor_id to ObjectId
-        doctor_oid = ObjectId(doctor_id)
-        # Query for confirmed appointments
-        fixed_appointments = list(mongo.db.appointments.find({'doctor_id': doctor_oid, 'status': 'approved'}))
-
-        # Enhance each appointment with patient information
-        for appointment in fixed_appointments:
-            patient_id = appointment.get('patient_id')
-            if patient_id:
-                # Fetch the patient information for each appointment
-                patient_info = mongo.db.patients.find_one({'_id': ObjectId(patient_id)})
-                # Add the patient information to the appointment document
-                appointment['patient_info'] = patient_info
-            else:
-                appointment['patient_info'] = None
-
-        return fixed_appointments
-    except Exception as e:
-        print(f"Error retrieving fixed appointments: {e}")
-        return []
+    join = _doctor_dashboard_join()
+    pipeline = [
+        {'$match': {'doctor_id': ObjectId(doctor_id), 'status': {'$in': ['requested', 'approved']}}},
+        {'$project': PROJECTIONS['appointment_row']},
+        {'$facet': {
+            'appointment_requests': [{'$match': {'status': 'requested'}}] + join,
+            'fixed_appointments': [{'$match': {'status': 'approved'}}] + join,
+            'counts': [{'$group': {'_id': '$status', 'count': {'$sum': 1}}}],
+        }},
+    ]
+    result = next(mongo.db.appointments.aggregate(pipeline), None) or {}
+    counts = {'requested': 0, 'approved': 0}
+    counts.update({group['_id']: group['count'] for group in result.get('counts', [])})
+    return {
+        'appointment_requests': result.get('appointment_requests', []),
+        'fixed_appointments': result.get('fixed_appointments', []),
+        'counts': counts,
+    }
 
 
 def get_available_doctors_count():
@@ -154,35 +415,274 @@ def get_total_appointments_count():
     return mongo.db.appointments.count_documents({})
 
 
+class TTLCache:
+    """
+    A small thread-safe LRU cache whose entries also expire after ttl seconds.
+    Used for in-process caches that write paths invalidate explicitly.
+    """
+
+    def __init__(self, maxsize, ttl):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        """Return the cached value for key, or None if it is missing or expired."""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            value, expires_at = entry
+            if monotonic() >= expires_at:
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return value
+
+    def set(self, key, value):
+        with self._lock:
+            self._entries[key] = (value, monotonic() + self.ttl)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def delete(self, key):
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def delete_matching(self, predicate):
+        """Drop every entry whose key satisfies predicate."""
+        with self._lock:
+            for key in [key for key in self._entries if predicate(key)]:
+                del self._entries[key]
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+# How long get_admin_stats() may serve cached counts before querying again
+ADMIN_STATS_TTL_SECONDS = 30
+
+_admin_stats_cache = TTLCache(maxsize=1, ttl=ADMIN_STATS_TTL_SECONDS)
+
+
+def get_admin_stats():
+    """
+    Get the totals and pending counts shown on the admin dashboard.
+    Totals use the collection metadata (estimated_document_count) and pending counts use
+    indexed count queries; the result is cached for ADMIN_STATS_TTL_SECONDS or until a
+    write path calls invalidate_admin_stats().
+    Returns:
+        dict: Counts keyed by 'total_patients', 'total_doctors', 'total_appointments',
+              'pending_patients', 'pending_doctors' and 'requested_appointments'.
+    """
+    stats = _admin_stats_cache.get('stats')
+    if stats is not None:
+        return stats
+
+    stats = {
+        'total_patients': mongo.db.patients.estimated_document_count(),
+        'total_doctors': mongo.db.doctors.estimated_document_count(),
+        'total_appointments': mongo.db.appointments.estimated_document_count(),
+        'pending_patients': mongo.db.patients.count_documents({'registration_status': 'pending'}),
+        'pending_doctors': mongo.db.doctors.count_documents({'registration_status': 'pending'}),
+        'requested_appointments': mongo.db.appointments.count_documents({'status': 'requested'}),
+    }
+    _admin_stats_cache.set('stats', stats)
+    return stats
+
+
+def invalidate_admin_stats():
+    """Drop the cached admin statistics so the next dashboard view recounts."""
+    _admin_stats_cache.clear()
+
+
+# How long a loaded Flask-Login user may be reused before it is read from MongoDB again
+USER_CACHE_TTL_SECONDS = 60
+
+_user_cache = TTLCache(maxsize=1024, ttl=USER_CACHE_TTL_SECONDS)
+
+
+def load_cached_user(role, username, loader):
+    """
+    Load a user through the in-process user cache.
+    Args:
+        role (str): 'patient', 'doctor' or 'admin'.
+        username (str): The user's username.
+        loader (callable): Reads the user from MongoDB, e.g. Patient.get; may return None.
+    Returns:
+        The user object, or None if it does not exist (misses are not cached).
+    """
+    user = _user_cache.get((role, username))
+    if user is None:
+        user = loader(username)
+        if user is not None:
+            _user_cache.set((role, username), user)
+    return user
+
+
+def invalidate_cached_user(role, username=None):
+    """Drop a cached user, or every cached user with the role when the username is not known."""
+    if username is None:
+        _user_cache.delete_matching(lambda key: key[0] == role)
+    else:
+        _user_cache.delete((role, username))
+
+
+# Default and maximum number of rows on a paginated admin list
+ADMIN_PAGE_SIZE = 50
+MAX_ADMIN_PAGE_SIZE = 200
+
+
+def get_page_size(value, default=ADMIN_PAGE_SIZE):
+    """Parse a requested page size, falling back to the default and capping it at MAX_ADMIN_PAGE_SIZE."""
+    try:
+        page_size = int(value)
+    except (TypeError, ValueError):
+        return default
+    return max(1, min(page_size, MAX_ADMIN_PAGE_SIZE))
+
+
+def get_page(collection, query=None, after=None, page_size=ADMIN_PAGE_SIZE, projection=None):
+    """
+    Fetch one page of a collection, newest first, using keyset pagination on _id.
+    Unlike skip/limit, the cost of a page does not grow with how far into the collection it is.
+    Args:
+        collection: The PyMongo collection to read from.
+        query (dict): Filter to apply.
+        after (str): The next page token returned for the previous page, if any.
+        page_size (int): Maximum number of documents on the page.
+        projection (dict): Fields to return, e.g. one of models.PROJECTIONS; all fields if None.
+    Returns:
+        tuple: The documents on the page and the token for the next page (None on the last page).
+    """
+    query = dict(query or {})
+    after_oid = to_object_id(after) if after else None
+    if after_oid is not None:
+        query['_id'] = {'$lt': after_oid}
+
+    # Fetch one extra document to know whether there is a next page
+    documents = list(collection.find(query, projection).sort('_id', DESCENDING).limit(page_size + 1))
+    next_token = str(documents[page_size - 1]['_id']) if len(documents) > page_size else None
+    return documents[:page_size], next_token
+
+
+def get_appointments_filter(status=None, date_from=None, date_to=None):
+    """
+    Build an appointments query from the admin list filters.
+    The date range is applied to the native start datetime; dates that do not parse are ignored.
+    Args:
+        status (str): Only include appointments with this status.
+        date_from (str): Earliest date to include, as "%Y-%m-%d".
+        date_to (str): Latest date to include, as "%Y-%m-%d".
+    Returns:
+        dict: The MongoDB query.
+    """
+    query = {}
+    if status:
+        query['status'] = status
+    date_range = {}
+    try:
+        if date_from:
+            date_range['$gte'] = datetime.strptime(date_from, '%Y-%m-%d')
+        if date_to:
+            date_range['$lt'] = datetime.strptime(date_to, '%Y-%m-%d') + timedelta(days=1)
+    except ValueError:
+        date_range = {}
+    if date_range:
+        query['start'] = date_range
+    return query
+
+
+def get_appointments_page(query=None, after=None, page_size=ADMIN_PAGE_SIZE):
+    """
+    Fetch one page of appointments with patient and doctor info attached.
+    Returns:
+        tuple: The enriched appointments and the next page token.
+    """
+    appointments, next_token = get_page(mongo.db.appointments, query, after, page_size,
+                                        PROJECTIONS['appointment_row'])
+    return enrich_appointments(appointments), next_token
+
+
 def get_all_appointments():
-    appointments = mongo.db.appointments.find()
-    appointments_with_details = []
+    appointments = mongo.db.appointments.find({}, PROJECTIONS['appointment_row'])
+    return enrich_appointments(appointments)
 
-    for appointment in appointments:
-        # Use the .get() method for safe access
-        patient_id = appointment.get('patient_id')
-        doctor_id = appointment.get('doctor_id')
 
-        # Initialize as None to handle missing information
-        patient_info = None
-        doctor_info = None
+# Fields that may be exported per collection, in column order; passwords are never exported
+EXPORT_FIELDS = {
+    'appointments': ['_id', 'patient_id', 'doctor_id', 'date', 'time', 'start', 'end', 'status'],
+    'patients': ['_id', 'username', 'first_name', 'last_name', 'date_of_birth', 'gender', 'phone_number',
+                 'email', 'blood_group', 'address', 'registration_status'],
+    'doctors': ['_id', 'username', 'first_name', 'last_name', 'date_of_birth', 'gender', 'phone_number',
+                'address', 'hospital', 'specialty', 'registration_status'],
+}
 
-        # Fetch patient information if patient_id exists
-        if patient_id:
-            patient_info = mongo.db.patients.find_one({'_id': ObjectId(patient_id)})
+# Number of bytes collected before an export chunk is sent to the client
+EXPORT_CHUNK_SIZE = 64 * 1024
 
-        # Fetch doctor information if doctor_id exists
-        if doctor_id:
-            doctor_info = mongo.db.doctors.find_one({'_id': ObjectId(doctor_id)})
 
-        # Update appointment details
-        appointment_details = dict(appointment)
-        appointment_details['patient_info'] = patient_info
-        appointment_details['doctor_info'] = doctor_info
+def _export_value(value):
+    """Flatten a document value for a CSV cell."""
+    if value is None:
+        return ''
+    if isinstance(value, (dict, list)):
+        return json_util.dumps(value)
+    return str(value)
 
-        appointments_with_details.append(appointment_details)
 
-    return appointments_with_details
+def export_documents(cursor, fields, export_format='csv'):
+    """
+    Serialise documents one at a time so an export never holds the whole collection in memory.
+    Args:
+        cursor (iterable): The documents to export, usually a PyMongo cursor.
+        fields (list): The fields to write, in column order.
+        export_format (str): 'csv' or 'ndjson'.
+    Yields:
+        str: Chunks of roughly EXPORT_CHUNK_SIZE characters.
+    """
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    if export_format == 'csv':
+        writer.writerow(fields)
+
+    for document in cursor:
+        if export_format == 'csv':
+            writer.writerow([_export_value(document.get(field)) for field in fields])
+        else:
+            buffer.write(json_util.dumps({field: document[field] for field in fields if field in document}))
+            buffer.write('\n')
+        if buffer.tell() >= EXPORT_CHUNK_SIZE:
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+    if buffer.tell():
+        yield buffer.getvalue()
+
+
+def gzip_chunks(chunks):
+    """Gzip a stream of text chunks incrementally."""
+    compressor = zlib.compressobj(wbits=31)  # 31 selects the gzip container
+    for chunk in chunks:
+        compressed = compressor.compress(chunk.encode('utf-8'))
+        if compressed:
+            yield compressed
+    yield compressor.flush()
+
+
+def get_export_cursor(collection_name, fields, query=None):
+    """
+    Open a cursor over a collection that returns only the exported fields.
+    Returns:
+        Cursor: Documents in _id order, fetched in batches.
+    """
+    projection = {field: 1 for field in fields}
+    if '_id' not in fields:
+        projection['_id'] = 0
+    return mongo.db[collection_name].find(query or {}, projection).sort('_id', 1).batch_size(1000)
 
 
 def get_all_patients():
@@ -197,7 +697,7 @@ def get_patients_by_registration_status(status):
     Returns:
         list: List of patients with the specified registration status.
     """
-    return mongo.db.patients.find({'registration_status': status})
+    return mongo.db.patients.find({'registration_status': status}, PROJECTIONS['patient_summary'])
 
 
 def get_pending_patients():
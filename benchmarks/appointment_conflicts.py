@@ -0,0 +1,82 @@
+"""
+Benchmark of appointment overlap checks on doctors with dense calendars.
+
+Builds one day's calendar per doctor from back-to-back appointments of mixed lengths and
+checks random prospective bookings against it three ways:
+
+- building an IntervalIndex from the calendar and querying it once, which is what
+  get_appointment_conflict does with each calendar it reads (sorted by start, as the query returns it);
+- querying an IntervalIndex that was built beforehand and is reused across checks;
+- a linear scan of the same appointments, for comparison.
+
+Needs no database.
+
+    python -m benchmarks.appointment_conflicts --doctors 200 --appointments 96 --checks 100000
+"""
+import argparse
+import random
+import time
+from datetime import datetime, timedelta
+
+from app.availability import IntervalIndex
+
+
+def _dense_day(day_start, count):
+    # Back-to-back appointments of 5 to 30 minutes, with the occasional long one overlapping the next
+    intervals = []
+    start = day_start
+    for _ in range(count):
+        length = timedelta(minutes=random.choice((5, 10, 15, 30)))
+        end = start + (length * 4 if random.random() < 0.05 else length)
+        intervals.append((start, end))
+        start += length
+    return intervals
+
+
+def _linear_overlaps(intervals, start, end):
+    return any(booked_start < end and start < booked_end for booked_start, booked_end in intervals)
+
+
+def _per_check_us(elapsed, checks):
+    return elapsed / checks * 1e6
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--doctors', type=int, default=200)
+    parser.add_argument('--appointments', type=int, default=96, help='Appointments per doctor per day')
+    parser.add_argument('--checks', type=int, default=100000)
+    args = parser.parse_args()
+
+    day_start = datetime(2030, 1, 7, 8, 0)
+    calendars = [_dense_day(day_start, args.appointments) for _ in range(args.doctors)]
+    day_minutes = int((max(end for calendar in calendars for _, end in calendar) - day_start).total_seconds() // 60)
+    checks = []
+    for _ in range(args.checks):
+        start = day_start + timedelta(minutes=random.randrange(day_minutes))
+        checks.append((random.randrange(args.doctors), start, start + timedelta(minutes=random.choice((15, 30, 60)))))
+
+    started = time.perf_counter()
+    linear = [_linear_overlaps(calendars[doctor], start, end) for doctor, start, end in checks]
+    linear_time = time.perf_counter() - started
+
+    started = time.perf_counter()
+    built = [IntervalIndex(calendars[doctor]).overlaps(start, end) for doctor, start, end in checks]
+    built_time = time.perf_counter() - started
+
+    indexes = [IntervalIndex(calendar) for calendar in calendars]
+    started = time.perf_counter()
+    reused = [indexes[doctor].overlaps(start, end) for doctor, start, end in checks]
+    reused_time = time.perf_counter() - started
+
+    if not linear == built == reused:
+        raise SystemExit('IntervalIndex and the linear scan disagree')
+    print(f'{args.doctors} doctors x {args.appointments} appointments, {args.checks} checks '
+          f'({sum(linear)} conflicts)')
+    print(f'linear scan                {_per_check_us(linear_time, args.checks):7.2f} us/check')
+    print(f'IntervalIndex build+query  {_per_check_us(built_time, args.checks):7.2f} us/check')
+    print(f'IntervalIndex query only   {_per_check_us(reused_time, args.checks):7.2f} us/check')
+
+
+if __name__ == '__main__':
+    main()
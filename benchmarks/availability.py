@@ -0,0 +1,66 @@
+"""
+Latency benchmark for get_available_slots against a local mongod.
+
+Seeds one doctor with a busy 90-day calendar and repeatedly computes the open slots of the
+whole window, the largest range the /doctor_availability endpoint answers.
+
+    python -m benchmarks.availability --appointments 1000 --runs 200
+"""
+import argparse
+import random
+import statistics
+import time
+from datetime import date, datetime, timedelta
+
+from bson import ObjectId
+from pymongo import MongoClient
+
+from app.availability import DEFAULT_SCHEDULE, MAX_AVAILABILITY_DAYS, get_available_slots
+from app.models import Appointment, ensure_indexes
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--uri', default='mongodb://localhost:27017')
+    parser.add_argument('--database', default='AppointmentBenchmark')
+    parser.add_argument('--appointments', type=int, default=1000,
+                        help='Booked appointments in the window, at most one per open slot')
+    parser.add_argument('--runs', type=int, default=200)
+    args = parser.parse_args()
+
+    client = MongoClient(args.uri)
+    client.drop_database(args.database)
+    db = client[args.database]
+    ensure_indexes(db)
+
+    doctor = {'_id': ObjectId(), 'schedule': DEFAULT_SCHEDULE}
+    first_day = date.today() + timedelta(days=1)
+    # Only weekday slots are open under DEFAULT_SCHEDULE, and a slot can be booked once
+    open_slots = [(day, 9 * 60 + 30 * index)
+                  for day in (first_day + timedelta(days=offset) for offset in range(MAX_AVAILABILITY_DAYS))
+                  if day.weekday() < 5
+                  for index in range(16)]
+    if args.appointments > len(open_slots):
+        print(f'Only {len(open_slots)} slots are open in the window; booking all of them')
+    appointments = []
+    for day, start in random.sample(open_slots, min(args.appointments, len(open_slots))):
+        slot = f'{start // 60:02d}:{start % 60:02d} - {(start + 30) // 60:02d}:{(start + 30) % 60:02d}'
+        appointments.append(Appointment(ObjectId(), doctor['_id'], day.isoformat(), slot).to_document())
+    db.appointments.insert_many(appointments)
+
+    now = datetime.now()
+    timings = []
+    for _ in range(args.runs):
+        started = time.perf_counter()
+        get_available_slots(doctor, first_day, MAX_AVAILABILITY_DAYS, now=now, db=db)
+        timings.append((time.perf_counter() - started) * 1000)
+
+    timings.sort()
+    print(f'{args.runs} runs over {MAX_AVAILABILITY_DAYS} days with {len(appointments)} appointments')
+    print(f'median {statistics.median(timings):.2f} ms, '
+          f'p99 {timings[int(len(timings) * 0.99) - 1]:.2f} ms, max {timings[-1]:.2f} ms')
+    client.drop_database(args.database)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,75 @@
+"""
+Concurrency benchmark for reserve_appointment_slot against a local mongod.
+
+Many threads try to book the same handful of slots at once; the run fails if any slot
+ends up with more than one active appointment.
+
+    python -m benchmarks.booking_concurrency --bookers 500 --slots 10
+"""
+import argparse
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from bson import ObjectId
+from pymongo import MongoClient
+
+from app.models import Appointment, ACTIVE_APPOINTMENT_STATUSES, ensure_indexes
+from app.utils import reserve_appointment_slot
+
+
+def _half_hour_slot(start_minutes):
+    end_minutes = start_minutes + 30
+    return (f"{start_minutes // 60:02d}:{start_minutes % 60:02d} - "
+            f"{end_minutes // 60:02d}:{end_minutes % 60:02d}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--uri', default='mongodb://localhost:27017')
+    parser.add_argument('--database', default='AppointmentBenchmark')
+    parser.add_argument('--bookers', type=int, default=500, help='Number of concurrent booking attempts')
+    parser.add_argument('--slots', type=int, default=10, help='Number of distinct slots being fought over')
+    parser.add_argument('--threads', type=int, default=200)
+    args = parser.parse_args()
+
+    client = MongoClient(args.uri, maxPoolSize=args.threads)
+    client.drop_database(args.database)
+    db = client[args.database]
+    ensure_indexes(db)
+
+    doctor_oid = ObjectId()
+    slots = [('2030-01-01', _half_hour_slot(9 * 60 + 30 * i)) for i in range(args.slots)]
+
+    def book(n):
+        date, slot_time = slots[n % len(slots)]
+        started = time.perf_counter()
+        booked = reserve_appointment_slot(Appointment(ObjectId(), doctor_oid, date, slot_time), db=db)
+        return booked is not None, time.perf_counter() - started
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.threads) as executor:
+        results = list(executor.map(book, range(args.bookers)))
+    elapsed = time.perf_counter() - started
+
+    latencies = sorted(latency for _, latency in results)
+    successes = sum(1 for booked, _ in results if booked)
+    per_slot = list(db.appointments.aggregate([
+        {'$match': {'doctor_id': doctor_oid, 'status': {'$in': ACTIVE_APPOINTMENT_STATUSES}}},
+        {'$group': {'_id': {'date': '$date', 'time': '$time'}, 'count': {'$sum': 1}}},
+    ]))
+    double_booked = [slot['_id'] for slot in per_slot if slot['count'] > 1]
+
+    print(f"bookers={args.bookers} slots={args.slots} threads={args.threads}")
+    print(f"booked={successes} rejected={args.bookers - successes} elapsed={elapsed:.3f}s "
+          f"throughput={args.bookers / elapsed:.0f}/s")
+    print(f"latency p50={latencies[len(latencies) // 2] * 1000:.2f}ms "
+          f"p99={latencies[int(len(latencies) * 0.99) - 1] * 1000:.2f}ms")
+    print(f"double_booked_slots={len(double_booked)}")
+
+    client.drop_database(args.database)
+    if double_booked or successes != min(args.bookers, args.slots):
+        raise SystemExit(1)
+
+
+if __name__ == '__main__':
+    main()
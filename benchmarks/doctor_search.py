@@ -0,0 +1,77 @@
+"""
+Latency benchmark for DoctorSearchIndex on a synthetic directory.
+
+Loads randomly generated doctors into an index and times typical searches (prefix, typo,
+facet-only and combined queries) and uncached typeahead suggestions. Needs no database.
+
+    python -m benchmarks.doctor_search --doctors 2000 --runs 500
+"""
+import argparse
+import random
+import statistics
+import string
+import time
+
+from bson import ObjectId
+
+from app.search import DoctorSearchIndex
+
+SPECIALTIES = ['Cardiology', 'Dermatology', 'Neurology', 'Oncology', 'Pediatrics', 'Urology', 'Psychiatry',
+               'Radiology', 'Ophthalmology', 'Orthopedics']
+CITIES = ['London', 'Leeds', 'Manchester', 'Bristol', 'Liverpool', 'Glasgow', 'Cardiff', 'Belfast']
+
+
+def _word():
+    return ''.join(random.choices(string.ascii_lowercase, k=random.randint(4, 10))).title()
+
+
+def _doctors(count):
+    return [{'_id': ObjectId(), 'username': _word().lower(), 'first_name': _word(), 'last_name': _word(),
+             'specialty': random.choice(SPECIALTIES), 'hospital': f'{_word()} Hospital',
+             'gender': random.choice(['male', 'female']), 'address': {'city': random.choice(CITIES)}}
+            for _ in range(count)]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--doctors', type=int, default=2000)
+    parser.add_argument('--runs', type=int, default=500)
+    args = parser.parse_args()
+
+    doctors = _doctors(args.doctors)
+    index = DoctorSearchIndex()
+    started = time.perf_counter()
+    index.load(doctors)
+    print(f'loaded {args.doctors} doctors in {(time.perf_counter() - started) * 1000:.1f} ms')
+
+    searches = {
+        'name prefix': {'text': doctors[0]['last_name'][:3]},
+        'specialty typo': {'text': 'neurolgy'},
+        'facets only': {'filters': {'gender': ['female'], 'city': ['london']}},
+        'text + location + facet': {'text': 'cardio', 'location': 'manch', 'filters': {'gender': ['male']}},
+    }
+    for label, search in searches.items():
+        timings = []
+        for _ in range(args.runs):
+            started = time.perf_counter()
+            results = index.search(**search)
+            timings.append((time.perf_counter() - started) * 1000)
+        timings.sort()
+        print(f'{label:<24} {results["total"]:>5} results  median {statistics.median(timings):.3f} ms  '
+              f'p99 {timings[int(len(timings) * 0.99) - 1]:.3f} ms')
+
+    # Every prefix is new to the suggestion cache, as while a user is typing
+    for length in (1, 2, 3):
+        prefixes = {doctor['last_name'][:length] for doctor in doctors}
+        timings = []
+        for prefix in prefixes:
+            started = time.perf_counter()
+            index.suggest(prefix)
+            timings.append((time.perf_counter() - started) * 1000)
+        timings.sort()
+        print(f'typeahead, {length}-letter prefix   median {statistics.median(timings):.3f} ms  '
+              f'max {timings[-1]:.3f} ms')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,64 @@
+"""
+Overhead of the request metrics on a hello-world route.
+
+Serves the same route from two Flask apps, one with init_metrics() and one without, through
+the test client, and reports the median time per request of each. Also times a bare
+Histogram.observe() call. Needs no database.
+
+    python -m benchmarks.metrics_overhead --requests 20000
+"""
+import argparse
+import statistics
+import time
+
+from flask import Flask
+
+from app.metrics import Histogram, MetricsRegistry, init_metrics
+
+
+def _hello_app(with_metrics):
+    hello = Flask(__name__)
+    hello.add_url_rule('/', 'hello', lambda: 'Hello, World!')
+    if with_metrics:
+        registry = MetricsRegistry()
+        duration = registry.histogram('http_request_duration_seconds', 'Time spent handling requests.',
+                                      ('endpoint', 'method', 'status'))
+        init_metrics(hello, registry, duration)
+    return hello
+
+
+def _median_request_us(client, requests, rounds=5):
+    # The median of several rounds, so a stray pause in one round does not skew the result
+    per_round = []
+    for _ in range(rounds):
+        started = time.perf_counter()
+        for _ in range(requests // rounds):
+            client.get('/')
+        per_round.append((time.perf_counter() - started) / (requests // rounds) * 1e6)
+    return statistics.median(per_round)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--requests', type=int, default=20000)
+    args = parser.parse_args()
+
+    clients = {label: _hello_app(with_metrics).test_client()
+               for label, with_metrics in (('without metrics', False), ('with metrics', True))}
+    for client in clients.values():
+        client.get('/')
+    timings = {label: _median_request_us(client, args.requests) for label, client in clients.items()}
+    for label, per_request in timings.items():
+        print(f'{label:<16} {per_request:7.1f} us/request')
+    overhead = timings['with metrics'] - timings['without metrics']
+    print(f'overhead         {overhead:7.1f} us/request ({overhead / timings["without metrics"]:.1%})')
+
+    histogram = Histogram('observe_seconds', 'Observe benchmark.', ('endpoint', 'method', 'status'))
+    started = time.perf_counter()
+    for _ in range(args.requests):
+        histogram.observe(0.003, 'hello', 'GET', '200')
+    print(f'Histogram.observe {(time.perf_counter() - started) / args.requests * 1e9:6.0f} ns/call')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,78 @@
+"""
+Benchmark of model hydration cost and per-object memory.
+
+Hydrates synthetic doctor documents three ways: keeping the raw dict (what routes passed
+around before), an attribute-dict class built field by field (the previous models) and
+Doctor.from_document(). Reports the time per object and the memory each object adds on top
+of the field values it shares with the document. Needs no database.
+
+    python -m benchmarks.model_hydration --documents 20000
+"""
+import argparse
+import gc
+import time
+import tracemalloc
+
+from bson import ObjectId
+
+from app.models import Doctor
+
+
+class _AttributeDoctor:
+    # The previous model: a plain class with a per-instance __dict__, built field by field
+    def __init__(self, **fields):
+        for name, value in fields.items():
+            setattr(self, name, value)
+
+
+def _documents(count):
+    return [{'_id': ObjectId(), 'username': f'doctor{i}', 'first_name': 'Anna', 'last_name': f'Smith{i}',
+             'date_of_birth': '1980-01-01', 'gender': 'female', 'phone_number': f'0700{i:06d}', 'password': 'hash',
+             'address': {'street': '1 High St', 'city': 'London', 'country': 'UK', 'postcode': 'N1'},
+             'hospital': 'General Hospital', 'specialty': 'Cardiology', 'registration_status': 'approved',
+             'image_url': f'/static/uploads/{i}.jpg', 'biography': 'Consultant cardiologist.'}
+            for i in range(count)]
+
+
+def _hydrators():
+    return {
+        'raw dict': dict,
+        'attribute-dict class': lambda document: _AttributeDoctor(
+            **{name: document.get(name) for name in Doctor.fields + Doctor.lazy_fields}),
+        'Doctor.from_document': Doctor.from_document,
+    }
+
+
+def _measure(hydrate, documents):
+    # Collector pauses triggered by the allocations would otherwise dominate the timings
+    gc.collect()
+    gc.disable()
+    started = time.perf_counter()
+    objects = [hydrate(document) for document in documents]
+    elapsed = time.perf_counter() - started
+    gc.enable()
+    del objects
+
+    gc.collect()
+    tracemalloc.start()
+    objects = [hydrate(document) for document in documents]
+    allocated, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del objects
+    return elapsed / len(documents), allocated / len(documents)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--documents', type=int, default=20000)
+    args = parser.parse_args()
+
+    documents = _documents(args.documents)
+    print(f'{args.documents} doctor documents')
+    for label, hydrate in _hydrators().items():
+        per_object, memory = _measure(hydrate, documents)
+        print(f'{label:<22} {per_object * 1e6:6.2f} us/object  {memory:6.0f} bytes/object')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,57 @@
+"""
+Login throughput of password verification on the request thread versus the hashing pool.
+
+    python -m benchmarks.password_hashing --logins 200 --threads 8
+
+More threads than passwords.HASH_QUEUE_LIMIT make the pool turn logins away; those are
+counted as rejected rather than included in the throughput.
+"""
+import argparse
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from werkzeug.security import check_password_hash, generate_password_hash
+
+from app import passwords
+
+
+def _login(verify, stored_hash):
+    try:
+        return verify(stored_hash, 'correct horse')
+    except passwords.HashingBusyError:
+        return None
+
+
+def _throughput(verify, stored_hash, logins, threads):
+    """Return the successful logins per second and the number of logins turned away."""
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=threads) as executor:
+        results = list(executor.map(lambda _: _login(verify, stored_hash), range(logins)))
+    elapsed = time.perf_counter() - started
+    rejected = results.count(None)
+    assert all(result for result in results if result is not None)
+    return (logins - rejected) / elapsed, rejected
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--logins', type=int, default=200)
+    parser.add_argument('--threads', type=int, default=passwords.HASH_QUEUE_LIMIT,
+                        help='Concurrent request threads (default: the hashing queue limit)')
+    args = parser.parse_args()
+
+    cores = os.cpu_count() or 1
+    stored_hash = generate_password_hash('correct horse', passwords.PASSWORD_HASH_METHOD)
+
+    inline, _ = _throughput(check_password_hash, stored_hash, args.logins, args.threads)
+    pooled, rejected = _throughput(passwords.verify_password, stored_hash, args.logins, args.threads)
+
+    print(f"method={passwords.PASSWORD_HASH_METHOD} cores={cores} pool_workers={passwords.HASH_POOL_WORKERS}")
+    print(f"request thread: {inline:.1f} logins/s ({inline / cores:.1f} per core)")
+    print(f"hashing pool:   {pooled:.1f} logins/s ({pooled / cores:.1f} per core), "
+          f"{rejected} of {args.logins} rejected as busy")
+
+
+if __name__ == '__main__':
+    main()
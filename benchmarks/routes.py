@@ -0,0 +1,191 @@
+"""
+Latency, query and memory benchmark of every page and JSON route against a local mongod.
+
+Seed a database first, then point the app at it through MONGO_URI:
+
+    export MONGO_URI=mongodb://localhost:27017/AppointmentBenchmark
+    flask --app app seed --doctors 1000 --patients 100000 --appointments 1000000 --drop
+    python -m benchmarks.routes --runs 200
+    python -m benchmarks.routes --runs 200 --baseline benchmarks/results/routes-3655540.json
+
+Each route is requested through the Flask test client as a logged-in patient, doctor or admin.
+The p50/p99 latency comes from the timed runs; the MongoDB commands, time in the database and
+documents returned per request come from the X-Query-Stats header; the peak memory of one
+request is measured with tracemalloc in a separate pass, since tracing slows every allocation.
+Results are written to benchmarks/results/routes-<commit>.json so runs can be compared.
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import time
+import tracemalloc
+from datetime import datetime, timezone
+
+from app import app, mongo
+from app.page_cache import page_cache
+from app.query_stats import STATS_HEADER
+from app.seed import SEED_ADMIN_USERNAME
+
+RESULTS_DIR = os.path.join(os.path.dirname(__file__), 'results')
+
+# (name, who is logged in, URL); the URLs are formatted with the ids picked from the database
+ROUTES = [
+    ('home', None, '/'),
+    ('search_doctor', None, '/search_doctor'),
+    ('search_doctor name', None, '/search_doctor?name=smi'),
+    ('search_doctor specialty', None, '/search_doctor?specialty=Cardiology&gender=female'),
+    ('search_doctor/suggest', None, '/search_doctor/suggest?q=car'),
+    ('book_appointment', 'patient', '/book_appointment?doctor_id={doctor_id}'),
+    ('doctor_availability', None, '/doctor_availability/{doctor_id}?days=30'),
+    ('patient_dashboard', 'patient', '/patient_dashboard'),
+    ('doctor_dashboard', 'doctor', '/doctor_dashboard'),
+    ('doctor_appointment', 'doctor', '/doctor_appointment'),
+    ('doctor_profile_settings', 'doctor', '/doctor_profile_settings'),
+    ('admin_dashboard', 'admin', '/admin_dashboard'),
+    ('admin_appointments', 'admin', '/admin_appointments'),
+    ('admin_patients', 'admin', '/admin/patients'),
+    ('admin_doctors', 'admin', '/admin/doctors'),
+]
+
+
+def _commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                              check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return 'unknown'
+
+
+def _pick_ids(db):
+    # The busiest approved doctor and a patient with appointments, so the dashboards have rows to render
+    busiest = next(db.appointments.aggregate([
+        {'$group': {'_id': '$doctor_id', 'appointments': {'$sum': 1}}},
+        {'$sort': {'appointments': -1}},
+        {'$limit': 1},
+    ]), None)
+    if busiest is None:
+        raise SystemExit('The database has no appointments; run `flask --app app seed` first.')
+    appointment = db.appointments.find_one({'doctor_id': busiest['_id']}, {'patient_id': 1})
+    return {'doctor_id': str(busiest['_id']), 'patient_id': str(appointment['patient_id'])}
+
+
+def _client(role, ids):
+    client = app.test_client()
+    with client.session_transaction() as session:
+        if role == 'patient':
+            session['patient_id'] = ids['patient_id']
+        elif role == 'doctor':
+            session['doctor_id'] = ids['doctor_id']
+        elif role == 'admin':
+            session['_user_id'] = f'admin:{SEED_ADMIN_USERNAME}'
+            session['_fresh'] = True
+    return client
+
+
+def _percentile(timings, fraction):
+    return timings[max(int(len(timings) * fraction) - 1, 0)]
+
+
+def _parse_stats(header):
+    stats = dict(item.split('=') for item in header.split('; '))
+    return {name: float(value) for name, value in stats.items()}
+
+
+def benchmark_route(client, url, runs, warmup, cold):
+    """Time one route. Returns its latency percentiles, query stats and peak memory."""
+    for _ in range(warmup):
+        client.get(url)
+
+    timings = []
+    stats = []
+    status = None
+    for _ in range(runs):
+        if cold:
+            page_cache.clear()
+        started = time.perf_counter()
+        response = client.get(url)
+        timings.append((time.perf_counter() - started) * 1000)
+        status = response.status_code
+        stats.append(_parse_stats(response.headers[STATS_HEADER]))
+
+    if cold:
+        page_cache.clear()
+    tracemalloc.start()
+    client.get(url)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    timings.sort()
+    return {
+        'status': status,
+        'p50_ms': round(statistics.median(timings), 3),
+        'p99_ms': round(_percentile(timings, 0.99), 3),
+        'commands': statistics.median(item['commands'] for item in stats),
+        'db_ms': round(statistics.median(item['db_ms'] for item in stats), 3),
+        'documents': statistics.median(item['documents'] for item in stats),
+        'peak_kib': round(peak / 1024, 1),
+    }
+
+
+def _print_table(results, baseline):
+    print(f'{"route":<26} {"status":>6} {"p50 ms":>9} {"p99 ms":>9} {"cmds":>5} {"db ms":>8} {"docs":>7} '
+          f'{"peak KiB":>9}')
+    for name, result in results.items():
+        line = f'{name:<26} {result["status"]:>6} {result["p50_ms"]:>9.2f} {result["p99_ms"]:>9.2f} ' \
+               f'{result["commands"]:>5.0f} {result["db_ms"]:>8.2f} {result["documents"]:>7.0f} ' \
+               f'{result["peak_kib"]:>9.1f}'
+        before = baseline.get(name)
+        if before:
+            line += f'   p50 {result["p50_ms"] / before["p50_ms"] - 1:+.0%}, ' \
+                    f'cmds {result["commands"] - before["commands"]:+.0f}, ' \
+                    f'peak {result["peak_kib"] / before["peak_kib"] - 1:+.0%}'
+        print(line)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--runs', type=int, default=200)
+    parser.add_argument('--warmup', type=int, default=10)
+    parser.add_argument('--cold', action='store_true', help='Clear the page cache before every request')
+    parser.add_argument('--route', action='append', help='Only benchmark these routes; may be repeated')
+    parser.add_argument('--baseline', help='Results file of an earlier run to compare against')
+    parser.add_argument('--output', help='Where to write the results (default: benchmarks/results/routes-<commit>.json)')
+    args = parser.parse_args()
+
+    app.config['QUERY_STATS_HEADER'] = True
+    db = mongo.db
+    ids = _pick_ids(db)
+    clients = {role: _client(role, ids) for role in (None, 'patient', 'doctor', 'admin')}
+
+    results = {}
+    for name, role, url in ROUTES:
+        if args.route and name not in args.route:
+            continue
+        results[name] = benchmark_route(clients[role], url.format(**ids), args.runs, args.warmup, args.cold)
+
+    baseline = {}
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)['routes']
+    _print_table(results, baseline)
+
+    commit = _commit()
+    output = args.output or os.path.join(RESULTS_DIR, f'routes-{commit}{"-cold" if args.cold else ""}.json')
+    os.makedirs(os.path.dirname(output) or '.', exist_ok=True)
+    with open(output, 'w') as f:
+        json.dump({
+            'commit': commit,
+            'timestamp': datetime.now(timezone.utc).isoformat(timespec='seconds'),
+            'database': db.name,
+            'counts': {name: db[name].estimated_document_count() for name in ('doctors', 'patients', 'appointments')},
+            'runs': args.runs,
+            'cold': args.cold,
+            'routes': results,
+        }, f, indent=2)
+    print(f'Results written to {output}')
+
+
+if __name__ == '__main__':
+    main()
@@ -1,6 +1,9 @@
-
 # Script to run the Flask application
 from app import app
+from app.models import ensure_indexes
 
 if __name__ == '__main__':
+    # Create missing indexes and report drift before serving requests
+    with app.app_context():
+        ensure_indexes()
     app.run(debug=True)